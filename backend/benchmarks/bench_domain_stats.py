@@ -0,0 +1,90 @@
+"""
+Compare la construction de la liste des VMs :
+- méthode historique : listAllDomains() puis info() + state() par domaine
+- méthode groupée   : un seul getAllDomainStats(state | balloon | vcpu)
+
+Utilise le driver de test libvirt (aucun hyperviseur nécessaire) :
+
+    cd backend
+    python -m benchmarks.bench_domain_stats            # 10, 100, 1000 domaines
+    python -m benchmarks.bench_domain_stats 50 500     # tailles personnalisées
+
+Remarque : avec test:///default tout est en mémoire dans le processus, donc le
+gain mesuré ici est un minimum ; sur qemu+ssh:// chaque appel évité est un
+aller-retour réseau.
+"""
+import statistics
+import sys
+import time
+
+import libvirt
+
+from services import domain_stats
+
+
+DEFAULT_SIZES = (10, 100, 1000)
+REPEAT = 5
+
+DOMAIN_XML = """
+<domain type='test'>
+  <name>{name}</name>
+  <memory unit='MiB'>256</memory>
+  <vcpu>1</vcpu>
+  <os><type arch='x86_64'>hvm</type></os>
+</domain>
+"""
+
+
+def populate(conn, count):
+    """Définit et démarre des domaines bench-N jusqu'à en avoir count."""
+    existing = {d.name() for d in conn.listAllDomains()}
+    for i in range(count):
+        name = f"bench-{i}"
+        if name in existing:
+            continue
+        dom = conn.defineXML(DOMAIN_XML.format(name=name))
+        if i % 2 == 0:
+            dom.create()
+
+
+def per_domain(conn):
+    vms = []
+    for d in conn.listAllDomains():
+        info = d.info()
+        vms.append({
+            "name": d.name(),
+            "state": d.state()[0],
+            "memory": info[1] // 1024,
+            "vcpus": info[3],
+        })
+    return vms
+
+
+def bulk(conn):
+    records = domain_stats.collect(conn, domain_stats.SUMMARY_GROUPS)
+    return [domain_stats.summarize(dom, raw) for dom, raw in records]
+
+
+def measure(fn, conn):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(conn)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(sizes):
+    print(f"{'domaines':>9} {'par domaine (ms)':>17} {'groupé (ms)':>12} {'gain':>7}")
+    for size in sizes:
+        # test:///default repart de son état initial dès que plus aucune connexion n'est ouverte
+        conn = libvirt.open("test:///default")
+        populate(conn, size)
+        slow = measure(per_domain, conn)
+        fast = measure(bulk, conn)
+        conn.close()
+        print(f"{size:>9} {slow * 1000:>17.2f} {fast * 1000:>12.2f} {slow / fast:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
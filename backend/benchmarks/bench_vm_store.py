@@ -0,0 +1,82 @@
+"""
+Latence des recherches dans l'index SQL des VMs (services.vm_store) :
+10 000 VMs réparties sur 50 hôtes, 3 labels chacune.
+
+    cd backend
+    python -m benchmarks.bench_vm_store            # 10 000 VMs
+    python -m benchmarks.bench_vm_store 50000
+
+La base est un fichier SQLite temporaire (ORCH_DATABASE_URL est forcé avant
+l'import des modèles) : aucun hyperviseur ni aucune base existante ne sont touchés.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ["ORCH_DATABASE_URL"] = f"sqlite:///{_tmp.name}"
+
+from models.db import SessionLocal, VmLabel, VmRecord, init_db  # noqa: E402
+from services.vm_store import VmStore  # noqa: E402
+
+
+REPEAT = 200
+QUERIES = {
+    "label env=prod (page 1)": {"selector": "env=prod"},
+    "label env=prod,tier!=db": {"selector": "env=prod,tier!=db"},
+    "owner": {"owner": "user-7"},
+    "label + owner": {"selector": "team=team-3", "owner": "user-3"},
+    "page 50": {"page": 50},
+    "label env=prod + total": {"selector": "env=prod", "count": True},
+}
+
+
+def page_cursor(store, page, **params):
+    """Curseur de la page page (obtenu en suivant next_cursor depuis la première)."""
+    cursor = None
+    for _ in range(page - 1):
+        cursor = store.query(cursor=cursor, **params)["next_cursor"]
+    return cursor
+
+
+def populate(count):
+    with SessionLocal() as db:
+        for i in range(count):
+            vm = VmRecord(host=f"host-{i % 50}", name=f"vm-{i:06d}", state=1 + i % 5,
+                          memory=1024, vcpus=2, owner=f"user-{i % 20}")
+            vm.labels = [
+                VmLabel(key="env", value=("prod", "staging", "dev")[i % 3]),
+                VmLabel(key="tier", value=("web", "db", "cache", "batch")[i % 4]),
+                VmLabel(key="team", value=f"team-{i % 10}"),
+            ]
+            db.add(vm)
+        db.commit()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    init_db()
+    start = time.perf_counter()
+    populate(count)
+    print(f"{count} VMs indexées en {time.perf_counter() - start:.1f} s\n")
+
+    store = VmStore()
+    print(f"{'requête':<28}{'médiane (ms)':>14}{'p95 (ms)':>12}{'total':>8}")
+    for name, params in QUERIES.items():
+        params = dict(params)
+        cursor = page_cursor(store, params.pop("page", 1), limit=50, **params)
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            result = store.query(cursor=cursor, limit=50, **params)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{name:<28}{statistics.median(timings):>14.3f}"
+              f"{timings[int(len(timings) * 0.95)]:>12.3f}{result.get('total', '-'):>8}")
+    os.unlink(_tmp.name)
+
+
+if __name__ == "__main__":
+    main()
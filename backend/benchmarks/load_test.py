@@ -0,0 +1,454 @@
+"""
+Test de charge de l'API contre le driver de test libvirt (aucun hyperviseur) :
+clients concurrents sur la liste des VMs, le cycle de vie, les snapshots et
+les clones ; débit, latences p50/p95/p99 et pic de mémoire (RSS) du serveur.
+
+    cd backend
+    python -m benchmarks.load_test                         # 500 domaines, 16 clients, 10 s par scénario
+    python -m benchmarks.load_test --domains 5000 --concurrency 64
+    python -m benchmarks.load_test --scenarios list,list_etag
+    python -m benchmarks.load_test --save-baseline         # fige la référence
+
+Le serveur (uvicorn + main:app) tourne dans un processus à part, avec
+ORCH_LIBVIRT_URI=test:///default, une base SQLite et des répertoires d'images
+temporaires. Ses domaines (bench-00000...) sont définis au démarrage à partir
+d'un XML généré ; ils sont injectés dans test:///default plutôt que servis par
+un fichier test:///chemin.xml, car chaque connexion à un fichier repart de sa
+propre copie de l'état : le pool, le cache d'événements et les clients ne
+verraient pas les mêmes domaines.
+
+Résultats : benchmarks/results/load-<date>.json, comparés à
+benchmarks/results/baseline.json s'il existe (code de sortie 1 si régression
+au-delà de --tolerance).
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+
+SCENARIOS = ("list", "list_page", "list_etag", "lifecycle", "snapshot", "clone")
+
+DOMAIN_XML = """
+<domain type='test'>
+  <name>{name}</name>
+  <memory unit='MiB'>64</memory>
+  <vcpu>1</vcpu>
+  <os><type arch='x86_64'>hvm</type></os>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='{images}/{name}.qcow2'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <graphics type='vnc' port='-1'/>
+  </devices>
+</domain>
+"""
+
+# Sources des clones : seules VMs dont le disque existe vraiment (qemu-img).
+# VMs arrêtées (indices impairs) : un clone complet d'une VM active est refusé
+CLONE_SOURCES = 4
+
+
+def clone_source(i):
+    return f"bench-{2 * (i % CLONE_SOURCES) + 1:05d}"
+
+
+# ------------------------------------------------------------------ serveur
+
+def generate_domains(count, images):
+    """XML des domaines bench-NNNNN (un sur deux démarré par serve())."""
+    return [DOMAIN_XML.format(name=f"bench-{i:05d}", images=images) for i in range(count)]
+
+
+def serve(args):
+    """Processus serveur : peuple test:///default puis lance l'application."""
+    import libvirt
+    import uvicorn
+
+    # Connexion gardée ouverte : test:///default repart de zéro quand plus aucune ne l'est
+    conn = libvirt.open("test:///default")
+    for i, xml in enumerate(generate_domains(args.domains, os.environ["ORCH_IMAGES_DIR"])):
+        dom = conn.defineXML(xml)
+        if i % 2 == 0:
+            dom.create()
+
+    from main import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+    conn.close()
+
+
+def start_server(args, workdir):
+    images = os.path.join(workdir, "images")
+    for sub in ("images", "iso", "templates"):
+        os.makedirs(os.path.join(workdir, sub), exist_ok=True)
+    if shutil.which("qemu-img"):
+        for i in range(CLONE_SOURCES):
+            subprocess.run(
+                ["qemu-img", "create", "-q", "-f", "qcow2", os.path.join(images, f"{clone_source(i)}.qcow2"), "16M"],
+                check=True,
+            )
+
+    env = dict(
+        os.environ,
+        ORCH_LIBVIRT_URI="test:///default",
+        ORCH_DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        ORCH_IMAGES_DIR=images,
+        ORCH_ISO_DIR=os.path.join(workdir, "iso"),
+        ORCH_TEMPLATE_DIR=os.path.join(workdir, "templates"),
+        ORCH_HOST_MEMORY_RESERVE="0",
+    )
+    cmd = [sys.executable, "-m", "benchmarks.load_test", "--serve",
+           "--port", str(args.port), "--domains", str(args.domains)]
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(BENCH_DIR), env=env)
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté au démarrage (code {proc.returncode})")
+        try:
+            status, headers, _ = request(args.port, "GET", "/vms?limit=1")
+            # ETag présent : le cache d'événements est synchronisé
+            if status == 200 and "etag" in headers:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("Le serveur n'a pas démarré en 120 s")
+
+
+def peak_rss_mb(pid):
+    """VmHWM du processus (pic de mémoire résidente), en Mo."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# ------------------------------------------------------------------ clients
+
+def request(port, method, path, body=None, headers=None, conn=None):
+    """(statut, en-têtes en minuscules, corps). conn : connexion persistante du client."""
+    own = conn is None
+    conn = conn or http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+    finally:
+        if own:
+            conn.close()
+
+
+def form(**fields):
+    return urllib.parse.urlencode(fields), {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+class Client:
+    """Un client : connexion HTTP persistante, mesures par opération."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        self.timings = {}   # opération -> [secondes]
+        self.errors = {}    # opération -> nombre
+
+    def call(self, op, method, path, body=None, headers=None, expect=(200,), check_body=False):
+        start = time.perf_counter()
+        try:
+            status, response_headers, data = request(self.port, method, path, body, headers, conn=self.conn)
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+            status, response_headers, data = None, {}, b""
+        elapsed = time.perf_counter() - start
+        payload = None
+        failed = status not in expect
+        if not failed and check_body and data:
+            payload = json.loads(data)
+            failed = isinstance(payload, dict) and "error" in payload
+        self.timings.setdefault(op, []).append(elapsed)
+        if failed:
+            self.errors[op] = self.errors.get(op, 0) + 1
+        return status, response_headers, payload
+
+    def job(self, op, method, path, body=None, headers=None):
+        """Lance un job (202) et attend sa fin : la latence mesurée est celle de bout en bout."""
+        start = time.perf_counter()
+        status, _, payload = self.call(op + ".submit", method, path, body, headers, expect=(202,), check_body=True)
+        ok = status == 202 and payload and "job_id" in payload
+        while ok:
+            _, _, job = self.call(op + ".poll", "GET", f"/jobs/{payload['job_id']}", check_body=True)
+            if not job or job.get("state") in ("succeeded", "failed", "cancelled"):
+                ok = bool(job) and job["state"] == "succeeded" and not (
+                    isinstance(job.get("result"), dict) and "error" in job["result"]
+                )
+                break
+            time.sleep(0.02)
+        self.timings.setdefault(op, []).append(time.perf_counter() - start)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+
+def scenario_list(client, index, iteration, state):
+    client.call("GET /vms", "GET", "/vms")
+
+
+def scenario_list_page(client, index, iteration, state):
+    cursor = state.get("cursor")
+    path = "/vms?limit=50&fields=name,state" + (f"&cursor={cursor}" if cursor else "")
+    _, headers, _ = client.call("GET /vms?limit=50", "GET", path)
+    state["cursor"] = headers.get("x-next-cursor")
+
+
+def scenario_list_etag(client, index, iteration, state):
+    headers = {"If-None-Match": state["etag"]} if state.get("etag") else {}
+    _, response_headers, _ = client.call("GET /vms (If-None-Match)", "GET", "/vms", headers=headers, expect=(200, 304))
+    state["etag"] = response_headers.get("etag", state.get("etag"))
+
+
+def owned_vm(index, iteration, state):
+    """
+    VM démarrée au départ (indice pair) réservée au client index : les clients
+    se partagent les VMs démarrées sans jamais opérer sur la même.
+    """
+    running = (state["domains"] + 1) // 2
+    per_client = max(1, running // state["clients"])
+    slot = index + (iteration % per_client) * state["clients"]
+    return f"bench-{2 * (slot % running):05d}"
+
+
+def scenario_lifecycle(client, index, iteration, state):
+    vm = owned_vm(index, iteration, state)
+    client.call("suspend", "POST", f"/vms/{vm}/suspend", check_body=True)
+    client.call("resume", "POST", f"/vms/{vm}/suspend", check_body=True)
+    client.call("stop", "POST", f"/vms/{vm}/stop", check_body=True)
+    client.call("start", "POST", f"/vms/{vm}/start", check_body=True)
+
+
+def scenario_snapshot(client, index, iteration, state):
+    vm = owned_vm(index, 0, state)
+    name = f"bench-{index}-{iteration}"
+    body, headers = form(snapshot_name=name)
+    client.job("snapshot create", "POST", f"/vms/{vm}/snapshot/create", body, headers)
+    client.call("snapshot list", "GET", f"/vms/{vm}/snapshot/list", check_body=True)
+    body, headers = form(snapshot_name=name)
+    client.call("snapshot delete", "POST", f"/vms/{vm}/snapshot/delete", body, headers, check_body=True)
+
+
+def scenario_clone(client, index, iteration, state):
+    source = clone_source(index)
+    target = f"clone-{index}-{iteration}"
+    body, headers = form(source=source, target=target, mode="linked" if iteration % 2 else "full")
+    client.job("clone", "POST", "/vms/clone", body, headers)
+    client.call("delete", "DELETE", f"/vms/delete/{target}", check_body=True)
+
+
+def run_scenario(name, args):
+    func = globals()[f"scenario_{name}"]
+    clients = [Client(args.port) for _ in range(args.concurrency)]
+    stop = threading.Event()
+    counts = [0] * len(clients)
+
+    def worker(index):
+        state = {"clients": len(clients), "domains": max(args.domains, 1)}
+        iteration = 0
+        while not stop.is_set():
+            func(clients[index], index, iteration, state)
+            iteration += 1
+        counts[index] = iteration
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(clients))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    for op in sorted({op for c in clients for op in c.timings}):
+        timings = sorted(t for c in clients for t in c.timings.get(op, []))
+        errors = sum(c.errors.get(op, 0) for c in clients)
+        operations[op] = summarize(timings, errors, elapsed)
+    for client in clients:
+        client.conn.close()
+    return {"iterations": sum(counts), "elapsed": round(elapsed, 3), "operations": operations}
+
+
+def summarize(timings, errors, elapsed):
+    def quantile(q):
+        return round(timings[min(len(timings) - 1, int(q * len(timings)))] * 1000, 3) if timings else None
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "throughput": round(len(timings) / elapsed, 2),
+        "p50_ms": quantile(0.50),
+        "p95_ms": quantile(0.95),
+        "p99_ms": quantile(0.99),
+        "max_ms": round(timings[-1] * 1000, 3) if timings else None,
+    }
+
+
+# ------------------------------------------------------------- comparaison
+
+def compare(results, baseline, tolerance):
+    """Régressions par rapport à la référence : débit en baisse, p95/p99 ou RSS en hausse."""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(scenario)
+        if not reference or "operations" not in current:
+            continue
+        for op, stats in current["operations"].items():
+            ref = reference["operations"].get(op)
+            if not ref:
+                continue
+            if ref["throughput"] and stats["throughput"] < ref["throughput"] * (1 - tolerance):
+                regressions.append(f"{scenario} / {op} : débit {stats['throughput']} < {ref['throughput']} req/s")
+            for key in ("p95_ms", "p99_ms"):
+                # Plancher d'1 ms : en dessous, l'écart est du bruit
+                if ref[key] and stats[key] and stats[key] > max(ref[key] * (1 + tolerance), ref[key] + 1):
+                    regressions.append(f"{scenario} / {op} : {key} {stats[key]} > {ref[key]} ms")
+            if stats["errors"] > ref["errors"]:
+                regressions.append(f"{scenario} / {op} : {stats['errors']} erreurs (référence : {ref['errors']})")
+    rss, ref_rss = results.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if rss and ref_rss and rss > ref_rss * (1 + tolerance):
+        regressions.append(f"pic RSS {rss} > {ref_rss} Mo")
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'scénario / opération':<44} {'req':>7} {'err':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for scenario, result in results["scenarios"].items():
+        if "skipped" in result:
+            print(f"{scenario:<44} ignoré : {result['skipped']}")
+            continue
+        for op, s in result["operations"].items():
+            label = f"{scenario} / {op}"
+            print(f"{label:<44} {s['requests']:>7} {s['errors']:>5} {s['throughput']:>9.1f} "
+                  f"{s['p50_ms'] or 0:>9.2f} {s['p95_ms'] or 0:>9.2f} {s['p99_ms'] or 0:>9.2f}")
+    print(f"\npic RSS du serveur : {results['peak_rss_mb']} Mo")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BENCH_DIR,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API (driver de test libvirt)")
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="secondes par scénario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--output", default=None, help="fichier JSON des résultats")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="écart toléré avant de signaler une régression")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"scénario(s) inconnu(s) : {', '.join(unknown)} (disponibles : {', '.join(SCENARIOS)})")
+    args.port = args.port or free_port()
+
+    workdir = tempfile.mkdtemp(prefix="orch-bench-")
+    proc = start_server(args, workdir)
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "domains": args.domains,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in scenarios:
+            if scenario == "clone" and not shutil.which("qemu-img"):
+                results["scenarios"][scenario] = {"skipped": "qemu-img introuvable"}
+                continue
+            if scenario == "clone" and args.domains < 2 * CLONE_SOURCES:
+                results["scenarios"][scenario] = {"skipped": f"au moins {2 * CLONE_SOURCES} domaines nécessaires"}
+                continue
+            print(f"scénario {scenario}...", flush=True)
+            results["scenarios"][scenario] = run_scenario(scenario, args)
+        results["peak_rss_mb"] = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if results.get("peak_rss_mb") is None:
+        # Sans /proc : pic du plus gros processus enfant terminé (Ko sous Linux, octets sous macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        results["peak_rss_mb"] = round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    print_results(results)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("load-%Y%m%d-%H%M%S.json"))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"résultats : {output}")
+
+    if args.save_baseline:
+        shutil.copyfile(output, args.baseline)
+        print(f"référence enregistrée : {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("pas de référence (--save-baseline pour en créer une)")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} régression(s) par rapport à {args.baseline} :")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
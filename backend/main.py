@@ -1,6 +1,29 @@
-from fastapi import FastAPI
+import contextlib
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware  # ✅ ajout ici
-from routes import vms, hypervisors
+from fastapi.responses import PlainTextResponse
+from routes import vms, hypervisors, jobs, templates, isos, placement, rebalance, memory, debug
+from models.db import init_db
+from services.connection_pool import pool_manager
+from services.inventory import registry
+from services.placement import scheduler
+from services.rebalancer import rebalancer
+from services.balloon import balancer as balloon_balancer
+from services.snapshot_pruner import pruner as snapshot_pruner
+from services.warm_pool import warm_pool
+from services import metrics
+from services.perf import perf, instrument_libvirt
+from services.vm_store import vm_store
+from services import domain_cache
+from services.jobs import job_manager
+from services.template_service import template_store
+from utils import config
+
+if config.PERF_LIBVIRT:
+    # Chaque appel RPC libvirt est mesuré (voir /debug/perf)
+    instrument_libvirt()
 
 app = FastAPI(title="Mini Orchestrateur Hyperviseurs")
 
@@ -11,13 +34,98 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Inventory-Synced-At", "X-Inventory-Age", "X-Inventory-Stale", "X-Trace-Id",
+                    "ETag", "X-Next-Cursor"],
 )
 
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Latence de chaque route (par modèle de chemin) et trace optionnelle de la requête."""
+    tracing = config.PERF_TRACING or request.headers.get("x-trace") == "1"
+    scope = perf.trace(f"{request.method} {request.url.path}") if tracing else contextlib.nullcontext()
+    start = time.perf_counter()
+    status = 500
+    with scope as trace:
+        try:
+            with perf.track("http"):
+                response = await call_next(request)
+            status = response.status_code
+        finally:
+            route = request.scope.get("route")
+            # Modèle de chemin (/vms/{name}/start) : une série par route, pas par VM
+            path = route.path if route is not None else "non routée"
+            perf.observe(f"http.{request.method} {path}", time.perf_counter() - start, error=status >= 500)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+    return response
+
 # ✅ Inclusion des routes
 app.include_router(vms.router, prefix="/vms", tags=["VMs"])
 app.include_router(hypervisors.router, prefix="/hypervisors", tags=["Hyperviseurs"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
+app.include_router(templates.router, prefix="/templates", tags=["Templates"])
+app.include_router(isos.router, prefix="/isos", tags=["ISO"])
+app.include_router(placement.router, prefix="/placement", tags=["Placement"])
+app.include_router(rebalance.router, prefix="/rebalance", tags=["Rééquilibrage"])
+app.include_router(memory.router, prefix="/memory", tags=["Mémoire"])
+app.include_router(debug.router, prefix="/debug", tags=["Debug"])
 
 @app.get("/")
 def root():
     return {"message": "Orchestrateur d'hyperviseurs en ligne"}
 
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Exposition Prometheus des métriques des VMs et des latences (routes, service, libvirt)."""
+    return PlainTextResponse(
+        metrics.render_prometheus(metrics.collector) + perf.render_prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.on_event("startup")
+def start_background_services():
+    init_db()
+    # Caches d'état de chaque hyperviseur enregistré (l'hôte local est ajouté au premier démarrage)
+    registry.start()
+    # Index de capacité des hôtes pour le placement des nouvelles VMs
+    scheduler.start()
+    # Mesure de la pression des hôtes (et rééquilibrage si ORCH_REBALANCE_AUTO=1)
+    rebalancer.start()
+    # Cibles balloon des VMs actives (appliquées si ORCH_BALLOON_AUTO=1)
+    balloon_balancer.start()
+    # Métriques de performance des VMs (CPU, mémoire, disque, réseau)
+    metrics.collector.start()
+    # Index SQL des VMs (labels, propriétaires) + historique des opérations
+    vm_store.start()
+    vms.aservice.add_listener(vm_store.record_call)
+    # Une VM supprimée quitte ses groupes d'anti-affinité
+    vms.aservice.add_listener(scheduler.record_call)
+    job_manager.add_listener(vm_store.record_job)
+    # Rétention des snapshots (label snapshot.keep, ORCH_SNAPSHOT_KEEP)
+    snapshot_pruner.start()
+    # Table d'état des domaines alimentée par les événements libvirt
+    domain_cache.get_domain_cache(config.LIBVIRT_URI).start()
+    # Maintien des pools chauds d'overlays des templates
+    template_store.start()
+    # VMs pré-démarrées et en pause des templates (vm_pool_size)
+    warm_pool.start()
+
+
+@app.on_event("shutdown")
+def stop_background_services():
+    vms.aservice.shutdown()
+    job_manager.shutdown()
+    snapshot_pruner.stop()
+    vm_store.stop()
+    metrics.collector.stop()
+    rebalancer.stop()
+    balloon_balancer.stop()
+    scheduler.stop()
+    registry.shutdown()
+    template_store.stop()
+    warm_pool.stop()
+    domain_cache.stop_all()
+    pool_manager.close_all()
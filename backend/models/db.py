@@ -0,0 +1,137 @@
+import time
+
+from sqlalchemy import (
+    Boolean, Column, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint, create_engine,
+)
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+
+from utils import config
+
+
+engine = create_engine(
+    config.DATABASE_URL,
+    # SQLite : la session peut être utilisée depuis les threads de FastAPI
+    connect_args={"check_same_thread": False} if config.DATABASE_URL.startswith("sqlite") else {},
+)
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
+
+
+class Hypervisor(Base):
+    __tablename__ = "hypervisors"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(128), unique=True, nullable=False, index=True)
+    uri = Column(String(512), unique=True, nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    # Délai max d'une requête groupée sur cet hôte (secondes)
+    timeout = Column(Float, nullable=False, default=5.0)
+    # Taille du pool de connexions libvirt vers cet hôte
+    pool_size = Column(Integer, nullable=False, default=4)
+    description = Column(String(512), nullable=False, default="")
+    created_at = Column(Float, nullable=False, default=time.time)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "uri": self.uri,
+            "enabled": self.enabled,
+            "timeout": self.timeout,
+            "pool_size": self.pool_size,
+            "description": self.description,
+            "created_at": self.created_at,
+        }
+
+
+class AntiAffinityMember(Base):
+    """Appartenance d'une VM à un groupe d'anti-affinité (deux membres jamais sur le même hôte)."""
+
+    __tablename__ = "anti_affinity_members"
+    __table_args__ = (UniqueConstraint("group", "vm"),)
+
+    id = Column(Integer, primary_key=True)
+    group = Column(String(128), nullable=False, index=True)
+    vm = Column(String(128), nullable=False)
+
+
+class VmRecord(Base):
+    """Index des VMs de tous les hyperviseurs, tenu à jour depuis libvirt (événements + réconciliation)."""
+
+    __tablename__ = "vms"
+    __table_args__ = (
+        UniqueConstraint("host", "name"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    host = Column(String(128), nullable=False)
+    name = Column(String(128), nullable=False, index=True)
+    state = Column(Integer, nullable=False, default=0, index=True)
+    memory = Column(Integer, nullable=False, default=0)   # Mo
+    vcpus = Column(Integer, nullable=False, default=0)
+    owner = Column(String(128), index=True)
+    created_at = Column(Float, nullable=False, default=time.time)
+    updated_at = Column(Float, nullable=False, default=time.time, onupdate=time.time)
+
+    labels = relationship(
+        "VmLabel", cascade="all, delete-orphan", lazy="selectin", back_populates="vm",
+    )
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "host": self.host,
+            "state": self.state,
+            "memory": self.memory,
+            "vcpus": self.vcpus,
+            "owner": self.owner,
+            "labels": {label.key: label.value for label in self.labels},
+            "updated_at": self.updated_at,
+        }
+
+
+class VmLabel(Base):
+    __tablename__ = "vm_labels"
+    __table_args__ = (
+        UniqueConstraint("vm_id", "key"),
+        # Sélecteurs env=prod : recherche par (clé, valeur) puis jointure sur vm_id
+        Index("ix_vm_labels_key_value", "key", "value", "vm_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    vm_id = Column(Integer, ForeignKey("vms.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(64), nullable=False)
+    value = Column(String(255), nullable=False)
+
+    vm = relationship("VmRecord", back_populates="labels")
+
+
+class Operation(Base):
+    """Historique des opérations (ajout seulement, jamais modifié)."""
+
+    __tablename__ = "operations"
+    __table_args__ = (Index("ix_operations_vm_time", "vm", "created_at"),)
+
+    id = Column(Integer, primary_key=True)
+    vm = Column(String(128), nullable=False)
+    host = Column(String(128))
+    action = Column(String(64), nullable=False, index=True)
+    status = Column(String(32), nullable=False)
+    detail = Column(Text)
+    job_id = Column(String(32), index=True)
+    created_at = Column(Float, nullable=False, default=time.time, index=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "vm": self.vm,
+            "host": self.host,
+            "action": self.action,
+            "status": self.status,
+            "detail": self.detail,
+            "job_id": self.job_id,
+            "created_at": self.created_at,
+        }
+
+
+def init_db():
+    Base.metadata.create_all(engine)
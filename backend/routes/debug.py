@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Query
+from services.console_proxy import console_proxy
+from services.domain_xml import domain_xml
+from services.perf import perf
+
+router = APIRouter()
+
+
+@router.get("/perf")
+def perf_summary(
+    prefix: str = Query(None, description="http., service. ou libvirt. pour filtrer"),
+    traces: int = Query(10, description="nombre de traces renvoyées"),
+    slowest: bool = Query(False, description="les plus lentes plutôt que les plus récentes"),
+):
+    """
+    Où passe le temps : latences (moyenne, p50/p95/p99, max), erreurs et
+    exécutions en cours par route HTTP, méthode de LibvirtService et appel libvirt,
+    triées par temps cumulé. Les traces relient une requête à ses appels libvirt
+    (ORCH_PERF_TRACING=1, ou en-tête X-Trace: 1 sur la requête).
+    """
+    return {
+        "since": perf.started_at,
+        "operations": perf.summary(prefix),
+        "traces": perf.traces(traces, slowest=slowest),
+    }
+
+
+@router.get("/domain-xml")
+def domain_xml_cache():
+    """Cache des descriptions XML analysées : taille, succès, échecs, entrées périmées et évincées."""
+    return domain_xml.stats()
+
+
+@router.get("/consoles")
+def console_sessions():
+    """Proxy des consoles : sessions ouvertes (octets, latence de relais, temps bridé), refus et fermetures."""
+    return console_proxy.stats()
@@ -1,10 +1,89 @@
-from fastapi import APIRouter
-from services.libvirt_service import LibvirtService
+from fastapi import APIRouter, Form, HTTPException
+from fastapi.responses import JSONResponse
+from services.connection_pool import pool_manager
+from services.inventory import registry
 
 router = APIRouter()
-service = LibvirtService()
+
 
 @router.get("/")
 def list_hypervisors():
-    # Ici, on pourrait gérer plusieurs hyperviseurs via une base de données
-    return {"hypervisors": [service.uri]}
+    """Hyperviseurs enregistrés (table hypervisors) avec leurs paramètres de connexion."""
+    return {"hypervisors": registry.list()}
+
+
+@router.post("/")
+def add_hypervisor(
+    name: str = Form(...),
+    uri: str = Form(...),
+    timeout: float = Form(None),
+    pool_size: int = Form(None),
+    enabled: bool = Form(True),
+    description: str = Form(""),
+):
+    """
+    Enregistre un hyperviseur (ex: uri = qemu+ssh://user@hote/system).
+    timeout   : délai max de réponse de cet hôte dans les requêtes groupées (s)
+    pool_size : nombre max de connexions libvirt ouvertes vers cet hôte
+    """
+    if timeout is not None and timeout <= 0:
+        return JSONResponse(status_code=400, content={"error": "timeout doit être > 0"})
+    if pool_size is not None and pool_size < 1:
+        return JSONResponse(status_code=400, content={"error": "pool_size doit être >= 1"})
+    result = registry.add(name, uri, timeout=timeout, pool_size=pool_size, enabled=enabled, description=description)
+    if "error" in result:
+        return JSONResponse(status_code=400, content={"error": result["error"]})
+    return result
+
+
+@router.get("/vms")
+def list_cluster_vms():
+    """
+    Toutes les VMs de tous les hyperviseurs actifs, interrogés en parallèle.
+    Un hôte qui ne répond pas dans son délai est marqué "timeout" dans hosts
+    et la réponse est renvoyée quand même (partial = true).
+    """
+    return registry.cluster_vms()
+
+
+@router.get("/pool")
+def connection_pool_stats():
+    """
+    Statistiques des pools de connexions libvirt (une entrée par URI) :
+    connexions ouvertes / libres / prêtées, réutilisations, reconnexions...
+    """
+    return {"pools": pool_manager.stats()}
+
+
+@router.get("/{name}")
+def get_hypervisor(name: str):
+    host = registry.get(name)
+    if host is None:
+        raise HTTPException(status_code=404, detail=f"Hyperviseur {name} introuvable")
+    return host
+
+
+@router.patch("/{name}")
+def update_hypervisor(
+    name: str,
+    timeout: float = Form(None),
+    pool_size: int = Form(None),
+    enabled: bool = Form(None),
+    description: str = Form(None),
+):
+    if timeout is not None and timeout <= 0:
+        return JSONResponse(status_code=400, content={"error": "timeout doit être > 0"})
+    if pool_size is not None and pool_size < 1:
+        return JSONResponse(status_code=400, content={"error": "pool_size doit être >= 1"})
+    result = registry.update(name, timeout=timeout, pool_size=pool_size, enabled=enabled, description=description)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@router.delete("/{name}")
+def delete_hypervisor(name: str):
+    result = registry.remove(name)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
@@ -0,0 +1,140 @@
+import re
+
+from fastapi import APIRouter, Form, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from services.iso_store import iso_store
+from utils import config
+
+router = APIRouter()
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+async def store_stream(upload_id, chunks, offset):
+    """
+    Écrit un flux asynchrone d'octets dans une session d'upload, par blocs de
+    ISO_CHUNK_SIZE (écriture et hash dans le threadpool, hors boucle asyncio).
+    Renvoie le résultat du dernier write_chunk ({"offset": ...} ou {"error": ...}).
+    """
+    buffer = bytearray()
+    result = {"offset": offset}
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= config.ISO_CHUNK_SIZE:
+            result = await run_in_threadpool(iso_store.write_chunk, upload_id, result["offset"], bytes(buffer))
+            buffer.clear()
+            if "error" in result:
+                return result
+    if buffer:
+        result = await run_in_threadpool(iso_store.write_chunk, upload_id, result["offset"], bytes(buffer))
+    return result
+
+
+async def store_upload_file(upload):
+    """
+    Range un UploadFile (formulaire multipart) dans le stockage des ISO,
+    lu par blocs : l'ISO n'est jamais chargée entièrement en mémoire.
+    Renvoie {"iso": ...} ou {"error": ...}.
+    """
+    async def chunks():
+        while True:
+            chunk = await upload.read(config.ISO_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    session = iso_store.start_upload(upload.filename)
+    result = await store_stream(session["upload_id"], chunks(), 0)
+    if "error" in result:
+        iso_store.abort_upload(session["upload_id"])
+        return result
+    return await run_in_threadpool(iso_store.finish_upload, session["upload_id"])
+
+
+@router.get("/")
+def list_isos():
+    """ISO déjà présentes : réutilisables via iso_id dans POST /vms/create, sans nouvel upload."""
+    return {"isos": iso_store.list()}
+
+
+@router.get("/{sha256}")
+def get_iso(sha256: str):
+    iso = iso_store.get(sha256)
+    if iso is None:
+        raise HTTPException(status_code=404, detail=f"ISO {sha256} introuvable")
+    return iso
+
+
+@router.delete("/{sha256}")
+def delete_iso(sha256: str):
+    result = iso_store.delete(sha256)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@router.post("/uploads")
+def start_upload(
+    filename: str = Form(...),
+    size: int = Form(None, description="taille totale en octets"),
+    sha256: str = Form(None, description="si déjà connue, une ISO identique n'est pas ré-envoyée"),
+):
+    """
+    Ouvre un upload reprenable. Réponse status=exists : l'ISO est déjà stockée,
+    rien à envoyer. Sinon, envoyer les blocs avec PUT /isos/uploads/{upload_id}.
+    """
+    return iso_store.start_upload(filename, size=size, sha256=sha256)
+
+
+@router.get("/uploads/{upload_id}")
+def upload_status(upload_id: str):
+    """Position actuelle : c'est là qu'il faut reprendre après une coupure."""
+    status = iso_store.upload_status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} introuvable")
+    return status
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(None, description="position du bloc (sinon Content-Range, sinon la fin actuelle)"),
+    content_range: str = Header(None),
+):
+    """
+    Corps de la requête = octets bruts, écrits en flux sur disque.
+    La position vient de ?offset= ou de Content-Range: bytes début-fin/total.
+    """
+    status = iso_store.upload_status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} introuvable")
+
+    if offset is None and content_range:
+        match = CONTENT_RANGE.fullmatch(content_range.strip())
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Content-Range invalide : {content_range}")
+        offset = int(match.group(1))
+    if offset is None:
+        offset = status["offset"]
+
+    result = await store_stream(upload_id, request.stream(), offset)
+    if "error" in result:
+        raise HTTPException(status_code=409, detail=result)
+    return result
+
+
+@router.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str):
+    result = iso_store.finish_upload(upload_id)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    result = iso_store.abort_upload(upload_id)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Query
+from services.jobs import job_manager
+
+router = APIRouter()
+
+
+@router.get("/")
+def list_jobs(
+    state: str = Query(None, description="pending, running, succeeded, failed, cancelled"),
+    kind: str = Query(None, description="create, clone, migrate, snapshot..."),
+    target: str = Query(None, description="nom de la VM"),
+):
+    return {"jobs": [j.to_dict() for j in job_manager.list(state=state, kind=kind, target=target)]}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} introuvable")
+    return job.to_dict()
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str):
+    result = job_manager.cancel(job_id)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
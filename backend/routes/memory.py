@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Query
+from services.balloon import balancer
+
+router = APIRouter()
+
+
+@router.get("/")
+def memory_status():
+    """
+    Mémoire libre de chaque hôte et, par VM active : mémoire actuelle (balloon),
+    utilisée par l'invité, bornes min/max, cible et décisions du dernier passage.
+    """
+    return balancer.status()
+
+
+@router.post("/balance")
+def balance_memory(dry_run: bool = Query(True, description="renvoie les décisions sans appliquer setMemory")):
+    """
+    Recalcule tout de suite les cibles balloon de toutes les VMs actives.
+    Bornes par VM : labels memory.min / memory.max (Mo).
+    """
+    return balancer.run(dry_run=dry_run)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Form, HTTPException
+from services.placement import scheduler, STRATEGIES
+
+router = APIRouter()
+
+
+@router.get("/capacity")
+def capacity():
+    """
+    Index de capacité des hyperviseurs : mémoire libre, vCPUs alloués / capacité
+    (avec surallocation), espace libre du pool de stockage, charge CPU, réservations.
+    """
+    return {"strategies": list(STRATEGIES), "hosts": scheduler.capacity()}
+
+
+@router.post("/refresh")
+def refresh_capacity():
+    """Relève immédiatement tous les hyperviseurs (sinon toutes les PLACEMENT_REFRESH secondes)."""
+    scheduler.refresh()
+    return {"hosts": scheduler.capacity()}
+
+
+@router.get("/groups")
+def list_groups():
+    """Groupes d'anti-affinité : deux VMs d'un même groupe ne sont jamais placées sur le même hôte."""
+    return {"groups": scheduler.groups()}
+
+
+@router.post("/groups/{group}")
+def add_group_member(group: str, vm: str = Form(...)):
+    return scheduler.add_to_group(group, vm)
+
+
+@router.delete("/groups/{group}/{vm}")
+def remove_group_member(group: str, vm: str):
+    result = scheduler.remove_from_group(group, vm)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
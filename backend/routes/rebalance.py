@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException, Query
+from services.placement import scheduler
+from services.rebalancer import rebalancer
+from utils import config
+
+router = APIRouter()
+
+
+@router.get("/")
+def rebalance_status():
+    """Pression CPU / mémoire moyenne par hôte, seuils, dernier plan calculé."""
+    return {
+        "auto": config.REBALANCE_AUTO,
+        "thresholds": {
+            "cpu": config.REBALANCE_CPU_THRESHOLD,
+            "memory": config.REBALANCE_MEMORY_THRESHOLD,
+            "margin": config.REBALANCE_MARGIN,
+        },
+        "pressure": rebalancer.pressure(),
+        "cordoned": [h["name"] for h in scheduler.capacity() if h["cordoned"]],
+        "last_plan": rebalancer.last_plan,
+    }
+
+
+@router.post("/run")
+def run_rebalance(dry_run: bool = Query(True, description="renvoie le plan sans lancer les migrations")):
+    """
+    Calcule les migrations qui ramènent les points chauds sous le seuil cible.
+    Avec dry_run=false, les migrations sont lancées (jobs, voir GET /jobs).
+    """
+    return rebalancer.run(dry_run=dry_run)
+
+
+@router.post("/drain/{host}")
+def drain_host(host: str, dry_run: bool = Query(False)):
+    """
+    Maintenance : l'hôte ne reçoit plus de VMs et ses VMs actives sont migrées
+    en parallèle vers les autres hôtes. Voir POST /rebalance/uncordon/{host} pour le réactiver.
+    """
+    result = rebalancer.drain(host, dry_run=dry_run)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@router.post("/uncordon/{host}")
+def uncordon_host(host: str):
+    scheduler.uncordon(host)
+    return {"message": f"Hyperviseur {host} de nouveau disponible pour le placement"}
@@ -0,0 +1,84 @@
+from fastapi import APIRouter, Form, HTTPException
+from services.template_service import template_store
+from services.warm_pool import warm_pool
+
+router = APIRouter()
+
+
+@router.get("/")
+def list_templates():
+    pools = warm_pool.status()
+    return {"templates": [dict(t, warm_vms=pools.get(t["name"])) for t in template_store.list()]}
+
+
+@router.post("/")
+def register_template(
+    name: str = Form(...),
+    path: str = Form(..., description="qcow2 déjà installé et préparé, sur l'hyperviseur"),
+    description: str = Form(""),
+    pool_size: int = Form(0, description="nombre d'overlays pré-créés à garder prêts"),
+    vm_pool_size: int = Form(0, description="nombre de VMs pré-démarrées et en pause à garder prêtes"),
+    vm_memory: int = Form(1024, description="mémoire des VMs pré-démarrées (Mo)"),
+    vm_vcpus: int = Form(1, description="vCPUs des VMs pré-démarrées"),
+    copy: bool = Form(False, description="copier l'image dans TEMPLATE_DIR (lecture seule) au lieu de l'utiliser en place"),
+):
+    result = template_store.register(
+        name, path, description=description, pool_size=pool_size,
+        vm_pool_size=vm_pool_size, vm_memory=vm_memory, vm_vcpus=vm_vcpus, copy=copy,
+    )
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    warm_pool.refill()
+    return result
+
+
+@router.get("/{name}")
+def get_template(name: str):
+    template = template_store.get(name)
+    if template is None:
+        raise HTTPException(status_code=404, detail=f"Template {name} introuvable")
+    return dict(template, warm_vms=warm_pool.status().get(name))
+
+
+@router.patch("/{name}")
+def update_template(
+    name: str,
+    description: str = Form(None),
+    pool_size: int = Form(None),
+    vm_pool_size: int = Form(None),
+    vm_memory: int = Form(None),
+    vm_vcpus: int = Form(None),
+):
+    result = template_store.update(
+        name, description=description, pool_size=pool_size,
+        vm_pool_size=vm_pool_size, vm_memory=vm_memory, vm_vcpus=vm_vcpus,
+    )
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    warm_pool.refill()
+    return result
+
+
+@router.delete("/{name}")
+def delete_template(name: str):
+    result = template_store.delete(name)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    # Les VMs pré-démarrées du template sont supprimées au prochain passage
+    warm_pool.refill()
+    return result
+
+
+@router.post("/{name}/claim")
+def claim_warm_vm(name: str, owner: str = Form(None)):
+    """
+    Prend une VM pré-démarrée (en pause) du template et la reprend : disponible
+    immédiatement, sans démarrage de l'OS. La VM garde son nom (renvoyé dans "name").
+    """
+    if template_store.get(name) is None:
+        raise HTTPException(status_code=404, detail=f"Template {name} introuvable")
+    result = warm_pool.claim(name, owner=owner)
+    if "error" in result:
+        # Pool vide ou VM non réétiquetée : le client peut réessayer ou créer la VM classiquement
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
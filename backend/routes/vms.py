@@ -1,18 +1,196 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import JSONResponse
-from services.libvirt_service import LibvirtService
-import os
+import asyncio
+
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query, Request, Response, Header, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.libvirt_service import LibvirtService, CLONE_MODES, STOP_MODES
+from services.async_service import AsyncLibvirtService
+from services.domain_cache import get_domain_cache
+from services.event_stream import vm_event_stream
+from services.jobs import job_manager
+from services.migration import build_migration
+from services.template_service import template_store
+from routes.isos import store_upload_file
+from services.iso_store import iso_store
+from services.inventory import registry
+from services.placement import scheduler
+from services.metrics import collector, parse_range
+from services import domain_profiles
+from services import inventory_view
+from services import labels as vm_labels
+from services.batch import ACTIONS, run_batch
+from services import console_proxy as proxy
+from services.console_proxy import console_proxy
+from services.snapshots import SNAPSHOT_MODES
+from schemas.vm_schema import BatchRequest, LabelsUpdate, SnapshotBulkDelete
+from services.vm_store import vm_store
+from utils import config
 
 router = APIRouter()
 service = LibvirtService()
+# Les opérations de cycle de vie passent par un pool de threads dédié et borné
+aservice = AsyncLibvirtService(service)
+
+
+def target_service(host: str = Query(None, description="hyperviseur cible (voir GET /hypervisors)")):
+    """Service libvirt de l'hyperviseur demandé (?host=), l'hyperviseur par défaut sinon."""
+    if host is None:
+        return service
+    target = registry.service(host)
+    if target is None:
+        raise HTTPException(status_code=404, detail=f"Hyperviseur {host} introuvable")
+    return target
+
 
-# Dossier où enregistrer les ISO
-UPLOAD_DIR = "/var/lib/libvirt/iso_uploads"
+def submit_job(kind, target, func, storage_pool=None, params=None, hypervisor=None):
+    """
+    Lance une opération longue en arrière-plan et répond tout de suite (202)
+    avec l'identifiant du job à suivre sur GET /jobs/{id}.
+    """
+    job = job_manager.submit(
+        kind, target, func,
+        hypervisor=hypervisor or service.uri,
+        storage_pool=storage_pool,
+        params=params,
+    )
+    return JSONResponse(status_code=202, content={
+        "message": f"Opération {kind} sur {target} lancée (job {job.id})",
+        "job_id": job.id,
+    })
 
 
 @router.get("/")
-def list_vms():
-    return service.list_vms()
+def list_vms(
+    request: Request,
+    label: str = Query(None, description="sélecteur de labels : env=prod,tier!=db"),
+    owner: str = Query(None),
+    index: bool = Query(False, description="recherche dans l'index SQL de tous les hyperviseurs"),
+    count: bool = Query(False, description="ajoute le total (index SQL seulement)"),
+    limit: int = Query(None, ge=1, le=1000, description="taille de page (pagination par curseur)"),
+    cursor: str = Query(None, description="valeur de X-Next-Cursor de la page précédente"),
+    state: str = Query(None, description="running, shutoff, paused... ou code numérique"),
+    prefix: str = Query(None, description="préfixe du nom"),
+    fields: str = Query(None, description="ex: name,state (tous par défaut)"),
+    if_none_match: str = Header(None),
+    host_service: LibvirtService = Depends(target_service),
+):
+    """
+    Sans label/owner/index : VMs de l'hyperviseur (cache d'événements), avec
+    filtres, projection, pagination par curseur et ETag (304 si rien n'a changé).
+    Avec label, owner ou index : recherche dans l'index SQL de tous les hyperviseurs,
+    paginée par curseur (next_cursor, repris aussi dans X-Next-Cursor).
+    """
+    try:
+        state_code = inventory_view.parse_state(state)
+        projection = inventory_view.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if label or owner or index:
+        try:
+            result = vm_store.query(
+                selector=label,
+                owner=owner,
+                state=state_code,
+                host=request.query_params.get("host"),
+                name_prefix=prefix,
+                cursor=cursor,
+                limit=limit or 50,
+                count=count,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": result["next_cursor"]} if result["next_cursor"] else {}
+        return JSONResponse(content=result, headers=headers)
+
+    try:
+        after = inventory_view.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cache = get_domain_cache(host_service.uri)
+    if not cache.ready:
+        # Cache pas encore synchronisé : lecture directe depuis libvirt
+        vms = host_service.list_vms()
+        if isinstance(vms, dict):
+            return vms
+        vms = sorted(vms, key=lambda vm: vm["name"])
+        body, next_cursor = _render_page(
+            vms, [vm["name"] for vm in vms], state_code, prefix, after, limit, projection,
+        )
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    seq, vms, names = cache.view()
+    # La génération du cache identifie exactement son contenu : même ETag, même réponse
+    etag = f'W/"{cache.epoch}-{seq}"'
+    status = cache.status()
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Inventory-Synced-At": str(status["synced_at"]),
+        "X-Inventory-Age": "%.3f" % status["age"],
+        "X-Inventory-Stale": "1" if status["stale"] else "0",
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    key = (host_service.uri, cache.epoch, seq, state_code, prefix, after, limit, projection)
+    body, next_cursor = _rendered.get_or_render(key, lambda: _render_page(
+        vms, names, state_code, prefix, after, limit, projection,
+    ))
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Pages déjà sérialisées par (hyperviseur, génération du cache, paramètres)
+_rendered = inventory_view.RenderCache()
+
+
+def _render_page(vms, names, state, prefix, after, limit, fields):
+    items, last = inventory_view.select(vms, names, state, prefix, after, limit, fields)
+    return inventory_view.render(items, inventory_view.encode_cursor(last) if last else None)
+
+
+@router.get("/stats")
+def domain_stats(
+    fields: str = Query(None, description="ex: state,balloon,cpu (tous par défaut)"),
+    host_service: LibvirtService = Depends(target_service),
+):
+    """
+    Statistiques de tous les domaines en un seul appel libvirt (getAllDomainStats).
+    Groupes : state, balloon, vcpu, cpu, block, interface.
+    """
+    result = host_service.domain_stats(fields)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
+@router.get("/events")
+async def vm_events(
+    request: Request,
+    since: str = Query(None, description="jeton de reprise (id du dernier événement reçu)"),
+    last_event_id: str = Header(None),
+    host_service: LibvirtService = Depends(target_service),
+):
+    """
+    Flux Server-Sent Events : snapshot initial puis uniquement les diffs
+    (VM ajoutée / supprimée / changement d'état), avec heartbeat.
+    Remplace le polling de GET /vms.
+    """
+    cache = get_domain_cache(host_service.uri)
+    return StreamingResponse(
+        vm_event_stream(cache, request, since or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache")
+def domain_cache_status(host_service: LibvirtService = Depends(target_service)):
+    """Fraîcheur du cache d'état des domaines (connexion d'événements, dernière resync...)."""
+    return get_domain_cache(host_service.uri).status()
 
 
 @router.post("/create")
@@ -20,112 +198,457 @@ async def create_vm(
     name: str = Form(...),
     memory: int = Form(None),
     disk_size: int = Form(10),
-    iso: UploadFile = File(None)
+    iso: UploadFile = File(None),
+    iso_id: str = Form(None),
+    template: str = Form(None),
+    vcpus: int = Form(None),
+    profile: str = Form(None, description="default, latency-sensitive, throughput ou dense"),
+    cpu_mode: str = Form(None),
+    pinning: str = Form(None, description="none, node ou dedicated"),
+    hugepages: bool = Form(None),
+    disk_cache: str = Form(None),
+    disk_io: str = Form(None),
+    iothreads: int = Form(None),
+    net_queues: str = Form(None, description="nombre de files virtio-net ou auto"),
+    sockets: int = Form(None),
+    cores: int = Form(None),
+    threads: int = Form(None),
+    strategy: str = Form(None, description="binpack, spread ou least_loaded"),
+    group: str = Form(None, description="groupe d'anti-affinité"),
+    owner: str = Form(None),
+    host: str = Query(None, description="hyperviseur imposé (choisi par le placement sinon)"),
 ):
+    """
+    Crée une VM depuis une ISO (installation) ou depuis un template (overlay
+    sur une image déjà installée, sans installation).
+    L'ISO est soit envoyée (iso), soit une ISO déjà stockée (iso_id = son SHA-256, voir GET /isos).
+    L'hyperviseur est choisi par le placement (capacité, stratégie, anti-affinité)
+    sauf s'il est imposé avec ?host=. Le disque est préparé sur le stockage de
+    l'orchestrateur : seuls les hôtes qui le partagent (hôte local et
+    ORCH_SHARED_STORAGE_HOSTS) sont candidats.
+    profile fixe les réglages de performance (topologie, épinglage NUMA, hugepages,
+    I/O disque et réseau) ; chaque champ peut être surchargé individuellement.
+    """
     memory = memory or 512
+    if host and host not in config.SHARED_STORAGE_HOSTS:
+        return JSONResponse(status_code=400, content={
+            "error": f"L'hôte {host} ne partage pas le stockage des disques (ORCH_SHARED_STORAGE_HOSTS)"
+        })
+    overrides = {
+        "vcpus": vcpus, "cpu_mode": cpu_mode, "pinning": pinning, "hugepages": hugepages,
+        "disk_cache": disk_cache, "disk_io": disk_io, "iothreads": iothreads,
+        "net_queues": int(net_queues) if net_queues and net_queues.isdigit() else net_queues,
+        "sockets": sockets, "cores": cores, "threads": threads,
+    }
+    try:
+        settings = domain_profiles.resolve(profile, overrides)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    vcpus = settings["vcpus"]
+
+    if template and template_store.get(template) is None:
+        return JSONResponse(status_code=400, content={"error": f"Template {template} introuvable"})
 
     iso_path = None
-    if iso:
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        iso_path = os.path.join(UPLOAD_DIR, iso.filename)
+    if iso_id:
+        stored = iso_store.get(iso_id)
+        if stored is None:
+            return JSONResponse(status_code=400, content={"error": f"ISO {iso_id} introuvable"})
+        iso_path = stored["path"]
+    elif iso:
         try:
-            with open(iso_path, "wb") as f:
-                f.write(await iso.read())
+            result = await store_upload_file(iso)
         except OSError as e:
             raise HTTPException(
                 status_code=507,
                 detail=f"Impossible d'écrire l'ISO ({e.strerror}). Vérifie l'espace disque."
             )
+        if "error" in result:
+            return JSONResponse(status_code=400, content={"error": result["error"]})
+        iso_path = result["iso"]["path"]
 
-    result = service.create_vm(
-        name=name,
-        memory=memory,
-        disk_size=disk_size,
-        iso_path=iso_path
+    placement = scheduler.place(
+        name, memory, vcpus=vcpus, disk=0 if template else disk_size,
+        strategy=strategy, group=group, hosts=[host] if host else sorted(config.SHARED_STORAGE_HOSTS),
     )
+    if "error" in placement:
+        return JSONResponse(status_code=409, content=placement)
+    host_service = registry.service(placement["host"])
 
-    if "error" in result:
-        return JSONResponse(status_code=400, content={"error": result["error"]})
+    def create(job):
+        result = host_service.create_vm(
+            name=name,
+            memory=memory,
+            disk_size=disk_size,
+            iso_path=iso_path,
+            template=template,
+            job=job,
+            profile=profile,
+            overrides=overrides,
+        )
+        # Propriétaire posé seulement si la VM existe : un échec ne le laisse pas en attente
+        if owner and "error" not in result:
+            vm_store.set_owner(name, owner, host=placement["host"])
+        return result
 
-    return result
+    return submit_job(
+        "create", name,
+        scheduler.bind(placement["reservation"], create),
+        storage_pool=config.IMAGES_DIR,
+        params={
+            "memory": memory, "disk_size": disk_size, "vcpus": vcpus, "iso_path": iso_path,
+            "template": template, "host": placement["host"], "strategy": placement["strategy"],
+            "profile": settings["profile"],
+        },
+        hypervisor=host_service.uri,
+    )
 
 
 @router.delete("/delete/{name}")
-def delete_vm(name: str):
-    result = service.delete_vm(name)
+async def delete_vm(name: str, host_service: LibvirtService = Depends(target_service)):
+    result = await aservice.call("delete_vm", name, service=host_service)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
 
 
 @router.post("/migrate/{name}")
-def migrate_vm(name: str, destination: str = Query(...)):
+async def migrate_vm(
+    name: str,
+    destination: str = Query(...),
+    bandwidth: int = Query(None, description="débit max (MiB/s)"),
+    parallel_connections: int = Query(None, description="connexions parallèles (multifd)"),
+    compression: str = Query(None, description="xbzrle ou zstd (zstd nécessite parallel_connections)"),
+    auto_converge: bool = Query(False),
+    postcopy_after: int = Query(None, description="bascule en post-copy après N itérations"),
+    max_downtime: int = Query(None, description="interruption max tolérée (ms)"),
+    copy_storage: bool = Query(True, description="copier les disques (stockage non partagé)"),
+    host_service: LibvirtService = Depends(target_service),
+):
     """
     Migration d'une VM vers un autre hyperviseur.
-    destination = qemu+ssh://user@IP/system
+    destination = qemu+ssh://user@IP/system, ou nom d'un hyperviseur enregistré
+    La progression (données restantes, dirty rate, downtime estimé) se suit sur GET /jobs/{id}.
     """
-    result = service.migrate_vm(name, destination)
+    options = {
+        "bandwidth": bandwidth,
+        "parallel_connections": parallel_connections,
+        "compression": compression,
+        "auto_converge": auto_converge,
+        "postcopy_after": postcopy_after,
+        "max_downtime": max_downtime,
+        "copy_storage": copy_storage,
+    }
+
+    # La destination peut aussi être le nom d'un hyperviseur enregistré
+    registered = registry.get(destination)
+    if registered:
+        destination = registered["uri"]
 
     # 🔥 TRÈS IMPORTANT : renvoyer { "error": "..." }
     # pour que le frontend puisse l'afficher dans alert()
-    if "error" in result:
-        return JSONResponse(status_code=400, content={"error": result["error"]})
+    if not destination.startswith("qemu+ssh://"):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "URI de destination invalide (attendu: qemu+ssh://user@hote/system)"},
+        )
+    try:
+        build_migration(options)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
-    return result
+    return submit_job(
+        "migrate", name,
+        lambda job: host_service.migrate_vm(name, destination, job=job, options=options),
+        params={"destination": destination, **options},
+        hypervisor=host_service.uri,
+    )
 
 
 @router.post("/{name}/start")
-def start_vm(name: str):
-    return service.start_vm(name)
+async def start_vm(
+    name: str,
+    cold: bool = Query(False, description="ignore l'état sauvegardé par une mise en veille et démarre à froid"),
+    host_service: LibvirtService = Depends(target_service),
+):
+    return await aservice.call("start_vm", name, cold=cold, service=host_service)
 
 
 @router.post("/{name}/stop")
-def stop_vm(name: str):
-    return service.stop_vm(name)
+async def stop_vm(
+    name: str,
+    mode: str = Query("shutdown", description="shutdown ou hibernate (état mémoire sauvegardé, restauré au start)"),
+    host_service: LibvirtService = Depends(target_service),
+):
+    if mode not in STOP_MODES:
+        raise HTTPException(status_code=400, detail=f"mode doit être parmi {', '.join(STOP_MODES)}")
+    return await aservice.call("stop_vm", name, mode=mode, service=host_service)
+
+
+@router.get("/{name}/saved-state")
+async def get_saved_state(name: str, host_service: LibvirtService = Depends(target_service)):
+    """Image de mise en veille de la VM (mode, chemin, taille sur disque)."""
+    result = await aservice.call("saved_state", name, service=host_service)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
 
 
 @router.post("/{name}/suspend")
-def suspend_vm(name: str):
-    return service.suspend_vm(name)
+async def suspend_vm(name: str, host_service: LibvirtService = Depends(target_service)):
+    return await aservice.call("suspend_vm", name, service=host_service)
 
 
 @router.post("/{name}/reboot")
-def reboot_vm(name: str):
-    result = service.reboot_vm(name)
+async def reboot_vm(name: str, host_service: LibvirtService = Depends(target_service)):
+    result = await aservice.call("reboot_vm", name, service=host_service)
+    if "error" in result:
+        return JSONResponse(status_code=400, content={"error": result["error"]})
+    return result
+
+@router.post("/batch")
+async def batch_operation(body: BatchRequest, host_service: LibvirtService = Depends(target_service)):
+    """
+    Applique une action (start, stop, suspend, reboot, delete, snapshot) à une
+    liste de VMs (names) ou aux VMs dont les labels correspondent à selector.
+    Parallélisme borné (parallel) et débit limité (rate opérations/s).
+    Réponse NDJSON : une ligne par VM dès qu'elle est terminée, puis une synthèse.
+    """
+    if body.action not in ACTIONS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Action inconnue : {body.action} (attendu : {', '.join(ACTIONS)})"},
+        )
+    if body.action == "snapshot" and not body.snapshot_name:
+        return JSONResponse(status_code=400, content={"error": "snapshot_name est requis pour action=snapshot"})
+    if bool(body.names) == bool(body.selector):
+        return JSONResponse(status_code=400, content={"error": "Indiquer names ou selector (un seul des deux)"})
+
+    names = list(dict.fromkeys(body.names or []))
+    if body.selector:
+        try:
+            terms = vm_labels.parse_selector(body.selector)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        all_labels = await aservice.call("list_labels", service=host_service)
+        if "error" in all_labels:
+            return JSONResponse(status_code=502, content={"error": all_labels["error"]})
+        names = sorted(n for n, labels in all_labels.items() if vm_labels.matches(labels, terms))
+
+    return StreamingResponse(
+        run_batch(
+            aservice, host_service, body.action, names,
+            params={"snapshot_name": body.snapshot_name},
+            parallel=body.parallel,
+            rate=body.rate,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/{name}/history")
+def vm_history(name: str, limit: int = Query(50, ge=1, le=1000)):
+    """Historique des opérations sur la VM (les plus récentes d'abord)."""
+    return {"name": name, "operations": vm_store.history(name, limit)}
+
+
+@router.put("/{name}/owner")
+def set_vm_owner(name: str, owner: str = Form(...), host: str = Query(None)):
+    return vm_store.set_owner(name, owner, host=host)
+
+
+@router.get("/{name}/labels")
+async def get_vm_labels(name: str, host_service: LibvirtService = Depends(target_service)):
+    result = await aservice.call("get_labels", name, service=host_service)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
+@router.put("/{name}/labels")
+async def set_vm_labels(name: str, body: LabelsUpdate, host_service: LibvirtService = Depends(target_service)):
+    """Remplace les labels de la VM (ex: {"labels": {"env": "prod", "owner": "alice"}})."""
+    result = await aservice.call("set_labels", name, body.labels, service=host_service)
     if "error" in result:
         return JSONResponse(status_code=400, content={"error": result["error"]})
     return result
 
+
+@router.get("/{name}/metrics")
+def vm_metrics(
+    name: str,
+    range_: str = Query(None, alias="range", description="durée : 300, 15m, 1h... (toute la rétention par défaut)"),
+    host: str = Query(None),
+):
+    """
+    Séries temporelles de la VM : CPU, mémoire (balloon), débits et IOPS disque,
+    débits réseau. Une mesure toutes les METRICS_INTERVAL secondes.
+    """
+    try:
+        seconds = parse_range(range_)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = collector.series(name, seconds, host=host)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Aucune mesure pour la VM {name}")
+    return result
+
+
 @router.get("/{name}/console")
-def get_vm_console(name: str):
+async def get_vm_console(name: str, host: str = Query(None), host_service: LibvirtService = Depends(target_service)):
     """
     Retourne l'URI VNC de la VM pour ouvrir une console (ex: vnc://127.0.0.1:5901)
+    et le chemin du WebSocket à donner à noVNC
     """
-    result = service.get_console_uri(name)
+    result = await aservice.call("get_console_uri", name, service=host_service)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
-    return result
+    return dict(result, websocket=f"/vms/{name}/console/ws" + (f"?host={host}" if host else ""))
+
+
+@router.websocket("/{name}/console/ws")
+async def console_websocket(websocket: WebSocket, name: str, host: str = Query(None)):
+    """
+    Console VNC de la VM relayée sur un WebSocket (noVNC).
+    Fermetures : 1008 VM ou hyperviseur introuvable, 1011 serveur VNC injoignable,
+    1013 trop de consoles ouvertes.
+    """
+    # noVNC peut demander le sous-protocole "binary"
+    subprotocol = "binary" if "binary" in websocket.scope.get("subprotocols", []) else None
+    host_service = service if host is None else registry.service(host)
+    if host_service is None or not console_proxy.reserve():
+        await websocket.accept(subprotocol=subprotocol)
+        if host_service is None:
+            await websocket.close(code=proxy.CLOSE_POLICY, reason=proxy.close_reason(f"Hyperviseur {host} introuvable"))
+        else:
+            await websocket.close(code=proxy.CLOSE_TRY_AGAIN, reason="Trop de consoles ouvertes")
+        return
+
+    target, writer = {}, None
+    try:
+        target = await aservice.call("open_console", name, service=host_service)
+        await websocket.accept(subprotocol=subprotocol)
+        if "error" in target:
+            await websocket.close(code=proxy.CLOSE_POLICY, reason=proxy.close_reason(target["error"]))
+            return
+        try:
+            reader, writer = await console_proxy.connect(target)
+        except (OSError, asyncio.TimeoutError) as e:
+            await websocket.close(code=proxy.CLOSE_ERROR, reason=proxy.close_reason(f"Serveur VNC injoignable : {e}"))
+            return
+    finally:
+        if writer is None:
+            console_proxy.release(target)
+    await console_proxy.relay(websocket, name, host_service.uri, target, reader, writer)
 
 @router.post("/clone")
-def clone_vm(source: str = Form(...), target: str = Form(...)):
-    result = service.clone_vm(source, target)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    return result
+async def clone_vm(
+    source: str = Form(...),
+    target: str = Form(...),
+    mode: str = Form("full"),
+    base_snapshot: bool = Form(False),
+    group: str = Form(None, description="groupe d'anti-affinité du clone"),
+    host: str = Query(None, description="hyperviseur de la source (retrouvé par le placement sinon)"),
+):
+    """
+    mode=full   : copie complète (reflink ou qemu-img convert)
+    mode=linked : overlay qcow2 sur le disque figé de la source (quasi instantané) ;
+                  pour une source active, base_snapshot=true est requis
+    Le disque est copié localement : le clone est créé sur l'hôte de la source,
+    après vérification par le placement qu'il y a la place (et l'anti-affinité).
+    """
+    if mode not in CLONE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Mode de clone inconnu : {mode} (attendu : {', '.join(CLONE_MODES)})",
+        )
+    if host is None:
+        default = registry.get_by_uri(service.uri)
+        host = scheduler.locate(source) or (default["name"] if default else None)
+    host_service = registry.service(host) if host else None
+    if host_service is None:
+        raise HTTPException(status_code=404, detail=f"Hyperviseur {host} introuvable")
+    vm = get_domain_cache(host_service.uri).get(source) or {}
+
+    placement = scheduler.place(
+        target, vm.get("memory", 0), vcpus=vm.get("vcpus", 1), group=group, hosts=[host],
+    )
+    if "error" in placement:
+        return JSONResponse(status_code=409, content=placement)
+
+    return submit_job(
+        "clone", target,
+        scheduler.bind(placement["reservation"], lambda job: host_service.clone_vm(
+            source, target, job=job, mode=mode, base_snapshot=base_snapshot,
+        )),
+        storage_pool=config.IMAGES_DIR,
+        params={"source": source, "mode": mode, "base_snapshot": base_snapshot, "host": host},
+        hypervisor=host_service.uri,
+    )
 
 
 @router.post("/{name}/snapshot/create")
-def create_snapshot(name: str, snapshot_name: str = Form(...)):
-    return service.snapshot_create(name, snapshot_name)
+async def create_snapshot(
+    name: str,
+    snapshot_name: str = Form(...),
+    mode: str = Form("internal"),
+    quiesce: bool = Form(True),
+    host_service: LibvirtService = Depends(target_service),
+):
+    """
+    mode=internal : snapshot dans le qcow2 (mémoire comprise si la VM tourne)
+    mode=external : overlay qcow2 disque seul, quasi instantané ; quiesce via l'agent invité
+    """
+    if mode not in SNAPSHOT_MODES:
+        return JSONResponse(status_code=400, content={"error": f"Mode inconnu : {mode} (attendu : {', '.join(SNAPSHOT_MODES)})"})
+    return submit_job(
+        "snapshot", name,
+        lambda job: host_service.snapshot_create(name, snapshot_name, job=job, mode=mode, quiesce=quiesce),
+        storage_pool=config.IMAGES_DIR,
+        params={"snapshot_name": snapshot_name, "mode": mode},
+        hypervisor=host_service.uri,
+    )
 
 @router.get("/{name}/snapshot/list")
-def list_snapshots(name: str):
-    return service.snapshot_list(name)
+async def list_snapshots(name: str, host_service: LibvirtService = Depends(target_service)):
+    return await aservice.call("snapshot_list", name, service=host_service)
+
+@router.get("/{name}/snapshot/tree")
+async def snapshot_tree(name: str, host_service: LibvirtService = Depends(target_service)):
+    """Arbre des snapshots avec date de création, parent, état, type et taille."""
+    return await aservice.call("snapshot_tree", name, service=host_service)
+
+@router.post("/{name}/snapshot/delete-many")
+async def delete_snapshots(name: str, body: SnapshotBulkDelete, host_service: LibvirtService = Depends(target_service)):
+    """Suppression groupée (job) : les snapshots listés, ou tous avec all=true."""
+    if not body.all and not body.snapshots:
+        return JSONResponse(status_code=400, content={"error": "snapshots ou all=true est requis"})
+    names = None if body.all else body.snapshots
+    return submit_job(
+        "snapshot_delete", name,
+        lambda job: host_service.snapshot_delete_many(name, names, job=job),
+        params={"snapshots": names or "all"},
+        hypervisor=host_service.uri,
+    )
+
+@router.post("/{name}/snapshot/prune")
+async def prune_snapshots(
+    name: str,
+    keep: int = Query(..., ge=0, description="nombre de snapshots récents à conserver"),
+    host_service: LibvirtService = Depends(target_service),
+):
+    """Applique tout de suite une rétention (le pruner périodique suit le label snapshot.keep)."""
+    return submit_job(
+        "snapshot_prune", name,
+        lambda job: host_service.snapshot_prune(name, keep, job=job),
+        params={"keep": keep},
+        hypervisor=host_service.uri,
+    )
 
 @router.post("/{name}/snapshot/restore")
-def restore_snapshot(name: str, snapshot_name: str = Form(...)):
-    return service.snapshot_restore(name, snapshot_name)
+async def restore_snapshot(name: str, snapshot_name: str = Form(...), host_service: LibvirtService = Depends(target_service)):
+    return await aservice.call("snapshot_restore", name, snapshot_name, service=host_service)
 
 @router.post("/{name}/snapshot/delete")
-def delete_snapshot(name: str, snapshot_name: str = Form(...)):
-    return service.snapshot_delete(name, snapshot_name)
+async def delete_snapshot(name: str, snapshot_name: str = Form(...), host_service: LibvirtService = Depends(target_service)):
+    return await aservice.call("snapshot_delete", name, snapshot_name, service=host_service)
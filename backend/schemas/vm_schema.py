@@ -0,0 +1,21 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class BatchRequest(BaseModel):
+    action: str                           # start, stop, hibernate, suspend, reboot, delete, snapshot
+    names: Optional[List[str]] = None     # VMs visées...
+    selector: Optional[str] = None        # ...ou sélecteur de labels : "env=prod,tier!=db"
+    parallel: Optional[int] = Field(None, gt=0)    # VMs traitées en même temps
+    rate: Optional[float] = Field(None, gt=0)      # opérations lancées par seconde
+    snapshot_name: Optional[str] = None   # pour action=snapshot
+
+
+class LabelsUpdate(BaseModel):
+    labels: Dict[str, str]
+
+
+class SnapshotBulkDelete(BaseModel):
+    snapshots: Optional[List[str]] = None  # snapshots à supprimer...
+    all: bool = False                      # ...ou tous
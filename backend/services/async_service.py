@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import config
+
+
+class AsyncLibvirtService:
+    """
+    Façade asynchrone de LibvirtService pour les routes FastAPI.
+
+    Les appels libvirt (bloquants) tournent dans un pool de threads dédié et borné,
+    distinct du threadpool de Starlette : des arrêts ou reboots lents ne bloquent
+    plus la boucle asyncio ni les autres requêtes.
+    Chaque opération a en plus sa propre limite de concurrence (OPERATION_LIMITS).
+    """
+
+    def __init__(self, service, max_workers=None, limits=None):
+        self.service = service
+        self.limits = config.OPERATION_LIMITS if limits is None else limits
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.LIBVIRT_WORKERS,
+            thread_name_prefix="libvirt",
+        )
+        self._semaphores = {}
+        self._listeners = []
+
+    @property
+    def uri(self):
+        return self.service.uri
+
+    async def call(self, operation, *args, service=None, **kwargs):
+        """
+        Exécute service.<operation>(*args, **kwargs) dans le pool dédié.
+        service : LibvirtService d'un autre hyperviseur (celui par défaut sinon).
+        """
+        service = service or self.service
+        func = functools.partial(getattr(service, operation), *args, **kwargs)
+        semaphore = self._semaphore(operation)
+        if semaphore is None:
+            result = await self.run(func)
+        else:
+            async with semaphore:
+                result = await self.run(func)
+        for callback in self._listeners:
+            callback(operation, args, service, result)
+        return result
+
+    def add_listener(self, callback):
+        """callback(operation, args, service, result) est appelé après chaque opération."""
+        self._listeners.append(callback)
+
+    async def run(self, func, *args):
+        """Exécute une fonction bloquante quelconque dans le pool dédié."""
+        loop = asyncio.get_running_loop()
+        # Le contexte suit l'appel : les spans libvirt restent rattachés à la requête
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, context.run, func, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _semaphore(self, operation):
+        limit = self.limits.get(operation)
+        if not limit:
+            return None
+        semaphore = self._semaphores.get(operation)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[operation] = semaphore
+        return semaphore
@@ -0,0 +1,266 @@
+"""
+Équilibrage dynamique de la mémoire des VMs par virtio-balloon.
+
+Toutes les BALLOON_INTERVAL secondes, pour chaque hyperviseur : mémoire libre
+de l'hôte et statistiques balloon de tous les domaines actifs (un seul
+getAllDomainStats : current, maximum, unused, available, swap in/out).
+La cible de chaque VM est sa mémoire utilisée + BALLOON_HEADROOM, bornée par
+[min, max] :
+- max : la mémoire définie (<memory>), ou le label memory.max (Mo)
+- min : le label memory.min (Mo), sinon BALLOON_MIN_RATIO * max (>= BALLOON_MIN_MB)
+
+Les reprises de mémoire sont progressives (BALLOON_STEP Mo par passage), les
+rendus immédiats ; un invité qui swappe grossit en priorité. Quand l'hôte
+passe sous HOST_MEMORY_RESERVE, la marge est divisée par deux et les
+croissances sont limitées à la mémoire libre restante.
+Sans ORCH_BALLOON_AUTO=1, les décisions sont calculées (dry-run) mais pas appliquées.
+"""
+import threading
+import time
+
+import libvirt
+
+from services import domain_stats
+from services.inventory import registry
+from services.vm_store import vm_store
+from utils import config
+
+
+MIN_LABEL = "memory.min"
+MAX_LABEL = "memory.max"
+
+
+class BalloonBalancer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}        # hôte -> {"free", "total", "vms": {vm: stats}}
+        self._swap = {}         # (hôte, vm) -> (swap_in cumulé, instant)
+        self._swapping = set()  # (hôte, vm) dont le swap_in a augmenté depuis la dernière mesure
+        self._running = False
+        self._wakeup = threading.Event()
+        self.last_run_at = None
+        self.last_decisions = []
+
+    # ---------------------------------------------------------------- lecture
+
+    def status(self):
+        """Mémoire libre des hôtes, et par VM : actuelle, utilisée, bornes, dernière cible."""
+        targets = {(d["host"], d["vm"]): d for d in self.last_decisions}
+        with self._lock:
+            hosts = {}
+            for name, host in self._hosts.items():
+                vms = []
+                for vm, stats in sorted(host["vms"].items()):
+                    decision = targets.get((name, vm))
+                    vms.append(dict(
+                        stats, vm=vm,
+                        target=decision["target"] if decision else stats["current"],
+                        swapping=(name, vm) in self._swapping,
+                    ))
+                hosts[name] = {"free": host["free"], "total": host["total"], "vms": vms}
+        return {
+            "auto": config.BALLOON_AUTO,
+            "interval": config.BALLOON_INTERVAL,
+            "headroom": config.BALLOON_HEADROOM,
+            "host_reserve": config.HOST_MEMORY_RESERVE,
+            "last_run_at": self.last_run_at,
+            "hosts": hosts,
+            "decisions": self.last_decisions,
+        }
+
+    # ------------------------------------------------------------ cycle de vie
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._loop, name="balloon", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            self._wakeup.wait(config.BALLOON_INTERVAL)
+            if not self._running:
+                break
+            try:
+                self.run(dry_run=not config.BALLOON_AUTO)
+            except Exception:
+                pass
+
+    # ---------------------------------------------------------------- décision
+
+    def run(self, dry_run=True):
+        """Mesure, calcule les nouvelles cibles et, hors dry-run, les applique (setMemory)."""
+        self.sample()
+        decisions = self.plan()
+        if not dry_run:
+            by_host = {}
+            for decision in decisions:
+                by_host.setdefault(decision["host"], []).append(decision)
+            results = registry.fan_out(
+                lambda host, service: self._apply(service, by_host[host["name"]]),
+                [h for h in registry.list() if h["name"] in by_host],
+            )
+            for decision in decisions:
+                outcome = results.get(decision["host"], {})
+                if outcome.get("status") != "ok":
+                    decision["error"] = outcome.get("error")
+                else:
+                    error = outcome["result"].get(decision["vm"])
+                    decision["applied"] = error is None
+                    if error:
+                        decision["error"] = error
+        self.last_run_at = time.time()
+        self.last_decisions = decisions
+        return {"dry_run": dry_run, "decisions": decisions}
+
+    def sample(self):
+        results = registry.fan_out(lambda host, service: self._collect(service))
+        now = time.monotonic()
+        with self._lock:
+            for name, outcome in results.items():
+                if outcome["status"] != "ok":
+                    # Pas de décision sur des mesures périmées
+                    self._hosts.pop(name, None)
+                    continue
+                self._hosts[name] = outcome["result"]
+                for vm, stats in outcome["result"]["vms"].items():
+                    key = (name, vm)
+                    previous = self._swap.get(key)
+                    self._swap[key] = (stats["swap_in"], now)
+                    if previous and stats["swap_in"] > previous[0]:
+                        self._swapping.add(key)
+                    else:
+                        self._swapping.discard(key)
+            for name in set(self._hosts) - set(results):
+                del self._hosts[name]
+
+    def plan(self):
+        """Nouvelles cibles balloon, hôte par hôte : [{host, vm, current, target, action, reason, ...}]."""
+        labels = vm_store.labels()
+        decisions = []
+        with self._lock:
+            hosts = {name: dict(host) for name, host in self._hosts.items()}
+            swapping = set(self._swapping)
+        for name, host in hosts.items():
+            decisions.extend(self._plan_host(name, host, labels.get(name, {}), swapping))
+        return decisions
+
+    def _plan_host(self, name, host, labels, swapping):
+        pressure = host["free"] < config.HOST_MEMORY_RESERVE
+        headroom = config.BALLOON_HEADROOM / 2 if pressure else config.BALLOON_HEADROOM
+        # Les reprises libèrent de la mémoire pour les croissances du même passage
+        budget = host["free"] - config.HOST_MEMORY_RESERVE
+
+        shrinks, grows = [], []
+        for vm, stats in host["vms"].items():
+            if stats["used"] is None:
+                continue    # statistiques de l'invité pas encore disponibles (pilote balloon absent ?)
+            low, high = self._bounds(stats, labels.get(vm, {}))
+            current = stats["current"]
+            if (name, vm) in swapping:
+                desired = current + config.BALLOON_STEP
+                reason = "l'invité swappe"
+            else:
+                desired = int(stats["used"] * (1 + headroom))
+                reason = "mémoire utilisée + marge"
+            target = max(low, min(high, desired))
+            if target < current:
+                # Reprise progressive : l'invité a le temps de libérer ses caches
+                target = max(target, current - config.BALLOON_STEP)
+            if abs(target - current) < max(config.BALLOON_MIN_CHANGE, current * 0.05):
+                continue
+            decision = {
+                "host": name, "vm": vm, "current": current, "target": target,
+                "used": stats["used"], "min": low, "max": high,
+                "action": "grow" if target > current else "shrink",
+                "reason": reason + (" (hôte sous pression)" if pressure else ""),
+            }
+            (grows if target > current else shrinks).append(decision)
+
+        budget += sum(d["current"] - d["target"] for d in shrinks)
+        accepted = list(shrinks)
+        # Les invités qui swappent d'abord, puis les plus gros besoins
+        for decision in sorted(grows, key=lambda d: (not d["reason"].startswith("l'invité swappe"), d["current"] - d["target"])):
+            needed = decision["target"] - decision["current"]
+            if needed > budget:
+                if budget < config.BALLOON_MIN_CHANGE:
+                    continue
+                decision["target"] = decision["current"] + budget
+                decision["reason"] += " (limité par la mémoire libre de l'hôte)"
+                needed = budget
+            budget -= needed
+            accepted.append(decision)
+        return accepted
+
+    @staticmethod
+    def _bounds(stats, labels):
+        high = stats["maximum"]
+        if labels.get(MAX_LABEL, "").isdigit():
+            high = min(high, int(labels[MAX_LABEL]))
+        if labels.get(MIN_LABEL, "").isdigit():
+            low = int(labels[MIN_LABEL])
+        else:
+            low = max(config.BALLOON_MIN_MB, int(stats["maximum"] * config.BALLOON_MIN_RATIO))
+        return min(low, high), high
+
+    # ---------------------------------------------------------------- libvirt
+
+    @staticmethod
+    def _collect(service):
+        conn = service.connect()
+        if not conn:
+            return {"error": f"Connexion impossible à {service.uri}"}
+        try:
+            total = conn.getInfo()[1]
+            free = conn.getFreeMemory() // (1024 * 1024)
+            records = domain_stats.collect(conn, ("state", "balloon"))
+            vms = {}
+            for dom, raw in records:
+                if raw.get("state.state") != libvirt.VIR_DOMAIN_RUNNING or "balloon.current" not in raw:
+                    continue
+                if "balloon.unused" not in raw or "balloon.available" not in raw:
+                    # Le pilote balloon ne publie ses statistiques qu'une fois la période réglée
+                    try:
+                        dom.setMemoryStatsPeriod(config.BALLOON_STATS_PERIOD, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+                    except libvirt.libvirtError:
+                        pass
+                    used = None
+                else:
+                    used = (raw["balloon.available"] - raw["balloon.unused"]) // 1024
+                vms[dom.name()] = {
+                    "current": raw["balloon.current"] // 1024,
+                    "maximum": raw.get("balloon.maximum", raw["balloon.current"]) // 1024,
+                    "used": used,
+                    "swap_in": raw.get("balloon.swap_in", 0),
+                    "swap_out": raw.get("balloon.swap_out", 0),
+                }
+            return {"free": free, "total": total, "vms": vms}
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _apply(service, decisions):
+        """{vm: None | erreur} après setMemory (taille live du balloon, en KiB)."""
+        conn = service.connect()
+        if not conn:
+            return {d["vm"]: f"Connexion impossible à {service.uri}" for d in decisions}
+        results = {}
+        try:
+            for decision in decisions:
+                try:
+                    conn.lookupByName(decision["vm"]).setMemory(decision["target"] * 1024)
+                    results[decision["vm"]] = None
+                except libvirt.libvirtError as e:
+                    results[decision["vm"]] = str(e)
+        finally:
+            conn.close()
+        return results
+
+
+balancer = BalloonBalancer()
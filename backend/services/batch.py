@@ -0,0 +1,110 @@
+"""
+Opérations groupées sur des VMs (POST /vms/batch) : parallélisme borné,
+limitation de débit par seau à jetons, résultats diffusés au fil de l'eau.
+"""
+import asyncio
+import json
+import time
+
+from utils import config
+
+
+# Action de l'API -> méthode de LibvirtService
+ACTIONS = {
+    "start": "start_vm",
+    "stop": "stop_vm",
+    "hibernate": "stop_vm",
+    "suspend": "suspend_vm",
+    "reboot": "reboot_vm",
+    "delete": "delete_vm",
+    "snapshot": "snapshot_create",
+}
+
+
+class TokenBucket:
+    """
+    Seau à jetons (asyncio) : au plus burst opérations d'un coup,
+    puis rate opérations par seconde en régime établi.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            # Un débit nul ou négatif ferait tourner take() sans jamais attendre
+            raise ValueError(f"Débit invalide : {rate} (attendu > 0)")
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def run_batch(aservice, service, action, names, params=None, parallel=None, rate=None):
+    """
+    Exécute action sur chaque VM de names et produit une ligne NDJSON par VM,
+    dans l'ordre où elles se terminent, puis une ligne de synthèse.
+    Les appels passent par le pool de connexions du service : pas de connexion par VM.
+    """
+    operation = ACTIONS[action]
+    params = params or {}
+    parallel = config.BATCH_PARALLEL if parallel is None else parallel
+    rate = config.BATCH_RATE if rate is None else rate
+    if parallel < 1 or rate <= 0:
+        raise ValueError("parallel et rate doivent être > 0")
+    parallel = min(parallel, config.BATCH_MAX_PARALLEL)
+    bucket = TokenBucket(min(rate, config.BATCH_MAX_RATE), config.BATCH_BURST)
+    semaphore = asyncio.Semaphore(parallel)
+    started = time.monotonic()
+
+    async def one(name):
+        async with semaphore:
+            await bucket.take()
+            start = time.monotonic()
+            try:
+                if action == "snapshot":
+                    result = await aservice.call(operation, name, params["snapshot_name"], service=service)
+                elif action == "hibernate":
+                    result = await aservice.call(operation, name, mode="hibernate", service=service)
+                else:
+                    result = await aservice.call(operation, name, service=service)
+            except Exception as e:
+                result = {"error": str(e)}
+            return name, result, time.monotonic() - start
+
+    tasks = [asyncio.ensure_future(one(name)) for name in names]
+    succeeded = failed = 0
+    try:
+        for future in asyncio.as_completed(tasks):
+            name, result, elapsed = await future
+            line = {"vm": name, "elapsed": round(elapsed, 3)}
+            if isinstance(result, dict) and "error" in result:
+                failed += 1
+                line.update(status="error", error=result["error"])
+            else:
+                succeeded += 1
+                line.update(status="ok", result=result)
+            yield json.dumps(line) + "\n"
+    finally:
+        # Client déconnecté : les VMs pas encore commencées ne le seront pas
+        for task in tasks:
+            task.cancel()
+
+    yield json.dumps({"summary": {
+        "action": action,
+        "total": len(names),
+        "succeeded": succeeded,
+        "failed": failed,
+        "parallel": parallel,
+        "rate": bucket.rate,
+        "elapsed": round(time.monotonic() - started, 3),
+    }}) + "\n"
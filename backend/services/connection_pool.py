@@ -0,0 +1,329 @@
+import threading
+import time
+
+import libvirt
+
+from utils import config
+
+
+_event_loop_lock = threading.Lock()
+_event_loop_started = False
+
+
+def ensure_event_loop():
+    """
+    Démarre (une seule fois par processus) la boucle d'événements libvirt
+    dans un thread dédié. Elle est nécessaire pour le keepalive et pour
+    les callbacks (fermeture de connexion, événements de domaines).
+    """
+    global _event_loop_started
+    with _event_loop_lock:
+        if _event_loop_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+        thread = threading.Thread(target=_run_event_loop, name="libvirt-events", daemon=True)
+        thread.start()
+        _event_loop_started = True
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+class PooledConnection:
+    """
+    Connexion prêtée par le pool (éventuellement partagée avec d'autres appelants).
+    Se comporte comme un virConnect ; close() la rend au pool au lieu de la fermer.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Slot:
+    """Connexion ouverte du pool et nombre d'emprunteurs qui l'utilisent."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.borrowers = 0
+        self.retired = False    # sortie du pool : fermée au retour du dernier emprunteur
+
+
+class ConnectionPool:
+    """
+    Petit pool de connexions libvirt longue durée pour une URI.
+    - une connexion virConnect est thread-safe (le client libvirt multiplexe les
+      RPC) : elle est prêtée à plusieurs appelants à la fois, en tourniquet,
+      au lieu d'être réservée. max_size borne le nombre de connexions ouvertes,
+      pas le nombre d'appels simultanés : une connexion libre est préférée, puis
+      une nouvelle connexion tant que max_size n'est pas atteint, puis la moins
+      partagée
+    - les connexions sont surveillées par keepalive (setKeepAlive)
+    - une connexion morte (libvirtd redémarré, SSH coupé...) est jetée
+      et remplacée au prochain acquire, sans que l'appelant le voie
+    """
+
+    def __init__(self, uri, max_size=None, acquire_timeout=None):
+        self.uri = uri
+        self.max_size = max_size or config.POOL_MAX_SIZE
+        self.acquire_timeout = acquire_timeout or config.POOL_ACQUIRE_TIMEOUT
+
+        self._cond = threading.Condition()
+        self._slots = []        # connexions ouvertes (_Slot)
+        self._retired = []      # connexions sorties du pool, encore empruntées
+        self._size = 0          # connexions ouvertes + en cours d'ouverture
+        self._next = 0          # tourniquet entre connexions également partagées
+
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "shared": 0,
+            "reconnects": 0,
+            "disconnects": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "failures": 0,
+        }
+
+    def acquire(self, timeout=None):
+        """Retourne un virConnect vivant (éventuellement partagé), ou lève libvirt.libvirtError."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        replacing = False
+        dead = []
+
+        try:
+            with self._cond:
+                while True:
+                    slot = self._pick()
+                    if slot is not None:
+                        if not self._is_alive(slot.conn):
+                            dead.extend(self._retire(slot))
+                            replacing = True
+                            continue
+                        self._stats["shared" if slot.borrowers else "reused"] += 1
+                        slot.borrowers += 1
+                        return slot.conn
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    # Toutes les connexions sont en cours d'ouverture : on attend la première
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise libvirt.libvirtError(f"Aucune connexion disponible pour {self.uri}")
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+        finally:
+            for conn in dead:
+                self._close(conn)
+
+        # Ouverture hors verrou : avec qemu+ssh:// cela peut prendre du temps
+        try:
+            conn = self._open()
+        except libvirt.libvirtError:
+            with self._cond:
+                self._size -= 1
+                self._stats["failures"] += 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            slot = _Slot(conn)
+            slot.borrowers = 1
+            self._slots.append(slot)
+            self._stats["created"] += 1
+            if replacing:
+                self._stats["reconnects"] += 1
+            self._cond.notify_all()
+        return conn
+
+    def release(self, conn):
+        closing = []
+        with self._cond:
+            slot = self._slot(conn)
+            if slot is None:
+                return
+            slot.borrowers -= 1
+            if slot.borrowers == 0:
+                if slot.retired:
+                    self._retired.remove(slot)
+                    closing.append(conn)
+                elif self._size > self.max_size or not self._is_alive(conn):
+                    closing.extend(self._retire(slot))
+        for conn in closing:
+            self._close(conn)
+
+    def connect(self, timeout=None):
+        """Comme acquire(), mais renvoie une PooledConnection (ou None en cas d'échec)."""
+        try:
+            return PooledConnection(self, self.acquire(timeout))
+        except libvirt.libvirtError:
+            return None
+
+    def resize(self, max_size):
+        """Change le nombre maximal de connexions (les connexions en trop se ferment une fois rendues)."""
+        closing = []
+        with self._cond:
+            self.max_size = max_size
+            for slot in [s for s in self._slots if not s.borrowers]:
+                if self._size <= self.max_size:
+                    break
+                closing.extend(self._retire(slot))
+        for conn in closing:
+            self._close(conn)
+
+    def close(self):
+        """Ferme les connexions libres ; celles encore empruntées se ferment à leur retour."""
+        closing = []
+        with self._cond:
+            for slot in list(self._slots):
+                closing.extend(self._retire(slot))
+        for conn in closing:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "uri": self.uri,
+                "max_size": self.max_size,
+                "open": self._size,
+                "idle": sum(1 for s in self._slots if not s.borrowers),
+                "in_use": sum(s.borrowers for s in self._slots),
+                **self._stats,
+            }
+
+    def _pick(self):
+        # Appelé avec le verrou tenu : connexion libre, sinon (pool plein) la moins partagée
+        if not self._slots:
+            return None
+        free = [s for s in self._slots if not s.borrowers]
+        if free:
+            return free[-1]
+        if self._size < self.max_size:
+            return None
+        least = min(s.borrowers for s in self._slots)
+        candidates = [s for s in self._slots if s.borrowers == least]
+        self._next += 1
+        return candidates[self._next % len(candidates)]
+
+    def _slot(self, conn):
+        # Appelé avec le verrou tenu
+        for slot in self._slots + self._retired:
+            if slot.conn is conn:
+                return slot
+        return None
+
+    def _retire(self, slot):
+        # Appelé avec le verrou tenu : sort slot du pool ; renvoie les connexions à fermer (hors verrou)
+        self._slots.remove(slot)
+        self._size -= 1
+        slot.retired = True
+        self._cond.notify_all()
+        if slot.borrowers:
+            self._retired.append(slot)
+            return []
+        return [slot.conn]
+
+    def _open(self):
+        ensure_event_loop()
+        conn = libvirt.open(self.uri)
+        if conn is None:
+            raise libvirt.libvirtError(f"Connexion impossible à {self.uri}")
+        try:
+            conn.setKeepAlive(config.KEEPALIVE_INTERVAL, config.KEEPALIVE_COUNT)
+        except libvirt.libvirtError:
+            # Les drivers locaux (test://, qemu:///system sans daemon distant) ne le gèrent pas toujours
+            pass
+        try:
+            conn.registerCloseCallback(self._on_close, None)
+        except libvirt.libvirtError:
+            pass
+        return conn
+
+    def _on_close(self, conn, reason, opaque):
+        # Appelé depuis le thread d'événements libvirt quand la connexion tombe
+        with self._cond:
+            self._stats["disconnects"] += 1
+
+    @staticmethod
+    def _close(conn):
+        # Hors verrou : une fermeture lente (SSH) ne bloque pas les autres emprunteurs
+        try:
+            conn.unregisterCloseCallback()
+        except libvirt.libvirtError:
+            pass
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            return conn.isAlive() == 1
+        except libvirt.libvirtError:
+            return False
+
+
+class ConnectionManager:
+    """Un pool par URI d'hyperviseur, partagé par toutes les instances de LibvirtService."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def get_pool(self, uri):
+        with self._lock:
+            pool = self._pools.get(uri)
+            if pool is None:
+                pool = ConnectionPool(uri)
+                self._pools[uri] = pool
+            return pool
+
+    def connect(self, uri, timeout=None):
+        return self.get_pool(uri).connect(timeout)
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        return [p.stats() for p in pools]
+
+    def remove(self, uri):
+        """Ferme et oublie le pool de uri (hyperviseur retiré du registre)."""
+        with self._lock:
+            pool = self._pools.pop(uri, None)
+        if pool is not None:
+            pool.close()
+
+    def close_all(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+pool_manager = ConnectionManager()
@@ -0,0 +1,268 @@
+"""
+Proxy WebSocket -> VNC des consoles (noVNC dans le frontend).
+
+Chaque session relaie les octets dans les deux sens entre le WebSocket du
+navigateur et le serveur VNC de la VM (socket fourni par openGraphicsFD, ou
+connexion TCP au port VNC), sans les recopier : ce qui est lu d'un côté est
+écrit tel quel de l'autre.
+- contre-pression : un seul bloc en vol par sens. Tant que le navigateur n'a pas
+  absorbé l'envoi précédent, on ne lit plus le serveur VNC (le tampon du
+  StreamReader se remplit, puis TCP ralentit QEMU) ; dans l'autre sens,
+  writer.drain() suspend la lecture du WebSocket.
+- débit : seau à jetons par session et par sens (CONSOLE_RATE_KB)
+- inactivité : fermeture après CONSOLE_IDLE_TIMEOUT secondes sans trafic
+- compteurs par session : octets, blocs, latence de relais (lecture -> envoi
+  terminé, hors attente du limiteur), temps passé bridé
+"""
+import asyncio
+import contextlib
+import itertools
+import os
+import socket
+import time
+
+from utils import config
+
+
+# Codes de fermeture WebSocket
+CLOSE_NORMAL = 1000
+CLOSE_POLICY = 1008
+CLOSE_ERROR = 1011
+CLOSE_TRY_AGAIN = 1013
+
+
+def close_reason(text):
+    """Raison de fermeture WebSocket : 123 octets UTF-8 au plus."""
+    return text.encode()[:123].decode(errors="ignore")
+
+
+class TokenBucket:
+    """Limiteur de débit (octets/s) ; rate=0 : illimité."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        # Une seconde de débit d'avance, au moins un bloc entier
+        self.capacity = max(rate, config.CONSOLE_CHUNK)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def consume(self, size):
+        """Attend que size octets puissent passer ; renvoie le temps d'attente (s)."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+
+class Direction:
+    """Compteurs d'un sens de relais."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.throttled = 0.0
+
+    def observe(self, size, latency, throttled):
+        self.bytes += size
+        self.chunks += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.throttled += throttled
+
+    def to_dict(self):
+        return {
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "latency_avg_ms": round(self.latency_total / self.chunks * 1000, 3) if self.chunks else None,
+            "latency_max_ms": round(self.latency_max * 1000, 3),
+            "throttled_s": round(self.throttled, 3),
+        }
+
+
+class ConsoleSession:
+    def __init__(self, id, vm, hypervisor, client, target):
+        self.id = id
+        self.vm = vm
+        self.hypervisor = hypervisor
+        self.client = client
+        self.target = target            # "fd" ou "hôte:port"
+        self.started_at = time.time()
+        self.last_activity = time.monotonic()
+        self.to_client = Direction()    # VNC -> navigateur
+        self.to_vnc = Direction()       # navigateur -> VNC
+        self.closed_reason = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "vm": self.vm,
+            "hypervisor": self.hypervisor,
+            "client": self.client,
+            "target": self.target,
+            "started_at": self.started_at,
+            "idle_s": round(time.monotonic() - self.last_activity, 1),
+            "to_client": self.to_client.to_dict(),
+            "to_vnc": self.to_vnc.to_dict(),
+        }
+
+
+class ConsoleProxy:
+    def __init__(self):
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self._reserved = 0              # places prises par des sessions en cours d'ouverture
+        self.opened = 0
+        self.rejected = 0
+        self.closed = {}                # raison -> nombre
+        self.bytes_to_client = 0
+        self.bytes_to_vnc = 0
+
+    def reserve(self):
+        """Réserve une place avant d'ouvrir une session ; False si le proxy est plein."""
+        if len(self._sessions) + self._reserved >= config.CONSOLE_MAX_SESSIONS:
+            self.rejected += 1
+            return False
+        self._reserved += 1
+        return True
+
+    def release(self, target=None):
+        """
+        Rend une place réservée (ouverture abandonnée, ou session démarrée par relay).
+        target : point d'accès obtenu mais inutilisé, dont le descripteur est fermé.
+        """
+        self._reserved -= 1
+        if target and "fd" in target:
+            with contextlib.suppress(OSError):
+                os.close(target["fd"])
+
+    def stats(self):
+        return {
+            "max_sessions": config.CONSOLE_MAX_SESSIONS,
+            "idle_timeout": config.CONSOLE_IDLE_TIMEOUT,
+            "rate_kb": config.CONSOLE_RATE_KB,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "closed": dict(self.closed),
+            "bytes_to_client": self.bytes_to_client + sum(s.to_client.bytes for s in self._sessions.values()),
+            "bytes_to_vnc": self.bytes_to_vnc + sum(s.to_vnc.bytes for s in self._sessions.values()),
+            "sessions": [s.to_dict() for s in self._sessions.values()],
+        }
+
+    async def connect(self, target):
+        """(reader, writer) vers le serveur VNC décrit par LibvirtService.open_console."""
+        if "fd" in target:
+            # En cas d'échec, le descripteur est fermé par release(target)
+            sock = socket.socket(fileno=target["fd"])
+            return await asyncio.open_connection(sock=sock, limit=config.CONSOLE_CHUNK)
+        return await asyncio.wait_for(
+            asyncio.open_connection(target["host"], target["port"], limit=config.CONSOLE_CHUNK),
+            config.CONSOLE_CONNECT_TIMEOUT,
+        )
+
+    async def relay(self, websocket, vm, hypervisor, target, reader, writer):
+        """
+        Relaie jusqu'à la fermeture d'un des deux côtés ou l'inactivité ;
+        le WebSocket doit être accepté et une place réservée (reserve()).
+        Renvoie la raison de fin.
+        """
+        client = websocket.client
+        session = ConsoleSession(
+            next(self._ids), vm, hypervisor,
+            f"{client.host}:{client.port}" if client else None,
+            "fd" if "fd" in target else f"{target['host']}:{target['port']}",
+        )
+        rate = config.CONSOLE_RATE_KB * 1024
+        self.release()
+        self._sessions[session.id] = session
+        self.opened += 1
+
+        tasks = [
+            asyncio.ensure_future(self._vnc_to_client(session, reader, websocket, TokenBucket(rate))),
+            asyncio.ensure_future(self._client_to_vnc(session, websocket, writer, TokenBucket(rate))),
+            asyncio.ensure_future(self._watch_idle(session)),
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            reason = next(iter(done)).result()
+        except asyncio.CancelledError:
+            reason = "annulée"
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+            del self._sessions[session.id]
+            session.closed_reason = reason
+            self.closed[reason] = self.closed.get(reason, 0) + 1
+            self.bytes_to_client += session.to_client.bytes
+            self.bytes_to_vnc += session.to_vnc.bytes
+
+        if reason != "client déconnecté":
+            with contextlib.suppress(Exception):
+                await websocket.close(code=CLOSE_ERROR if reason == "erreur" else CLOSE_NORMAL, reason=reason)
+        return reason
+
+    @staticmethod
+    async def _vnc_to_client(session, reader, websocket, bucket):
+        try:
+            while True:
+                data = await reader.read(config.CONSOLE_CHUNK)
+                if not data:
+                    return "serveur VNC fermé"
+                start = time.perf_counter()
+                throttled = await bucket.consume(len(data))
+                await websocket.send_bytes(data)
+                session.last_activity = time.monotonic()
+                session.to_client.observe(len(data), time.perf_counter() - start - throttled, throttled)
+        except (ConnectionError, OSError):
+            return "serveur VNC fermé"
+        except Exception:
+            # Envoi sur un WebSocket fermé (WebSocketDisconnect, ConnectionClosed...)
+            return "client déconnecté"
+
+    @staticmethod
+    async def _client_to_vnc(session, websocket, writer, bucket):
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return "client déconnecté"
+                data = message.get("bytes")
+                if data is None:
+                    continue    # noVNC n'envoie que des trames binaires
+                start = time.perf_counter()
+                throttled = await bucket.consume(len(data))
+                writer.write(data)
+                await writer.drain()
+                session.last_activity = time.monotonic()
+                session.to_vnc.observe(len(data), time.perf_counter() - start - throttled, throttled)
+        except (ConnectionError, OSError):
+            return "serveur VNC fermé"
+        except Exception:
+            return "erreur"
+
+    @staticmethod
+    async def _watch_idle(session):
+        timeout = config.CONSOLE_IDLE_TIMEOUT
+        if not timeout:
+            await asyncio.Event().wait()    # jamais
+        while True:
+            idle = time.monotonic() - session.last_activity
+            if idle >= timeout:
+                return "inactivité"
+            await asyncio.sleep(timeout - idle)
+
+
+console_proxy = ConsoleProxy()
@@ -0,0 +1,356 @@
+import collections
+import threading
+import time
+import uuid
+
+import libvirt
+
+from services.connection_pool import ensure_event_loop
+from services import domain_stats
+from utils import config
+
+
+class DomainStateCache:
+    """
+    Table en mémoire des domaines d'un hyperviseur (nom, état, mémoire, vCPUs),
+    tenue à jour par les événements de cycle de vie libvirt.
+
+    - une resynchronisation complète à la connexion et après chaque reconnexion
+    - ensuite, seul le domaine concerné par un événement est relu
+    - GET /vms est servi depuis cette table, sans aucun appel RPC
+
+    Chaque modification incrémente une génération (seq) et est conservée dans
+    un journal borné de diffs, ce qui permet aux abonnés (flux /vms/events)
+    de reprendre là où ils en étaient.
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._domains = {}
+        self._snapshot = None
+        self._names = []
+
+        # Génération + journal des diffs ; epoch change à chaque démarrage du processus
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self._changes = collections.deque(maxlen=config.EVENTS_BACKLOG)
+        self._subscribers = []
+
+        # Générations des descriptions XML (services.domain_xml) : par UUID, et une
+        # globale incrémentée à chaque resynchronisation (événements peut-être manqués)
+        self._xml_generations = {}
+        self._resyncs = 0
+
+        self.synced_at = None        # dernière resynchronisation complète
+        self.last_event_at = None    # dernier événement reçu
+        self.disconnected_at = None  # début de la coupure en cours (None si connecté)
+
+        self._conn = None
+        self._callback_ids = []
+        self._running = False
+        self._thread = None
+        self._lifecycle_lock = threading.Lock()
+        self._disconnected = threading.Event()
+
+    # ------------------------------------------------------------------ lecture
+
+    @property
+    def ready(self):
+        return self.synced_at is not None
+
+    def list(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = sorted(self._domains.values(), key=lambda d: d["name"])
+                self._names = [d["name"] for d in self._snapshot]
+            return self._snapshot
+
+    def view(self):
+        """(seq, liste triée par nom, noms dans le même ordre) lus de façon cohérente (pagination)."""
+        with self._lock:
+            vms = self.list()
+            return self.seq, vms, self._names
+
+    def get(self, name):
+        with self._lock:
+            return self._domains.get(name)
+
+    def wait_for_change(self, name, entry, timeout):
+        """
+        Bloque jusqu'à ce que l'entrée de name ne soit plus entry (événement reçu)
+        ou jusqu'au timeout. Renvoie True si elle a changé.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self._domains.get(name) is not entry, timeout)
+
+    def snapshot(self):
+        """(seq, liste) lus de façon cohérente."""
+        with self._lock:
+            return self.seq, self.list()
+
+    def changes_since(self, seq):
+        """
+        Diffs postérieurs à seq sous forme [(seq, diff), ...].
+        Renvoie None si seq est sorti du journal (le client doit repartir d'un snapshot).
+        """
+        with self._lock:
+            if seq == self.seq:
+                return []
+            if seq > self.seq or not self._changes or self._changes[0][0] > seq + 1:
+                return None
+            return [(s, diff) for s, diff in self._changes if s > seq]
+
+    def token(self, seq):
+        """Jeton de reprise opaque : epoch:seq."""
+        return f"{self.epoch}:{seq}"
+
+    def parse_token(self, token):
+        """seq du jeton, ou None s'il est invalide ou vient d'une autre instance."""
+        epoch, _, seq = (token or "").partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def xml_generation(self, uuid):
+        """
+        Génération de la description XML du domaine uuid, ou None si le cache
+        ne peut pas la garantir (pas synchronisé, ou connexion d'événements coupée).
+        """
+        with self._lock:
+            if not self.ready or self.disconnected_at is not None:
+                return None
+            return self._resyncs, self._xml_generations.get(uuid, 0)
+
+    def touch(self, uuid):
+        """Invalide la description XML de uuid (modification faite hors événement de cycle de vie)."""
+        with self._lock:
+            self._xml_generations[uuid] = self._xml_generations.get(uuid, 0) + 1
+
+    def subscribe(self, callback):
+        """callback() est appelé (depuis un thread libvirt) après chaque modification."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def status(self):
+        """Fraîcheur des données : age = 0 tant que la connexion d'événements est vivante."""
+        with self._lock:
+            connected = self.ready and self.disconnected_at is None
+            if not self.ready:
+                age = None
+            elif connected:
+                age = 0.0
+            else:
+                age = time.time() - self.disconnected_at
+            return {
+                "uri": self.uri,
+                "connected": connected,
+                "stale": not connected,
+                "domains": len(self._domains),
+                "generation": self.token(self.seq),
+                "synced_at": self.synced_at,
+                "last_event_at": self.last_event_at,
+                "age": age,
+            }
+
+    # --------------------------------------------------------------- cycle de vie
+
+    def start(self):
+        with self._lifecycle_lock:
+            self._running = True
+            if self._thread is not None:
+                # Superviseur pas encore sorti (stop puis start) : il voit
+                # _running et reprend, on n'en lance pas un second
+                return
+            self._thread = threading.Thread(
+                target=self._supervise, name=f"domain-cache:{self.uri}", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._disconnected.set()
+
+    def _supervise(self):
+        backoff = 1
+        while True:
+            with self._lifecycle_lock:
+                if not self._running:
+                    self._thread = None
+                    return
+            try:
+                self._connect()
+                self.resync()
+                backoff = 1
+            except libvirt.libvirtError:
+                self._cleanup()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            # On attend la fermeture de la connexion (callback ou keepalive expiré)
+            self._disconnected.wait()
+            self._cleanup()
+
+    def _connect(self):
+        ensure_event_loop()
+        self._disconnected.clear()
+        conn = libvirt.open(self.uri)
+        if conn is None:
+            raise libvirt.libvirtError(f"Connexion impossible à {self.uri}")
+        try:
+            conn.setKeepAlive(config.KEEPALIVE_INTERVAL, config.KEEPALIVE_COUNT)
+        except libvirt.libvirtError:
+            pass
+        conn.registerCloseCallback(self._on_close, None)
+        self._conn = conn
+
+        self._callback_ids.append(
+            conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle, None
+            )
+        )
+        # Ajout/retrait de périphériques à chaud : le XML change sans événement de cycle de vie
+        for event_id in (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED, libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+            self._callback_ids.append(
+                conn.domainEventRegisterAny(None, event_id, self._on_device, None)
+            )
+
+    def _cleanup(self):
+        conn, self._conn = self._conn, None
+        with self._lock:
+            if self.disconnected_at is None:
+                self.disconnected_at = time.time()
+        if conn is None:
+            return
+        for callback_id in self._callback_ids:
+            try:
+                conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError:
+                pass
+        self._callback_ids = []
+        try:
+            conn.unregisterCloseCallback()
+        except libvirt.libvirtError:
+            pass
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    def _on_close(self, conn, reason, opaque):
+        self._disconnected.set()
+
+    # ------------------------------------------------------------- mise à jour
+
+    def resync(self):
+        """Relit tous les domaines (un appel getAllDomainStats) et remplace la table."""
+        domains = {}
+        for dom, raw in domain_stats.collect(self._conn, domain_stats.SUMMARY_GROUPS):
+            entry = domain_stats.summarize(dom, raw)
+            domains[entry["name"]] = entry
+        with self._lock:
+            # Les changements survenus pendant la coupure deviennent des diffs
+            for name in self._domains.keys() - domains.keys():
+                self._record({"type": "removed", "name": name})
+            for name, entry in domains.items():
+                self._record_entry(self._domains.get(name), entry)
+            self._domains = domains
+            self._snapshot = None
+            self._resyncs += 1
+            self._xml_generations.clear()
+            self.synced_at = time.time()
+            self.disconnected_at = None
+        self._notify()
+
+    def _on_lifecycle(self, conn, dom, event, detail, opaque):
+        # Appelé depuis le thread d'événements libvirt
+        try:
+            self.touch(dom.UUIDString())
+            if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+                self._remove(dom.name())
+            else:
+                self._update(self._describe(dom))
+        except libvirt.libvirtError:
+            # Le domaine a pu disparaître entre l'événement et la lecture
+            pass
+
+    def _on_device(self, conn, dom, dev, opaque):
+        self.touch(dom.UUIDString())
+
+    def _update(self, entry):
+        with self._lock:
+            self.last_event_at = time.time()
+            changed = self._record_entry(self._domains.get(entry["name"]), entry)
+            if changed:
+                self._domains[entry["name"]] = entry
+                self._snapshot = None
+        if changed:
+            self._notify()
+
+    def _remove(self, name):
+        with self._lock:
+            self.last_event_at = time.time()
+            removed = self._domains.pop(name, None) is not None
+            if removed:
+                self._record({"type": "removed", "name": name})
+                self._snapshot = None
+        if removed:
+            self._notify()
+
+    def _record_entry(self, old, new):
+        # Appelé avec le verrou tenu
+        if old == new:
+            return False
+        self._record({"type": "added" if old is None else "changed", "vm": new})
+        return True
+
+    def _record(self, diff):
+        # Appelé avec le verrou tenu
+        self.seq += 1
+        self._changes.append((self.seq, diff))
+
+    def _notify(self):
+        with self._lock:
+            self._changed.notify_all()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback()
+
+    @staticmethod
+    def _describe(dom):
+        info = dom.info()
+        return {
+            "name": dom.name(),
+            "state": info[0],
+            "memory": info[1] // 1024,  # Mo
+            "vcpus": info[3],
+        }
+
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def get_domain_cache(uri):
+    """Retourne le cache (unique par processus) de l'hyperviseur uri."""
+    with _caches_lock:
+        cache = _caches.get(uri)
+        if cache is None:
+            cache = DomainStateCache(uri)
+            _caches[uri] = cache
+        return cache
+
+
+def stop_all():
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.stop()
@@ -0,0 +1,326 @@
+"""
+Profils de domaine pour create_vm : nombre et topologie des vCPUs, modèle de
+CPU, épinglage des vCPUs et de l'émulateur sur la topologie NUMA de l'hôte
+(getCapabilities), mémoire en hugepages, disques cache='none' io='native'
+avec iothreads dédiés et virtio-net multiqueue.
+
+Le XML du domaine est construit avec ElementTree (plus de gabarit texte).
+"""
+import xml.etree.ElementTree as ET
+
+
+# Épinglage des vCPUs :
+# - none      : l'ordonnanceur de l'hôte place les vCPUs librement
+# - node      : vCPUs, émulateur et mémoire confinés à un nœud NUMA
+# - dedicated : un CPU physique par vCPU, réservé (non partagé avec une autre VM
+#               épinglée), émulateur et iothreads sur un cœur de service du nœud
+PINNING_MODES = ("none", "node", "dedicated")
+CPU_MODES = ("host-passthrough", "host-model")
+CACHE_MODES = ("none", "writeback", "writethrough", "directsync", "unsafe")
+IO_MODES = ("native", "threads", "io_uring")
+
+PROFILES = {
+    # XML historique de create_vm : aucun réglage
+    "default": {
+        "vcpus": 1, "cpu_mode": None, "pinning": "none", "hugepages": False,
+        "disk_cache": None, "disk_io": None, "iothreads": 0, "net_queues": 1,
+    },
+    # Latence minimale et stable : CPUs dédiés, mémoire locale en hugepages
+    "latency-sensitive": {
+        "vcpus": 2, "cpu_mode": "host-passthrough", "pinning": "dedicated", "hugepages": True,
+        "disk_cache": "none", "disk_io": "native", "iothreads": 1, "net_queues": "auto",
+    },
+    # Débit : un nœud NUMA entier, plusieurs iothreads, une file réseau par vCPU
+    "throughput": {
+        "vcpus": 4, "cpu_mode": "host-passthrough", "pinning": "node", "hugepages": True,
+        "disk_cache": "none", "disk_io": "native", "iothreads": 2, "net_queues": "auto",
+    },
+    # Densité : surallocation possible et migrable entre hôtes hétérogènes
+    # (host-model plutôt que host-passthrough), pas de mémoire réservée
+    "dense": {
+        "vcpus": 1, "cpu_mode": "host-model", "pinning": "none", "hugepages": False,
+        "disk_cache": "none", "disk_io": "threads", "iothreads": 0, "net_queues": 1,
+    },
+}
+
+# Champs qu'une requête peut surcharger (en plus de ceux des profils)
+TOPOLOGY_FIELDS = ("sockets", "cores", "threads")
+
+_MAX_NET_QUEUES = 8
+
+
+def resolve(profile=None, overrides=None):
+    """
+    Réglages du profil avec les surcharges appliquées (valeurs None ignorées).
+    Lève ValueError si le profil, un champ ou une combinaison est invalide.
+    """
+    name = profile or "default"
+    if name not in PROFILES:
+        raise ValueError(f"Profil inconnu : {name} (disponibles : {', '.join(PROFILES)})")
+    settings = dict(PROFILES[name], profile=name, sockets=None, cores=None, threads=None)
+    for key, value in (overrides or {}).items():
+        if value is None:
+            continue
+        if key not in settings or key == "profile":
+            raise ValueError(f"Champ non surchargeable : {key}")
+        settings[key] = value
+    _validate(settings)
+    return settings
+
+
+def _validate(s):
+    if not isinstance(s["vcpus"], int) or not 1 <= s["vcpus"] <= 256:
+        raise ValueError("vcpus doit être compris entre 1 et 256")
+    if s["cpu_mode"] not in (None,) + CPU_MODES:
+        raise ValueError(f"cpu_mode invalide : {s['cpu_mode']} (attendu : {', '.join(CPU_MODES)})")
+    if s["pinning"] not in PINNING_MODES:
+        raise ValueError(f"pinning invalide : {s['pinning']} (attendu : {', '.join(PINNING_MODES)})")
+    if s["disk_cache"] not in (None,) + CACHE_MODES:
+        raise ValueError(f"disk_cache invalide : {s['disk_cache']} (attendu : {', '.join(CACHE_MODES)})")
+    if s["disk_io"] not in (None,) + IO_MODES:
+        raise ValueError(f"disk_io invalide : {s['disk_io']} (attendu : {', '.join(IO_MODES)})")
+    if s["disk_io"] == "native" and s["disk_cache"] not in ("none", "directsync"):
+        raise ValueError("disk_io=native exige disk_cache=none ou directsync (O_DIRECT)")
+    if not isinstance(s["iothreads"], int) or not 0 <= s["iothreads"] <= 16:
+        raise ValueError("iothreads doit être compris entre 0 et 16")
+    if s["net_queues"] != "auto" and (not isinstance(s["net_queues"], int) or not 1 <= s["net_queues"] <= 256):
+        raise ValueError("net_queues doit être 'auto' ou compris entre 1 et 256")
+
+    topology = [s[k] for k in TOPOLOGY_FIELDS]
+    if any(v is not None for v in topology):
+        if any(v is not None and (not isinstance(v, int) or v < 1) for v in topology):
+            raise ValueError("sockets, cores et threads doivent être >= 1")
+        sockets, threads = s["sockets"] or 1, s["threads"] or 1
+        cores = s["cores"] or s["vcpus"] // (sockets * threads)
+        if sockets * cores * threads != s["vcpus"]:
+            raise ValueError(f"Topologie {sockets}x{cores}x{threads} incompatible avec {s['vcpus']} vCPUs")
+        s["sockets"], s["cores"], s["threads"] = sockets, cores, threads
+
+
+# ----------------------------------------------------------- topologie de l'hôte
+
+class HostTopology:
+    """Nœuds NUMA de l'hôte lus dans getCapabilities()."""
+
+    def __init__(self, capabilities_xml):
+        root = ET.fromstring(capabilities_xml)
+        self.cells = []
+        for cell in root.findall("./host/topology/cells/cell"):
+            memory = cell.find("memory")
+            cpus = [
+                {
+                    "id": int(cpu.get("id")),
+                    "core": (cpu.get("socket_id"), cpu.get("die_id"), cpu.get("core_id")),
+                    "siblings": _parse_cpuset(cpu.get("siblings") or cpu.get("id")),
+                }
+                for cpu in cell.findall("./cpus/cpu")
+            ]
+            self.cells.append({
+                "id": int(cell.get("id")),
+                "memory": int(memory.text) if memory is not None else 0,     # KiB
+                "cpus": cpus,
+                "pages": {int(p.get("size")): int(p.text) for p in cell.findall("pages")},
+            })
+
+    @property
+    def threads_per_core(self):
+        for cell in self.cells:
+            for cpu in cell["cpus"]:
+                return len(cpu["siblings"])
+        return 1
+
+    def hugepage_size(self):
+        """Plus petite taille de hugepage disponible (KiB), ou None."""
+        sizes = {size for cell in self.cells for size, total in cell["pages"].items() if size > 4 and total}
+        return min(sizes) if sizes else None
+
+
+def plan(topology, settings, memory, used_cpus=(), free_pages=None):
+    """
+    Placement NUMA d'une nouvelle VM de memory Mo :
+    {"node", "vcpupin": [cpuset par vCPU], "emulatorpin", "page_size", "threads", "notes"}.
+    used_cpus : CPUs déjà réservés par des VMs à épinglage dédié.
+    free_pages : {nœud: {taille KiB: pages libres}} (getFreePages) si hugepages.
+    Lève ValueError si l'hôte ne peut pas satisfaire le profil.
+    """
+    result = {"node": None, "vcpupin": None, "emulatorpin": None, "page_size": None, "threads": None, "notes": []}
+    vcpus = settings["vcpus"]
+    used = set(used_cpus)
+
+    pages_needed = None
+    if settings["hugepages"]:
+        size = topology.hugepage_size()
+        if size is None:
+            raise ValueError("Aucune hugepage réservée sur l'hôte (hugepages=false pour s'en passer)")
+        if (memory * 1024) % size:
+            raise ValueError(f"La mémoire ({memory} Mo) doit être un multiple de la taille des hugepages ({size // 1024} Mo)")
+        result["page_size"] = size
+        pages_needed = memory * 1024 // size
+
+    def free_hugepages(cell_id):
+        return (free_pages or {}).get(cell_id, {}).get(result["page_size"], 0)
+
+    if settings["pinning"] == "none":
+        if pages_needed and sum(free_hugepages(c["id"]) for c in topology.cells) < pages_needed:
+            raise ValueError(f"Hugepages libres insuffisantes ({pages_needed} nécessaires)")
+        return result
+
+    candidates = []
+    for cell in topology.cells:
+        if pages_needed and free_hugepages(cell["id"]) < pages_needed:
+            continue
+        if not pages_needed and cell["memory"] < memory * 1024:
+            continue
+        candidates.append(cell)
+
+    if settings["pinning"] == "node":
+        fitting = [c for c in candidates if len(c["cpus"]) >= vcpus]
+        if not fitting:
+            if pages_needed and not candidates:
+                raise ValueError(f"Aucun nœud NUMA n'a {pages_needed} hugepages libres")
+            # La VM dépasse un nœud : mieux vaut ne pas la confiner que la surcharger
+            result["notes"].append("VM plus grande qu'un nœud NUMA : vCPUs non épinglés")
+            return result
+        cell = max(fitting, key=lambda c: (free_hugepages(c["id"]), len(c["cpus"]) - len(used & _ids(c))))
+        cpuset = _format_cpuset(_ids(cell))
+        result.update(node=cell["id"], vcpupin=[cpuset] * vcpus, emulatorpin=cpuset)
+        return result
+
+    # dedicated : un cœur de service par nœud (le premier) pour l'émulateur et les iothreads
+    best = None
+    for cell in candidates:
+        cpus = sorted(cell["cpus"], key=lambda c: c["id"])
+        if not cpus:
+            continue
+        housekeeping = set(cpus[0]["siblings"])
+        free = [c for c in cpus if c["id"] not in used and c["id"] not in housekeeping]
+        if len(free) < vcpus:
+            continue
+        if best is None or len(free) > len(best[2]):
+            best = (cell, housekeeping, free)
+    if best is None:
+        raise ValueError(f"Aucun nœud NUMA n'a {vcpus} CPU(s) libres pour un épinglage dédié")
+    cell, housekeeping, free = best
+
+    # Cœurs entiers d'abord : des frères hyperthreads consécutifs deviennent les threads d'un même cœur invité
+    by_core = {}
+    for cpu in free:
+        by_core.setdefault(cpu["core"], []).append(cpu["id"])
+    cores = sorted(by_core.values(), key=lambda ids: (-len(ids), ids[0]))
+    chosen = [cpu for ids in cores for cpu in ids][:vcpus]
+
+    threads = topology.threads_per_core
+    if threads > 1 and vcpus % threads == 0 and all(len(ids) == threads for ids in cores[:vcpus // threads]):
+        result["threads"] = threads
+    result.update(
+        node=cell["id"],
+        vcpupin=[str(cpu) for cpu in chosen],
+        emulatorpin=_format_cpuset(housekeeping),
+    )
+    return result
+
+
+def _ids(cell):
+    return {c["id"] for c in cell["cpus"]}
+
+
+def _parse_cpuset(value):
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part or part.startswith("^"):
+            continue
+        if "-" in part:
+            low, high = part.split("-")
+            cpus.update(range(int(low), int(high) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def _format_cpuset(cpus):
+    """{0, 1, 2, 5} -> "0-2,5"."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+# ------------------------------------------------------------------ XML
+
+def build_domain(name, memory, disk_path, settings, placement=None, iso_path=None, boot_from_disk=False):
+    """XML du domaine (memory en Mo) pour les réglages résolus et le placement NUMA."""
+    placement = placement or {}
+    vcpus = settings["vcpus"]
+
+    domain = ET.Element("domain", type="kvm")
+    ET.SubElement(domain, "name").text = name
+    ET.SubElement(domain, "memory", unit="MiB").text = str(memory)
+    if placement.get("page_size"):
+        backing = ET.SubElement(domain, "memoryBacking")
+        ET.SubElement(ET.SubElement(backing, "hugepages"), "page", size=str(placement["page_size"]), unit="KiB")
+    ET.SubElement(domain, "vcpu", placement="static").text = str(vcpus)
+    if settings["iothreads"]:
+        ET.SubElement(domain, "iothreads").text = str(settings["iothreads"])
+
+    if placement.get("vcpupin"):
+        cputune = ET.SubElement(domain, "cputune")
+        for vcpu, cpuset in enumerate(placement["vcpupin"]):
+            ET.SubElement(cputune, "vcpupin", vcpu=str(vcpu), cpuset=cpuset)
+        ET.SubElement(cputune, "emulatorpin", cpuset=placement["emulatorpin"])
+        for iothread in range(1, settings["iothreads"] + 1):
+            ET.SubElement(cputune, "iothreadpin", iothread=str(iothread), cpuset=placement["emulatorpin"])
+    if placement.get("node") is not None:
+        numatune = ET.SubElement(domain, "numatune")
+        ET.SubElement(numatune, "memory", mode="strict", nodeset=str(placement["node"]))
+
+    os_elem = ET.SubElement(domain, "os")
+    ET.SubElement(os_elem, "type", arch="x86_64").text = "hvm"
+    if not boot_from_disk:
+        ET.SubElement(os_elem, "boot", dev="cdrom")
+    ET.SubElement(os_elem, "boot", dev="hd")
+
+    if settings["cpu_mode"] or settings["threads"] or placement.get("threads"):
+        cpu = ET.SubElement(domain, "cpu")
+        if settings["cpu_mode"]:
+            cpu.set("mode", settings["cpu_mode"])
+        if settings["cpu_mode"] == "host-passthrough":
+            cpu.set("check", "none")
+        threads = settings["threads"] or placement.get("threads") or 1
+        sockets = settings["sockets"] or 1
+        cores = settings["cores"] or vcpus // (sockets * threads)
+        ET.SubElement(cpu, "topology", sockets=str(sockets), cores=str(cores), threads=str(threads))
+
+    devices = ET.SubElement(domain, "devices")
+    disk = ET.SubElement(devices, "disk", type="file", device="disk")
+    driver = ET.SubElement(disk, "driver", name="qemu", type="qcow2")
+    if settings["disk_cache"]:
+        driver.set("cache", settings["disk_cache"])
+    if settings["disk_io"]:
+        driver.set("io", settings["disk_io"])
+    if settings["iothreads"]:
+        driver.set("iothread", "1")
+    ET.SubElement(disk, "source", file=disk_path)
+    ET.SubElement(disk, "target", dev="vda", bus="virtio")
+
+    if iso_path:
+        cdrom = ET.SubElement(devices, "disk", type="file", device="cdrom")
+        ET.SubElement(cdrom, "driver", name="qemu", type="raw")
+        ET.SubElement(cdrom, "source", file=iso_path)
+        ET.SubElement(cdrom, "target", dev="hda", bus="ide")
+        ET.SubElement(cdrom, "readonly")
+
+    interface = ET.SubElement(devices, "interface", type="network")
+    ET.SubElement(interface, "source", network="default")
+    ET.SubElement(interface, "model", type="virtio")
+    queues = settings["net_queues"]
+    if queues == "auto":
+        queues = min(vcpus, _MAX_NET_QUEUES)
+    if queues > 1:
+        ET.SubElement(interface, "driver", name="vhost", queues=str(queues))
+
+    ET.SubElement(devices, "graphics", type="vnc", port="-1")
+    return ET.tostring(domain, encoding="unicode")
@@ -0,0 +1,87 @@
+"""
+Collecte groupée des statistiques de domaines via getAllDomainStats :
+un seul appel RPC pour tous les domaines, au lieu de info() + state() par domaine.
+"""
+import libvirt
+
+
+# Groupes exposés par l'API (fields=...) -> (flag libvirt, préfixe des clés)
+STAT_GROUPS = {
+    "state": (libvirt.VIR_DOMAIN_STATS_STATE, "state."),
+    "balloon": (libvirt.VIR_DOMAIN_STATS_BALLOON, "balloon."),
+    "vcpu": (libvirt.VIR_DOMAIN_STATS_VCPU, "vcpu."),
+    "cpu": (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL, "cpu."),
+    "block": (libvirt.VIR_DOMAIN_STATS_BLOCK, "block."),
+    "interface": (libvirt.VIR_DOMAIN_STATS_INTERFACE, "net."),
+}
+
+# Groupes nécessaires pour la vue "liste" (nom, état, mémoire, vCPUs)
+SUMMARY_GROUPS = ("state", "balloon", "vcpu")
+
+# Groupes indexés (block.0.name, net.1.rx.bytes...) renvoyés sous forme de liste
+_INDEXED_GROUPS = ("block", "interface")
+
+
+def parse_fields(fields):
+    """
+    "state,cpu" -> ["state", "cpu"] ; None/"" -> tous les groupes.
+    Lève ValueError si un groupe est inconnu.
+    """
+    if not fields:
+        return list(STAT_GROUPS)
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in STAT_GROUPS]
+    if unknown:
+        raise ValueError(
+            "Groupe(s) de statistiques inconnu(s) : %s (disponibles : %s)"
+            % (", ".join(unknown), ", ".join(STAT_GROUPS))
+        )
+    return list(dict.fromkeys(fields))
+
+
+def collect(conn, groups):
+    """Retourne [(virDomain, {clé: valeur}), ...] pour tous les domaines, en un appel."""
+    flags = 0
+    for group in groups:
+        flags |= STAT_GROUPS[group][0]
+    return conn.getAllDomainStats(flags)
+
+
+def group_stats(raw, groups):
+    """Range les clés plates de libvirt par groupe, sans leur préfixe."""
+    result = {}
+    for group in groups:
+        prefix = STAT_GROUPS[group][1]
+        values = {k[len(prefix):]: v for k, v in raw.items() if k.startswith(prefix)}
+        if group in _INDEXED_GROUPS:
+            values = _split_indexed(values)
+        result[group] = values
+    return result
+
+
+def _split_indexed(values):
+    items = [{} for _ in range(values.get("count", 0))]
+    for key, value in values.items():
+        index, _, sub = key.partition(".")
+        if index.isdigit() and int(index) < len(items):
+            items[int(index)][sub] = value
+    return items
+
+
+def summarize(dom, raw):
+    """Entrée de liste (même format que list_vms) à partir des stats groupées."""
+    if "balloon.maximum" in raw and "vcpu.current" in raw:
+        memory_kib = raw["balloon.maximum"]
+        vcpus = raw["vcpu.current"]
+    else:
+        # Certains drivers ne remplissent pas balloon/vcpu pour les domaines inactifs
+        info = dom.info()
+        memory_kib = info[1]
+        vcpus = info[3]
+    return {
+        "name": dom.name(),
+        "state": raw.get("state.state", libvirt.VIR_DOMAIN_NOSTATE),
+        "memory": memory_kib // 1024,  # Mo
+        "vcpus": vcpus,
+    }
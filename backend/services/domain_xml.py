@@ -0,0 +1,201 @@
+"""
+Cache des descriptions XML analysées des domaines (disques, consoles,
+interfaces, vCPUs, mémoire), partagé par toutes les instances de LibvirtService.
+
+Les entrées sont indexées par (URI, UUID) et valides tant que la génération
+XML du domaine dans le cache d'événements de l'hyperviseur n'a pas changé :
+définition, suppression, démarrage, arrêt, ajout/retrait de périphérique ou
+resynchronisation les invalident. Sans cache d'événements connecté, le XML
+est relu à chaque appel.
+"""
+import collections
+import copy
+import threading
+import xml.etree.ElementTree as ET
+
+from services.domain_cache import get_domain_cache
+from utils import config
+
+
+class Disk:
+    def __init__(self, device, target, path, format, bus):
+        self.device = device    # disk, cdrom...
+        self.target = target    # vda, sda...
+        self.path = path        # fichier source (None pour un lecteur vide ou un volume réseau)
+        self.format = format    # qcow2, raw...
+        self.bus = bus
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class Graphics:
+    def __init__(self, type, port, listen):
+        self.type = type
+        self.port = port        # None tant que le port n'est pas attribué (VM arrêtée, autoport)
+        self.listen = listen
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class Interface:
+    def __init__(self, type, source, mac, model):
+        self.type = type        # network, bridge...
+        self.source = source    # nom du réseau ou du pont
+        self.mac = mac
+        self.model = model
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class DomainDescription:
+    """Description analysée d'un domaine. Partagée entre appelants : ne pas modifier (voir tree())."""
+
+    def __init__(self, xml):
+        self.xml = xml
+        self._root = ET.fromstring(xml)
+        root = self._root
+
+        self.name = root.findtext("name")
+        self.uuid = root.findtext("uuid")
+        memory = root.find("memory")
+        self.memory = _to_mib(memory) if memory is not None else None    # Mo
+        self.vcpus = int(root.findtext("vcpu") or 1)
+
+        self.disks = []
+        for disk in root.findall("./devices/disk"):
+            source, target, driver = disk.find("source"), disk.find("target"), disk.find("driver")
+            self.disks.append(Disk(
+                device=disk.get("device"),
+                target=target.get("dev") if target is not None else None,
+                path=source.get("file") if source is not None else None,
+                format=driver.get("type") if driver is not None else None,
+                bus=target.get("bus") if target is not None else None,
+            ))
+
+        self.graphics = []
+        for gfx in root.findall("./devices/graphics"):
+            port = gfx.get("port")
+            self.graphics.append(Graphics(
+                type=gfx.get("type"),
+                port=None if port in (None, "-1") else int(port),
+                listen=gfx.get("listen"),
+            ))
+
+        self.interfaces = []
+        for iface in root.findall("./devices/interface"):
+            source, mac, model = iface.find("source"), iface.find("mac"), iface.find("model")
+            self.interfaces.append(Interface(
+                type=iface.get("type"),
+                source=(source.get("network") or source.get("bridge")) if source is not None else None,
+                mac=mac.get("address") if mac is not None else None,
+                model=model.get("type") if model is not None else None,
+            ))
+
+        # CPUs réservés par un épinglage dédié (un seul CPU par vCPU), voir services.domain_profiles
+        self.dedicated_cpus = set()
+        for pin in root.findall("./cputune/vcpupin"):
+            cpuset = pin.get("cpuset") or ""
+            if cpuset.isdigit():
+                self.dedicated_cpus.add(int(cpuset))
+
+    def primary_disk(self):
+        """Premier disque (device="disk") adossé à un fichier, ou None."""
+        for disk in self.disks:
+            if disk.device == "disk" and disk.path:
+                return disk
+        return None
+
+    def console(self, type="vnc"):
+        for gfx in self.graphics:
+            if gfx.type == type:
+                return gfx
+        return None
+
+    def tree(self):
+        """Copie modifiable de l'arbre XML (pour redéfinir un domaine dérivé, ex : clone)."""
+        return copy.deepcopy(self._root)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "uuid": self.uuid,
+            "memory": self.memory,
+            "vcpus": self.vcpus,
+            "disks": [d.to_dict() for d in self.disks],
+            "graphics": [g.to_dict() for g in self.graphics],
+            "interfaces": [i.to_dict() for i in self.interfaces],
+        }
+
+
+_UNITS = {"b": 1 / 1024 ** 2, "bytes": 1 / 1024 ** 2, "kib": 1 / 1024, "k": 1 / 1024,
+          "mib": 1, "m": 1, "gib": 1024, "g": 1024, "tib": 1024 ** 2, "t": 1024 ** 2}
+
+
+def _to_mib(element):
+    return int(int(element.text) * _UNITS.get((element.get("unit") or "KiB").lower(), 1 / 1024))
+
+
+class DomainXmlCache:
+    def __init__(self, size=None):
+        self.size = size or config.DOMAIN_XML_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()   # (uri, uuid) -> (génération, description)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0     # entrées trouvées mais périmées
+        self.evictions = 0
+
+    def describe(self, uri, dom):
+        """Description analysée de dom (libvirt.virDomain). Lève libvirt.libvirtError comme XMLDesc()."""
+        key = (uri, dom.UUIDString())
+        # Génération lue avant XMLDesc() : un événement arrivé entre-temps invalide l'entrée
+        generation = get_domain_cache(uri).xml_generation(key[1])
+        if generation is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                if entry is not None:
+                    self.invalidations += 1
+                self.misses += 1
+        else:
+            with self._lock:
+                self.misses += 1
+
+        description = DomainDescription(dom.XMLDesc())
+        if generation is not None:
+            with self._lock:
+                self._entries[key] = (generation, description)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return description
+
+    def invalidate(self, uri, dom):
+        """À appeler après une modification du XML qui ne produit pas d'événement (snapshot externe...)."""
+        uuid = dom.UUIDString()
+        get_domain_cache(uri).touch(uuid)
+        with self._lock:
+            self._entries.pop((uri, uuid), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+domain_xml = DomainXmlCache()
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from utils import config
+
+
+def _sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def vm_event_stream(cache, request, resume_token=None):
+    """
+    Flux Server-Sent Events de l'état des VMs :
+    - "snapshot" : liste complète (au début, ou si le jeton de reprise est trop ancien)
+    - "diff"     : {"type": added|changed|removed, ...} pour chaque modification
+    - "heartbeat": toutes les EVENTS_HEARTBEAT secondes sans modification
+
+    Chaque événement porte un id (jeton epoch:seq). Le navigateur le renvoie dans
+    Last-Event-ID en se reconnectant : on rejoue alors seulement les diffs manqués.
+    """
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+
+    def notify():
+        # Appelé depuis le thread d'événements libvirt
+        loop.call_soon_threadsafe(wake.set)
+
+    cache.subscribe(notify)
+    try:
+        seq = cache.parse_token(resume_token)
+        if seq is not None and cache.changes_since(seq) is None:
+            seq = None
+
+        while True:
+            if await request.is_disconnected():
+                break
+
+            if seq is None and cache.ready:
+                seq, vms = cache.snapshot()
+                yield _sse("snapshot", {"vms": vms}, cache.token(seq))
+
+            if seq is not None:
+                changes = cache.changes_since(seq)
+                if changes is None:
+                    # Trop de retard (journal dépassé) : on renvoie un snapshot
+                    seq = None
+                    continue
+                for change_seq, diff in changes:
+                    seq = change_seq
+                    yield _sse("diff", diff, cache.token(seq))
+
+            try:
+                await asyncio.wait_for(wake.wait(), config.EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield _sse("heartbeat", cache.status())
+            wake.clear()
+    finally:
+        cache.unsubscribe(notify)
@@ -0,0 +1,237 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from models.db import Hypervisor, SessionLocal
+from services.connection_pool import pool_manager
+from services.domain_cache import get_domain_cache
+from services.libvirt_service import LibvirtService
+from utils import config
+
+
+class HypervisorRegistry:
+    """
+    Registre des hyperviseurs (table hypervisors) et requêtes groupées sur le cluster.
+
+    Les requêtes à l'échelle du cluster sont lancées en parallèle sur tous les
+    hôtes actifs, chacun avec son propre délai : un hôte lent ou mort est signalé
+    en "timeout" et la réponse part avec les résultats partiels des autres. La
+    latence totale est donc bornée par l'hôte sain le plus lent.
+
+    Un appel en retard continue d'occuper un worker : tant qu'il n'est pas
+    terminé, l'hôte n'est pas relancé (il reste en "timeout"), si bien qu'un
+    hôte mort n'immobilise jamais plus d'un worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = None
+        self._services = {}
+        self._inflight = {}   # nom d'hôte -> future de l'appel en cours
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.FANOUT_WORKERS, thread_name_prefix="fanout"
+        )
+
+    # ------------------------------------------------------------------ registre
+
+    def list(self):
+        return sorted(self._load().values(), key=lambda h: h["name"])
+
+    def get(self, name):
+        return self._load().get(name)
+
+    def get_by_uri(self, uri):
+        for host in self._load().values():
+            if host["uri"] == uri:
+                return host
+        return None
+
+    def add(self, name, uri, timeout=None, pool_size=None, enabled=True, description=""):
+        with SessionLocal() as db:
+            exists = db.query(Hypervisor).filter(
+                (Hypervisor.name == name) | (Hypervisor.uri == uri)
+            ).first()
+            if exists:
+                return {"error": f"Hyperviseur déjà enregistré ({exists.name} : {exists.uri})"}
+            host = Hypervisor(
+                name=name,
+                uri=uri,
+                enabled=enabled,
+                timeout=timeout or config.FANOUT_TIMEOUT,
+                pool_size=pool_size or config.POOL_MAX_SIZE,
+                description=description,
+            )
+            db.add(host)
+            db.commit()
+            result = host.to_dict()
+        self._reload()
+        if enabled:
+            self._activate(result)
+        return {"message": f"Hyperviseur {name} enregistré", "hypervisor": result}
+
+    def update(self, name, **fields):
+        with SessionLocal() as db:
+            host = db.query(Hypervisor).filter(Hypervisor.name == name).first()
+            if host is None:
+                return {"error": f"Hyperviseur {name} introuvable"}
+            for key, value in fields.items():
+                if value is not None:
+                    setattr(host, key, value)
+            db.commit()
+            result = host.to_dict()
+        self._reload()
+        if result["enabled"]:
+            self._activate(result)
+        else:
+            get_domain_cache(result["uri"]).stop()
+        return {"message": f"Hyperviseur {name} mis à jour", "hypervisor": result}
+
+    def remove(self, name):
+        with SessionLocal() as db:
+            host = db.query(Hypervisor).filter(Hypervisor.name == name).first()
+            if host is None:
+                return {"error": f"Hyperviseur {name} introuvable"}
+            uri = host.uri
+            db.delete(host)
+            db.commit()
+        self._reload()
+        get_domain_cache(uri).stop()
+        with self._lock:
+            self._services.pop(uri, None)
+        pool_manager.remove(uri)
+        return {"message": f"Hyperviseur {name} supprimé"}
+
+    def service(self, name):
+        """LibvirtService de l'hôte name (None s'il est inconnu)."""
+        host = self.get(name)
+        if host is None:
+            return None
+        with self._lock:
+            service = self._services.get(host["uri"])
+            if service is None:
+                service = LibvirtService(host["uri"])
+                self._services[host["uri"]] = service
+            return service
+
+    def start(self):
+        """Enregistre l'hyperviseur local si le registre est vide, puis démarre le cache de chaque hôte."""
+        if not self._load():
+            self.add(config.DEFAULT_HYPERVISOR_NAME, config.LIBVIRT_URI)
+        for host in self.list():
+            if host["enabled"]:
+                self._activate(host)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------ requêtes groupées
+
+    def fan_out(self, func, hosts=None):
+        """
+        Exécute func(host, service) sur chaque hôte actif, en parallèle.
+        Renvoie {nom: {"status": ok|error|timeout, "elapsed": s, "result"|"error": ...}}.
+        """
+        hosts = [h for h in (hosts or self.list()) if h["enabled"]]
+        start = time.monotonic()
+        futures = {}
+        results = {}
+        for host in hosts:
+            future = self._submit(func, host)
+            if future is None:
+                results[host["name"]] = {
+                    "status": "timeout",
+                    "elapsed": 0,
+                    "error": "L'appel précédent n'a pas encore répondu",
+                }
+                continue
+            futures[future] = (host, start + host["timeout"])
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            for future in [f for f in pending if futures[f][1] <= now]:
+                host = futures[future][0]
+                pending.discard(future)
+                results[host["name"]] = {
+                    "status": "timeout",
+                    "elapsed": round(now - start, 3),
+                    "error": f"Pas de réponse en {host['timeout']} s",
+                }
+            if not pending:
+                break
+            next_deadline = min(futures[f][1] for f in pending)
+            done, _ = wait(pending, timeout=max(0, next_deadline - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                host = futures[future][0]
+                elapsed = round(time.monotonic() - start, 3)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": str(e)}
+                if isinstance(result, dict) and "error" in result:
+                    results[host["name"]] = {"status": "error", "elapsed": elapsed, "error": result["error"]}
+                else:
+                    results[host["name"]] = {"status": "ok", "elapsed": elapsed, "result": result}
+        return results
+
+    def cluster_vms(self):
+        """Toutes les VMs de tous les hôtes (résultats partiels si un hôte ne répond pas)."""
+        def list_host(host, service):
+            cache = get_domain_cache(host["uri"])
+            if cache.ready:
+                return cache.list()
+            return service.list_vms()
+
+        results = self.fan_out(list_host)
+        vms = []
+        hosts = {}
+        for name, outcome in sorted(results.items()):
+            for vm in outcome.pop("result", None) or []:
+                vms.append({**vm, "host": name})
+            hosts[name] = outcome
+        return {
+            "vms": vms,
+            "hosts": hosts,
+            "partial": any(h["status"] != "ok" for h in hosts.values()),
+        }
+
+    # ---------------------------------------------------------------- interne
+
+    def _submit(self, func, host):
+        """Lance func sur host, sauf si l'appel précédent à cet hôte tourne encore (None)."""
+        name = host["name"]
+        service = self.service(name)
+        context = contextvars.copy_context()
+        with self._lock:
+            previous = self._inflight.get(name)
+            if previous is not None and not previous.done():
+                return None
+            future = self._executor.submit(context.run, func, host, service)
+            self._inflight[name] = future
+        future.add_done_callback(lambda f: self._done(name, f))
+        return future
+
+    def _done(self, name, future):
+        with self._lock:
+            if self._inflight.get(name) is future:
+                del self._inflight[name]
+
+    def _activate(self, host):
+        pool_manager.get_pool(host["uri"]).resize(host["pool_size"])
+        get_domain_cache(host["uri"]).start()
+
+    def _load(self):
+        with self._lock:
+            if self._hosts is None:
+                with SessionLocal() as db:
+                    self._hosts = {h.name: h.to_dict() for h in db.query(Hypervisor).all()}
+            return self._hosts
+
+    def _reload(self):
+        with self._lock:
+            self._hosts = None
+
+
+registry = HypervisorRegistry()
@@ -0,0 +1,112 @@
+"""
+Vue paginée de l'inventaire d'un hyperviseur (GET /vms) : filtres, projection
+de champs, curseur, et rendu JSON mis en cache par génération du cache de
+domaines (les sondages répétés ne re-sérialisent rien).
+"""
+import base64
+import bisect
+import collections
+import json
+import threading
+
+import libvirt
+
+
+FIELDS = ("name", "state", "memory", "vcpus")
+
+STATES = {
+    "nostate": libvirt.VIR_DOMAIN_NOSTATE,
+    "running": libvirt.VIR_DOMAIN_RUNNING,
+    "blocked": libvirt.VIR_DOMAIN_BLOCKED,
+    "paused": libvirt.VIR_DOMAIN_PAUSED,
+    "shutdown": libvirt.VIR_DOMAIN_SHUTDOWN,
+    "shutoff": libvirt.VIR_DOMAIN_SHUTOFF,
+    "crashed": libvirt.VIR_DOMAIN_CRASHED,
+    "pmsuspended": libvirt.VIR_DOMAIN_PMSUSPENDED,
+}
+
+
+def parse_state(value):
+    """ "running" ou "1" -> 1. Lève ValueError si l'état est inconnu."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    if value not in STATES:
+        raise ValueError(f"État inconnu : {value} (attendu : {', '.join(STATES)} ou un code numérique)")
+    return STATES[value]
+
+
+def parse_fields(value):
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"Champ(s) inconnu(s) : {', '.join(unknown)} (disponibles : {', '.join(FIELDS)})")
+    return tuple(dict.fromkeys(fields))
+
+
+def encode_cursor(name):
+    return base64.urlsafe_b64encode(name.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Curseur invalide")
+
+
+def select(vms, names, state=None, prefix=None, after=None, limit=None, fields=None):
+    """
+    VMs (triées par nom) qui passent les filtres, à partir du nom suivant after.
+    names est la liste des noms de vms (même ordre) : le début est trouvé par
+    bisect, et le parcours s'arrête dès que limit résultats sont trouvés.
+    Renvoie (résultats, nom de la dernière VM renvoyée si la page est pleine).
+    """
+    start = 0
+    if prefix:
+        start = bisect.bisect_left(names, prefix)
+    if after is not None:
+        start = max(start, bisect.bisect_right(names, after))
+
+    result = []
+    last = None
+    for vm in vms[start:] if start else vms:
+        if prefix and not vm["name"].startswith(prefix):
+            break
+        if state is not None and vm["state"] != state:
+            continue
+        if limit is not None and len(result) == limit:
+            return result, last
+        result.append({f: vm[f] for f in fields} if fields else vm)
+        last = vm["name"]
+    return result, None
+
+
+class RenderCache:
+    """Derniers corps JSON rendus, par (hyperviseur, génération, paramètres)."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = render()
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def render(items, next_cursor):
+    body = json.dumps(items, separators=(",", ":")).encode()
+    return body, next_cursor
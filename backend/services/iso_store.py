@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from utils import config
+
+
+class UploadSession:
+    """Upload d'ISO en cours : fichier partiel + SHA-256 calculé au fil de l'eau."""
+
+    def __init__(self, upload_id, filename, size=None, sha256=None, created_at=None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size            # taille annoncée (optionnelle)
+        self.sha256 = sha256        # empreinte annoncée (optionnelle)
+        self.created_at = created_at or time.time()
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self.sha256,
+            "offset": self.offset,
+            "created_at": self.created_at,
+        }
+
+
+class IsoStore:
+    """
+    Stockage des ISO adressé par contenu : ISO_DIR/<sha256>.iso.
+
+    - les uploads sont écrits sur disque par blocs pendant le calcul du SHA-256
+      (jamais l'ISO entière en mémoire)
+    - ils sont reprenables : le fichier partiel et la session survivent à une
+      coupure (et à un redémarrage du processus)
+    - une ISO déjà connue n'est stockée qu'une fois ; si le client annonce son
+      empreinte et qu'elle existe déjà, l'upload se termine immédiatement
+    """
+
+    def __init__(self, root=None):
+        self.root = root or config.ISO_DIR
+        self.partial_dir = os.path.join(self.root, ".partial")
+        self.index_path = os.path.join(self.root, "index.json")
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._sessions = {}
+
+    # ---------------------------------------------------------------- catalogue
+
+    def list(self):
+        with self._lock:
+            return sorted(self._load().values(), key=lambda iso: iso["created_at"])
+
+    def get(self, sha256):
+        with self._lock:
+            return self._load().get(sha256)
+
+    def delete(self, sha256):
+        with self._lock:
+            index = self._load()
+            iso = index.pop(sha256, None)
+            if iso is None:
+                return {"error": f"ISO {sha256} introuvable"}
+            self._save(index)
+        try:
+            os.remove(iso["path"])
+        except OSError:
+            pass
+        return {"message": f"ISO {sha256} supprimée"}
+
+    # ------------------------------------------------------------------ uploads
+
+    def start_upload(self, filename, size=None, sha256=None):
+        """
+        Ouvre une session d'upload. Si sha256 est fourni et déjà stocké,
+        renvoie directement l'ISO existante ({"iso": ...}) sans rien transférer.
+        """
+        if sha256:
+            sha256 = sha256.lower()
+            existing = self._reuse(sha256, filename)
+            if existing:
+                return {"status": "exists", "iso": existing}
+
+        os.makedirs(self.partial_dir, exist_ok=True)
+        session = UploadSession(uuid.uuid4().hex, filename, size=size, sha256=sha256)
+        open(self._partial_path(session.id), "wb").close()
+        with open(self._session_path(session.id), "w") as f:
+            json.dump(session.to_dict(), f)
+        with self._lock:
+            self._sessions[session.id] = session
+        return {"status": "created", **session.to_dict()}
+
+    def upload_status(self, upload_id):
+        session = self._session(upload_id)
+        return session.to_dict() if session else None
+
+    def write_chunk(self, upload_id, offset, data):
+        """
+        Ajoute data à la position offset (qui doit être la fin actuelle du fichier
+        partiel). Renvoie {"offset": nouvelle position} ou {"error": ...}.
+        """
+        session = self._session(upload_id)
+        if session is None:
+            return {"error": f"Upload {upload_id} introuvable"}
+        with session.lock:
+            if offset != session.offset:
+                return {"error": f"Position {offset} invalide, attendu {session.offset}", "offset": session.offset}
+            if session.size is not None and offset + len(data) > session.size:
+                return {"error": "Données au-delà de la taille annoncée", "offset": session.offset}
+            with open(self._partial_path(upload_id), "ab") as f:
+                f.write(data)
+            session.hasher.update(data)
+            session.offset += len(data)
+            return {"offset": session.offset}
+
+    def finish_upload(self, upload_id):
+        """Vérifie taille et empreinte puis range l'ISO sous son SHA-256 (dédupliquée)."""
+        session = self._session(upload_id)
+        if session is None:
+            return {"error": f"Upload {upload_id} introuvable"}
+        with session.lock:
+            if session.size is not None and session.offset != session.size:
+                return {"error": f"Upload incomplet ({session.offset}/{session.size} octets)"}
+            digest = session.hasher.hexdigest()
+            if session.sha256 and session.sha256 != digest:
+                self._drop_session(upload_id)
+                return {"error": f"Empreinte différente de celle annoncée ({digest})"}
+
+            iso = self._reuse(digest, session.filename)
+            if iso:
+                os.remove(self._partial_path(upload_id))
+            else:
+                iso = self._add(self._partial_path(upload_id), digest, session.offset, session.filename)
+            self._drop_session(upload_id)
+            return {"status": "stored", "iso": iso}
+
+    def abort_upload(self, upload_id):
+        if self._session(upload_id) is None:
+            return {"error": f"Upload {upload_id} introuvable"}
+        self._drop_session(upload_id)
+        return {"message": f"Upload {upload_id} annulé"}
+
+    # ---------------------------------------------------------------- interne
+
+    def _reuse(self, sha256, filename):
+        with self._lock:
+            index = self._load()
+            iso = index.get(sha256)
+            if iso is None or not os.path.exists(iso["path"]):
+                return None
+            if filename and filename not in iso["names"]:
+                iso["names"].append(filename)
+                self._save(index)
+            return iso
+
+    def _add(self, tmp_path, sha256, size, filename):
+        path = os.path.join(self.root, f"{sha256}.iso")
+        os.replace(tmp_path, path)
+        iso = {
+            "sha256": sha256,
+            "path": path,
+            "size": size,
+            "names": [filename] if filename else [],
+            "created_at": time.time(),
+        }
+        with self._lock:
+            index = self._load()
+            index[sha256] = iso
+            self._save(index)
+        return iso
+
+    def _session(self, upload_id):
+        if not upload_id.isalnum():
+            return None
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                session = self._restore_session(upload_id)
+            return session
+
+    def _restore_session(self, upload_id):
+        # Appelé avec le verrou tenu : reprise après redémarrage du processus
+        try:
+            with open(self._session_path(upload_id)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        session = UploadSession(
+            upload_id, meta["filename"], size=meta.get("size"),
+            sha256=meta.get("sha256"), created_at=meta.get("created_at"),
+        )
+        # Le hash en cours est perdu : on le recalcule sur ce qui a déjà été reçu
+        try:
+            with open(self._partial_path(upload_id), "rb") as f:
+                for block in iter(lambda: f.read(config.ISO_CHUNK_SIZE), b""):
+                    session.hasher.update(block)
+                    session.offset += len(block)
+        except OSError:
+            return None
+        self._sessions[upload_id] = session
+        return session
+
+    def _drop_session(self, upload_id):
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        for path in (self._partial_path(upload_id), self._session_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _partial_path(self, upload_id):
+        return os.path.join(self.partial_dir, f"{upload_id}.part")
+
+    def _session_path(self, upload_id):
+        return os.path.join(self.partial_dir, f"{upload_id}.json")
+
+    def _load(self):
+        # Appelé avec le verrou tenu
+        if self._index is None:
+            try:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {}
+        return self._index
+
+    def _save(self, index):
+        # Appelé avec le verrou tenu ; écriture atomique
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+
+iso_store = IsoStore()
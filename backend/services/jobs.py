@@ -0,0 +1,256 @@
+import collections
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import config
+
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class Job:
+    """
+    Opération longue (création, clone, migration, snapshot) exécutée en arrière-plan.
+    La fonction de travail reçoit le Job : elle peut publier sa progression
+    (set_progress) et enregistrer de quoi s'interrompre (on_cancel).
+    """
+
+    def __init__(self, kind, target, hypervisor, storage_pool=None, params=None, limits=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.hypervisor = hypervisor
+        self.storage_pool = storage_pool
+        self.params = params or {}
+        self.limits = dict(limits or {})   # limites supplémentaires : clé -> jobs simultanés max
+
+        self.state = PENDING
+        self.progress = 0.0
+        self.details = {}
+        self.result = None
+        self.error = None
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._func = None
+        self._lock = threading.Lock()
+        self._cancel_requested = threading.Event()
+        self._cancel_callbacks = []
+
+    @property
+    def pool_key(self):
+        """
+        Clé de limite du pool de stockage : (hyperviseur, pool). Deux hyperviseurs
+        ont chacun leur IMAGES_DIR, même s'il porte le même chemin.
+        """
+        return (self.hypervisor, self.storage_pool) if self.storage_pool else None
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+    def set_progress(self, percent=None, **details):
+        with self._lock:
+            if percent is not None:
+                self.progress = max(0.0, min(100.0, float(percent)))
+            self.details.update(details)
+
+    def on_cancel(self, callback):
+        """
+        Enregistre callback() pour interrompre l'opération en cours
+        (ex: dom.abortJob, process.terminate). Appelé tout de suite si
+        l'annulation a déjà été demandée.
+        """
+        with self._lock:
+            if not self._cancel_requested.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def _request_cancel(self):
+        with self._lock:
+            self._cancel_requested.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        errors = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                errors.append(str(e))
+        return errors
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "target": self.target,
+                "hypervisor": self.hypervisor,
+                "storage_pool": self.storage_pool,
+                "params": self.params,
+                "state": self.state,
+                "progress": round(self.progress, 1),
+                "details": dict(self.details),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "duration": (
+                    (self.finished_at or time.time()) - self.started_at
+                    if self.started_at else None
+                ),
+            }
+
+
+class JobManager:
+    """
+    File de jobs avec un pool de workers borné.
+    Un job ne démarre que si les limites de son hyperviseur et de son pool de
+    stockage le permettent ; sinon il reste en attente sans occuper de worker.
+    """
+
+    def __init__(self, workers=None, per_hypervisor=None, per_storage_pool=None, history=None):
+        self.workers = workers or config.JOB_WORKERS
+        self.per_hypervisor = per_hypervisor or config.JOBS_PER_HYPERVISOR
+        self.per_storage_pool = per_storage_pool or config.JOBS_PER_STORAGE_POOL
+        self.history = history or config.JOB_HISTORY
+
+        self._lock = threading.Lock()
+        self._jobs = collections.OrderedDict()
+        self._pending = collections.deque()
+        self._running_total = 0
+        self._running_by_hypervisor = collections.Counter()
+        self._running_by_pool = collections.Counter()
+        self._running_by_key = collections.Counter()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._listeners = []
+
+    def submit(self, kind, target, func, hypervisor, storage_pool=None, params=None, limits=None):
+        """
+        Met en file func(job). func renvoie un dict au format des services
+        ({"message": ...} ou {"error": ...}). Retourne le Job immédiatement.
+        limits : limites propres à l'appelant, {clé: jobs simultanés max} ; le job
+        attend (sans occuper de worker) que chacune de ses clés ait une place.
+        """
+        job = Job(kind, target, hypervisor, storage_pool, params, limits)
+        job._func = func
+        with self._lock:
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._trim()
+        self._dispatch()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, state=None, kind=None, target=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [
+            j for j in reversed(jobs)
+            if (state is None or j.state == state)
+            and (kind is None or j.kind == kind)
+            and (target is None or j.target == target)
+        ]
+
+    def cancel(self, job_id):
+        """Annule un job en attente, ou demande l'interruption d'un job en cours."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {"error": f"Job {job_id} introuvable"}
+            if job.state in FINISHED_STATES:
+                return {"error": f"Job {job_id} déjà terminé ({job.state})"}
+            if job.state == PENDING:
+                self._pending.remove(job)
+                job.state = CANCELLED
+                job.finished_at = time.time()
+                job._request_cancel()
+                return {"message": f"Job {job_id} annulé"}
+
+        errors = job._request_cancel()
+        if errors:
+            return {"error": f"Annulation du job {job_id} impossible : {'; '.join(errors)}"}
+        return {"message": f"Annulation du job {job_id} demandée"}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _dispatch(self):
+        with self._lock:
+            for job in list(self._pending):
+                if self._running_total >= self.workers:
+                    break
+                if self._running_by_hypervisor[job.hypervisor] >= self.per_hypervisor:
+                    continue
+                if job.pool_key and self._running_by_pool[job.pool_key] >= self.per_storage_pool:
+                    continue
+                if any(self._running_by_key[key] >= limit for key, limit in job.limits.items()):
+                    continue
+                self._pending.remove(job)
+                self._running_total += 1
+                self._running_by_hypervisor[job.hypervisor] += 1
+                if job.pool_key:
+                    self._running_by_pool[job.pool_key] += 1
+                self._running_by_key.update(job.limits.keys())
+                job.state = RUNNING
+                job.started_at = time.time()
+                self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            result = job._func(job)
+        except Exception as e:
+            result = {"error": f"Erreur inattendue : {e}"}
+
+        with self._lock:
+            if job.cancel_requested and isinstance(result, dict) and "error" in result:
+                job.state = CANCELLED
+                job.error = result["error"]
+            elif isinstance(result, dict) and "error" in result:
+                job.state = FAILED
+                job.error = result["error"]
+            else:
+                job.state = SUCCEEDED
+                job.progress = 100.0
+            job.result = result
+            job.finished_at = time.time()
+            job._func = None
+
+            self._running_total -= 1
+            self._running_by_hypervisor[job.hypervisor] -= 1
+            if job.pool_key:
+                self._running_by_pool[job.pool_key] -= 1
+            self._running_by_key.subtract(job.limits.keys())
+        for callback in self._listeners:
+            try:
+                callback(job)
+            except Exception:
+                pass
+        self._dispatch()
+
+    def add_listener(self, callback):
+        """callback(job) est appelé à la fin de chaque job (succès, échec ou annulation)."""
+        self._listeners.append(callback)
+
+    def _trim(self):
+        # Appelé avec le verrou tenu : on oublie les plus vieux jobs terminés
+        finished = [j for j in self._jobs.values() if j.state in FINISHED_STATES]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+
+job_manager = JobManager()
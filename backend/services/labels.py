@@ -0,0 +1,72 @@
+"""
+Labels des VMs (clé=valeur), stockés dans les métadonnées du domaine libvirt
+(<metadata><orch:labels>...</orch:labels></metadata>) : ils suivent la VM
+(migration, clone) sans base externe.
+"""
+import re
+import xml.etree.ElementTree as ET
+
+
+LABELS_URI = "http://orchestrateur/labels/1.0"
+LABELS_PREFIX = "orch"
+
+_KEY = re.compile(r"^[A-Za-z0-9]([A-Za-z0-9._/-]{0,62}[A-Za-z0-9])?$")
+
+
+def validate(labels):
+    """Lève ValueError si une clé ou une valeur est invalide."""
+    for key, value in labels.items():
+        if not _KEY.match(key):
+            raise ValueError(f"Clé de label invalide : {key}")
+        if not isinstance(value, str) or len(value) > 255:
+            raise ValueError(f"Valeur de label invalide pour {key}")
+
+
+def to_xml(labels):
+    root = ET.Element("labels")
+    for key, value in sorted(labels.items()):
+        ET.SubElement(root, "label", key=key).text = value
+    return ET.tostring(root, encoding="unicode")
+
+
+def from_xml(xml):
+    root = ET.fromstring(xml)
+    return {label.get("key"): label.text or "" for label in root.iter("label") if label.get("key")}
+
+
+def parse_selector(selector):
+    """
+    "env=prod,tier!=db,owner" -> [("env", "=", "prod"), ("tier", "!=", "db"), ("owner", "exists", None)]
+    Lève ValueError si le sélecteur est invalide.
+    """
+    terms = []
+    for item in (selector or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "!=" in item:
+            key, _, value = item.partition("!=")
+            op = "!="
+        elif "=" in item:
+            key, _, value = item.partition("=")
+            op = "="
+        else:
+            key, value, op = item, None, "exists"
+        key = key.strip()
+        if not _KEY.match(key):
+            raise ValueError(f"Sélecteur invalide : {item}")
+        terms.append((key, op, value.strip() if value is not None else None))
+    if not terms:
+        raise ValueError("Sélecteur vide")
+    return terms
+
+
+def matches(labels, terms):
+    for key, op, value in terms:
+        if op == "exists" and key not in labels:
+            return False
+        if op == "=" and labels.get(key) != value:
+            return False
+        if op == "!=" and labels.get(key) == value:
+            return False
+    return True
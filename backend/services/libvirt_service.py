@@ -1,109 +1,252 @@
+import contextlib
 import libvirt
 import os
 import subprocess
+import threading
 import xml.etree.ElementTree as ET
 import time
-
-
+import urllib.parse
+import uuid
+
+from services.connection_pool import pool_manager
+from services.domain_cache import get_domain_cache
+from services.domain_xml import domain_xml
+from services import domain_profiles
+from services import domain_stats
+from services import labels as vm_labels
+from services import migration
+from services import snapshots
+from services.template_service import template_store
+from services.perf import instrumented
+from utils import config
+
+
+CLONE_MODES = ("full", "linked")
+STOP_MODES = ("shutdown", "hibernate")
+
+# Sérialise le placement NUMA et la définition des VMs épinglées ou en hugepages
+_pinning_lock = threading.Lock()
+
+
+@instrumented(
+    "service",
+    private=("_run_command", "_wait_until_off", "_freeze_base", "_copy_disk",
+             "_snapshot_external", "_consolidate", "_commit_live", "_numa_placement", "_hibernate",
+             "_define_and_start"),
+)
 class LibvirtService:
-    def __init__(self, uri="qemu:///system"):
-        self.uri = uri
+    def __init__(self, uri=None, pool=None):
+        self.uri = uri or config.LIBVIRT_URI
+        # Toutes les instances partagent le même gestionnaire de pools (une connexion
+        # longue durée par URI au lieu d'un libvirt.open() à chaque appel)
+        self.pool = pool or pool_manager
 
     def connect(self):
+        """
+        Emprunte une connexion au pool de self.uri.
+        conn.close() la rend au pool ; renvoie None si l'hyperviseur est injoignable.
+        """
+        return self.pool.connect(self.uri)
+
+    def _run_command(self, cmd, job=None, on_tick=None):
+        """
+        Lance une commande externe (qemu-img, cp...) sans passer par un shell.
+        Avec un job : on_tick() est appelé chaque seconde (progression) et
+        l'annulation du job tue la commande.
+        Renvoie None si tout s'est bien passé, sinon le message d'erreur.
+        """
         try:
-            return libvirt.open(self.uri)
-        except libvirt.libvirtError:
-            return None
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+            )
+        except OSError as e:
+            return f"Impossible de lancer {cmd[0]} : {e.strerror}"
+
+        if job is not None:
+            job.on_cancel(proc.terminate)
+
+        while True:
+            try:
+                _, stderr = proc.communicate(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                if on_tick:
+                    on_tick()
+
+        if job is not None and job.cancel_requested:
+            return "Opération annulée"
+        if proc.returncode != 0:
+            return (stderr or "").strip() or f"{cmd[0]} a échoué (code {proc.returncode})"
+        return None
 
     def list_vms(self):
         conn = self.connect()
         if not conn:
             return {"error": "Impossible de se connecter à l'hyperviseur"}
-        domains = conn.listAllDomains()
-        vms = []
-        for d in domains:
-            info = d.info()
-            vms.append({
-                "name": d.name(),
-                "state": d.state()[0],
-                "memory": info[1] // 1024,  # Mo
-                "vcpus": info[3],
-            })
+        try:
+            # Un seul appel pour tous les domaines (au lieu de info() + state() par domaine)
+            records = domain_stats.collect(conn, domain_stats.SUMMARY_GROUPS)
+            vms = [domain_stats.summarize(dom, raw) for dom, raw in records]
+        except libvirt.libvirtError as e:
+            conn.close()
+            return {"error": f"Erreur libvirt lors de la lecture des VMs: {e}"}
         conn.close()
         return vms
 
-    def create_vm(self, name, memory=512, disk_size=10, iso_path=None):
+    def domain_stats(self, fields=None):
+        """
+        Statistiques détaillées de tous les domaines en un appel getAllDomainStats.
+        fields : groupes voulus parmi state, balloon, vcpu, cpu, block, interface
+        (tous par défaut) ; on ne paie que les groupes demandés.
+        """
+        try:
+            groups = domain_stats.parse_fields(fields)
+        except ValueError as e:
+            return {"error": str(e)}
+
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            records = domain_stats.collect(conn, groups)
+            stats = [
+                {"name": dom.name(), **domain_stats.group_stats(raw, groups)}
+                for dom, raw in records
+            ]
+        except libvirt.libvirtError as e:
+            conn.close()
+            return {"error": f"Erreur libvirt lors de la collecte des statistiques: {e}"}
+        conn.close()
+        return {"fields": groups, "domains": stats}
+
+    def create_vm(self, name, memory=512, disk_size=10, iso_path=None, template=None, job=None, vcpus=None,
+                  profile=None, overrides=None):
+        """
+        Crée et démarre une VM :
+        - depuis une ISO : disque vierge de disk_size Go, installation de l'OS
+        - depuis un template : overlay qcow2 sur l'image de référence (disk_size ignoré),
+          pris dans le pool chaud du template s'il y en a un
+        profile : réglages de performance (voir services.domain_profiles), overrides
+        surcharge certains champs ; vcpus est un raccourci de overrides["vcpus"].
+        """
+        overrides = dict(overrides or {})
+        if vcpus is not None:
+            overrides["vcpus"] = vcpus
+        try:
+            settings = domain_profiles.resolve(profile, overrides)
+        except ValueError as e:
+            return {"error": str(e)}
+
         conn = self.connect()
         if not conn:
             return {"error": "Connexion échouée à libvirt (uri: %s)" % self.uri}
 
         # Chemin du disque
-        disk_path = f"/var/lib/libvirt/images/{name}.qcow2"
+        disk_path = os.path.join(config.IMAGES_DIR, f"{name}.qcow2")
+        if os.path.exists(disk_path):
+            conn.close()
+            return {"error": f"Le disque {disk_path} existe déjà"}
 
         # Création du disque qcow2
+        if template:
+            error = template_store.acquire_disk(template, disk_path)
+        else:
+            error = self._run_command(
+                ["qemu-img", "create", "-f", "qcow2", disk_path, f"{disk_size}G"], job=job
+            )
+        if error:
+            conn.close()
+            return {"error": f"Erreur lors de la création du disque: {error}"}
+        if job is not None:
+            job.set_progress(50, step="disque créé")
+
+        # Placement NUMA et définition sous un même verrou : deux créations
+        # simultanées ne peuvent pas réserver les mêmes CPUs
+        numa = settings["pinning"] != "none" or settings["hugepages"]
+        with _pinning_lock if numa else contextlib.nullcontext():
+            result = self._define_and_start(conn, name, memory, disk_path, settings, numa, iso_path, template)
+        conn.close()
+        if "error" in result:
+            # Sinon le disque orphelin bloquerait toute nouvelle tentative avec ce nom
+            try:
+                os.remove(disk_path)
+            except OSError:
+                pass
+            return result
+        placement = result["placement"]
+
+        notes = "".join(f" ({note})" for note in (placement or {}).get("notes", []))
+        return {"message": f"VM '{name}' créée avec succès (profil {settings['profile']}){notes}"}
+
+    def _define_and_start(self, conn, name, memory, disk_path, settings, numa, iso_path, template):
+        """Définit et démarre la VM de create_vm : {"placement"} ou {"error"} (domaine retiré)."""
+        placement = None
+        if numa:
+            try:
+                placement = self._numa_placement(conn, settings, memory)
+            except (ValueError, libvirt.libvirtError) as e:
+                return {"error": f"Profil {settings['profile']} impossible sur cet hôte : {e}"}
+
+        # Un template est déjà installé : on démarre sur le disque
+        xml = domain_profiles.build_domain(
+            name, memory, disk_path, settings, placement,
+            iso_path=iso_path, boot_from_disk=bool(template and not iso_path),
+        )
+
         try:
-            os.system(f"qemu-img create -f qcow2 {disk_path} {disk_size}G")
-        except Exception as e:
-            return {"error": f"Erreur lors de la création du disque: {e}"}
-
-        # Si une ISO est fournie, on ajoute le lecteur CD
-        iso_xml = f"""
-            <disk type='file' device='cdrom'>
-              <driver name='qemu' type='raw'/>
-              <source file='{iso_path}'/>
-              <target dev='hda' bus='ide'/>
-              <readonly/>
-            </disk>
-        """ if iso_path else ""
-
-        # XML de la VM
-        xml = f"""
-            <domain type='kvm'>
-              <name>{name}</name>
-              <memory unit='MiB'>{memory}</memory>
-              <vcpu>1</vcpu>
-              <os>
-                <type arch='x86_64'>hvm</type>
-                <boot dev='cdrom'/>
-                <boot dev='hd'/>
-              </os>
-              <devices>
-                <disk type='file' device='disk'>
-                  <driver name='qemu' type='qcow2'/>
-                  <source file='{disk_path}'/>
-                  <target dev='vda' bus='virtio'/>
-                </disk>
-                {iso_xml}
-                <interface type='network'>
-                  <source network='default'/>
-                  <model type='virtio'/>
-                </interface>
-                <graphics type='vnc' port='-1'/>
-              </devices>
-            </domain>
-        """
+            conn.lookupByName(name)
+            # defineXML redéfinirait le domaine existant, retiré ensuite en cas d'échec
+            return {"error": f"La VM {name} existe déjà"}
+        except libvirt.libvirtError:
+            pass
 
+        dom = None
         try:
             dom = conn.defineXML(xml)
             if dom is None:
-                conn.close()
                 return {"error": "defineXML a renvoyé None (XML invalide ?)"}
-
             dom.create()
-            conn.close()
-            return {"message": f"VM '{name}' créée avec succès"}
         except libvirt.libvirtError as e:
-            conn.close()
+            if dom is not None:
+                # Définition sans disque : on la retire avec lui
+                try:
+                    dom.undefine()
+                except libvirt.libvirtError:
+                    pass
             return {"error": f"Erreur libvirt lors de la création: {e}"}
-
-    def migrate_vm(self, name, destination_uri):
+        return {"placement": placement}
+
+    def _numa_placement(self, conn, settings, memory):
+        topology = domain_profiles.HostTopology(conn.getCapabilities())
+        used = set()
+        if settings["pinning"] == "dedicated":
+            for dom in conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE):
+                used |= domain_xml.describe(self.uri, dom).dedicated_cpus
+        free_pages = None
+        size = topology.hugepage_size()
+        if settings["hugepages"] and size:
+            free_pages = conn.getFreePages([size], 0, len(topology.cells))
+        return domain_profiles.plan(topology, settings, memory, used, free_pages)
+
+    def migrate_vm(self, name, destination_uri, job=None, options=None):
         """
-        Migration live d'une VM vers un autre hyperviseur.
+        Migration live d'une VM vers un autre hyperviseur, via l'API libvirt.
         destination_uri doit être de la forme : qemu+ssh://user@IP/system
+        options : réglages de migration (voir services.migration.build_migration)
+
+        La connexion à la destination est ouverte par ce processus (comme le faisait
+        virsh migrate), d'où migrate3() plutôt que migrateToURI3() en peer-to-peer.
+        Avec un job : progression via jobStats() et annulation via abortJob().
         """
+        options = options or {}
         if not destination_uri.startswith("qemu+ssh://"):
             return {"error": "URI de destination invalide (attendu: qemu+ssh://user@hote/system)"}
 
+        try:
+            flags, params = migration.build_migration(options)
+        except ValueError as e:
+            return {"error": str(e)}
+
         conn = self.connect()
         if not conn:
             return {"error": "Impossible de se connecter à l'hyperviseur source"}
@@ -119,24 +262,49 @@ class LibvirtService:
             conn.close()
             return {"error": f"La VM {name} n'est pas active. Démarre-la avant une migration live."}
 
-        cmd = [
-            "virsh", "-c", "qemu:///system", "migrate",
-            "--live", "--persistent", "--verbose",
-            "--copy-storage-all", "--undefinesource",
-            name,
-            destination_uri,
-        ]
+        dconn = self.pool.connect(destination_uri)
+        if not dconn:
+            conn.close()
+            return {"error": f"Impossible de se connecter à l'hyperviseur destination {destination_uri}"}
+
+        monitor = migration.MigrationMonitor(
+            dom,
+            job=job,
+            max_downtime=options.get("max_downtime"),
+            postcopy_after=options.get("postcopy_after"),
+        )
+        if job is not None:
+            job.on_cancel(dom.abortJob)
+        monitor.start()
 
         try:
-            res = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            conn.close()
-            return {"message": f"Migration de {name} vers {destination_uri} réussie"}
-        except subprocess.CalledProcessError as e:
+            dom.migrate3(dconn.raw, params, flags)
+            error = None
+        except libvirt.libvirtError as e:
+            error = str(e)
+        finally:
+            # postcopy_started et last_stats ne sont lus qu'une fois le suivi terminé
+            monitor.stop()
+            monitor.join()
+            dconn.close()
             conn.close()
-            return {"error": e.stderr or f"Erreur lors de la migration de {name}"}
 
-    def start_vm(self, name):
-        conn = libvirt.open("qemu:///system")
+        if error:
+            if job is not None and job.cancel_requested:
+                return {"error": f"Migration de {name} annulée"}
+            return {"error": f"Erreur lors de la migration de {name} : {error}"}
+        return {
+            "message": f"Migration de {name} vers {destination_uri} réussie",
+            "postcopy": monitor.postcopy_started,
+        }
+
+    def start_vm(self, name, cold=False):
+        """
+        Démarre la VM. Si elle a été mise en veille (stop mode=hibernate), son
+        état mémoire est restauré au lieu d'un démarrage à froid ; cold=True
+        jette l'image de sauvegarde et redémarre à froid.
+        """
+        conn = self.connect()
         if not conn:
             return {"error": "Impossible de se connecter à l'hyperviseur"}
 
@@ -150,19 +318,186 @@ class LibvirtService:
             conn.close()
             return {"message": f"VM {name} est déjà en cours d'exécution"}
 
+        save_path = self._save_path(name)
+        start = time.monotonic()
         try:
-            dom.create()
-            message = f"VM {name} démarrée avec succès"
+            if save_path and os.path.exists(save_path) and not cold:
+                conn.restoreFlags(save_path, None, self._save_flags())
+                self._remove_save(save_path)
+                message = f"VM {name} restaurée depuis {save_path} en {time.monotonic() - start:.1f} s"
+            else:
+                if save_path and os.path.exists(save_path):
+                    self._remove_save(save_path)
+                managed = dom.hasManagedSaveImage(0)
+                if managed and cold:
+                    dom.managedSaveRemove(0)
+                # create() restaure l'image managedSave s'il y en a une
+                dom.create()
+                if managed and not cold:
+                    message = f"VM {name} restaurée (managedSave) en {time.monotonic() - start:.1f} s"
+                else:
+                    message = f"VM {name} démarrée avec succès"
         except libvirt.libvirtError as e:
             message = f"Erreur lors du démarrage de {name}: {str(e)}"
 
         conn.close()
         return {"message": message}
 
-    def stop_vm(self, name):
-        import time
+    def resume_vm(self, name):
+        """Reprend une VM en pause (sans effet si elle tourne déjà)."""
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            dom = conn.lookupByName(name)
+            if dom.state()[0] == libvirt.VIR_DOMAIN_PAUSED:
+                dom.resume()
+            elif not dom.isActive():
+                return {"error": f"VM {name} arrêtée"}
+        except libvirt.libvirtError as e:
+            return {"error": f"Impossible de reprendre {name} : {e}"}
+        finally:
+            conn.close()
+        return {"message": f"VM {name} reprise"}
+
+    def pause_vm(self, name):
+        """Met une VM active en pause (sans effet si elle l'est déjà)."""
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            dom = conn.lookupByName(name)
+            if dom.state()[0] == libvirt.VIR_DOMAIN_RUNNING:
+                dom.suspend()
+            elif not dom.isActive():
+                return {"error": f"VM {name} arrêtée"}
+        except libvirt.libvirtError as e:
+            return {"error": f"Impossible de mettre {name} en pause : {e}"}
+        finally:
+            conn.close()
+        return {"message": f"VM {name} en pause"}
+
+    def list_pool_vms(self, prefix, label):
+        """
+        {nom: (valeur du label, état)} des domaines dont le nom commence par
+        prefix et qui portent le label (métadonnées lues pour ceux-là seulement).
+        """
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        result = {}
+        try:
+            for dom in conn.listAllDomains():
+                if not dom.name().startswith(prefix):
+                    continue
+                value = self._read_labels(dom).get(label)
+                if value is not None:
+                    result[dom.name()] = (value, dom.state()[0])
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            conn.close()
+        return result
+
+    def get_labels(self, name):
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            dom = conn.lookupByName(name)
+        except libvirt.libvirtError:
+            conn.close()
+            return {"error": f"VM {name} introuvable"}
+        labels = self._read_labels(dom)
+        conn.close()
+        return {"name": name, "labels": labels}
+
+    def set_labels(self, name, labels):
+        """Remplace les labels de la VM (métadonnées du domaine, config persistante + live)."""
+        try:
+            vm_labels.validate(labels)
+        except ValueError as e:
+            return {"error": str(e)}
+
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            dom = conn.lookupByName(name)
+        except libvirt.libvirtError:
+            conn.close()
+            return {"error": f"VM {name} introuvable"}
+
+        flags = libvirt.VIR_DOMAIN_AFFECT_CONFIG
+        if dom.isActive():
+            flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
+        try:
+            dom.setMetadata(
+                libvirt.VIR_DOMAIN_METADATA_ELEMENT,
+                vm_labels.to_xml(labels) if labels else None,
+                vm_labels.LABELS_PREFIX,
+                vm_labels.LABELS_URI,
+                flags,
+            )
+        except libvirt.libvirtError as e:
+            conn.close()
+            return {"error": f"Impossible d'enregistrer les labels de {name}: {e}"}
+        conn.close()
+        return {"message": f"Labels de {name} mis à jour", "labels": labels}
+
+    def list_labels(self):
+        """{nom: labels} de tous les domaines (une lecture de métadonnées par domaine)."""
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            result = {dom.name(): self._read_labels(dom) for dom in conn.listAllDomains()}
+        except libvirt.libvirtError as e:
+            conn.close()
+            return {"error": str(e)}
+        conn.close()
+        return result
+
+    @staticmethod
+    def _read_labels(dom):
+        try:
+            xml = dom.metadata(libvirt.VIR_DOMAIN_METADATA_ELEMENT, vm_labels.LABELS_URI, 0)
+        except libvirt.libvirtError:
+            # VIR_ERR_NO_DOMAIN_METADATA : aucun label
+            return {}
+        return vm_labels.from_xml(xml)
+
+    def _wait_until_off(self, dom, timeout):
+        """
+        Attend que la VM soit éteinte (au plus timeout secondes).
+        Réveillé par les événements de cycle de vie du cache d'état ; si le cache
+        n'est pas connecté, on retombe sur une interrogation périodique.
+        """
+        cache = get_domain_cache(self.uri)
+        name = dom.name()
+        deadline = time.monotonic() + timeout
+        while True:
+            # L'entrée est lue AVANT isActive() pour ne rater aucun événement
+            entry = cache.get(name)
+            if not dom.isActive():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if cache.status()["connected"]:
+                cache.wait_for_change(name, entry, remaining)
+            else:
+                time.sleep(min(0.2, remaining))
+
+    def stop_vm(self, name, mode="shutdown"):
+        """
+        mode="shutdown"  : arrêt propre (ACPI), forcé après SHUTDOWN_TIMEOUT secondes
+        mode="hibernate" : état mémoire sauvegardé sur disque, restauré par start_vm
+        """
+        if mode not in STOP_MODES:
+            return {"error": f"Mode d'arrêt inconnu : {mode} (disponibles : {', '.join(STOP_MODES)})"}
 
-        conn = libvirt.open("qemu:///system")
+        conn = self.connect()
         if not conn:
             return {"error": "Impossible de se connecter à l'hyperviseur"}
 
@@ -176,13 +511,15 @@ class LibvirtService:
             conn.close()
             return {"message": f"VM {name} est déjà arrêtée"}
 
+        if mode == "hibernate":
+            result = self._hibernate(dom, name)
+            conn.close()
+            return result
+
         try:
             dom.shutdown()
-            for _ in range(5):
-                time.sleep(1)
-                if not dom.isActive():
-                    break
-            if dom.isActive():
+            # Arrêt propre, puis arrêt forcé si l'invité ne répond pas à temps
+            if not self._wait_until_off(dom, config.SHUTDOWN_TIMEOUT):
                 dom.destroy()
             message = f"VM {name} arrêtée avec succès"
         except libvirt.libvirtError as e:
@@ -190,10 +527,75 @@ class LibvirtService:
 
         conn.close()
         return {"message": message}
+
+    def _hibernate(self, dom, name):
+        save_path = self._save_path(name)
+        start = time.monotonic()
+        try:
+            if save_path:
+                dom.saveFlags(save_path, None, self._save_flags())
+            else:
+                dom.managedSave(self._save_flags())
+        except libvirt.libvirtError as e:
+            return {"error": f"Erreur lors de la mise en veille de {name}: {e}"}
+        return {
+            "message": f"VM {name} mise en veille en {time.monotonic() - start:.1f} s",
+            "save": self._saved_state(dom, name),
+        }
+
+    def saved_state(self, name):
+        """Image de mise en veille de la VM : {"saved", "mode", "path", "size", "apparent_size"}."""
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
+        try:
+            dom = conn.lookupByName(name)
+            state = self._saved_state(dom, name)
+        except libvirt.libvirtError:
+            return {"error": f"VM {name} introuvable"}
+        finally:
+            conn.close()
+        return {"name": name, "saved": state is not None, **(state or {})}
+
+    def _saved_state(self, dom, name):
+        save_path = self._save_path(name)
+        if save_path and os.path.exists(save_path):
+            mode = "file"
+        elif dom.hasManagedSaveImage(0):
+            mode = "managed"
+            # Lisible seulement pour l'hyperviseur local (et avec les droits)
+            save_path = os.path.join(config.MANAGED_SAVE_DIR, f"{name}.save")
+        else:
+            return None
+        try:
+            st = os.stat(save_path)
+            size, apparent = st.st_blocks * 512, st.st_size
+        except OSError:
+            size = apparent = None
+        return {"mode": mode, "path": save_path, "size": size, "apparent_size": apparent}
+
+    def _save_path(self, name):
+        """Image de sauvegarde dans SAVE_DIR ; None : managedSave (SAVE_DIR vide ou hyperviseur distant)."""
+        if not config.SAVE_DIR or urllib.parse.urlparse(self.uri).hostname:
+            return None
+        return os.path.join(config.SAVE_DIR, f"{name}.save")
+
+    @staticmethod
+    def _save_flags():
+        return libvirt.VIR_DOMAIN_SAVE_BYPASS_CACHE if config.SAVE_BYPASS_CACHE else 0
+
+    @staticmethod
+    def _remove_save(save_path):
+        try:
+            os.remove(save_path)
+        except OSError:
+            pass
+
     def reboot_vm(self, name):
         """
         Redémarrage "hard" d'une VM :
-        - si la VM est active : destroy -> attendre qu'elle soit éteinte -> pause 2s -> start
+        - si la VM est active : destroy -> attendre qu'elle soit éteinte -> pause -> start
+          (pause = REBOOT_PAUSE secondes, 0 par défaut : le flux /vms/events montre déjà l'arrêt)
         - si la VM est arrêtée : start
         """
         conn = self.connect()
@@ -212,13 +614,10 @@ class LibvirtService:
                 dom.destroy()
 
                 # On attend qu'elle soit vraiment éteinte (max ~2s)
-                for _ in range(10):
-                    time.sleep(0.2)
-                    if not dom.isActive():
-                        break
+                self._wait_until_off(dom, 2)
 
-                # On laisse 2 secondes bien visibles en "éteinte"
-                time.sleep(2)
+                if config.REBOOT_PAUSE:
+                    time.sleep(config.REBOOT_PAUSE)
 
                 # On redémarre
                 dom.create()
@@ -286,39 +685,85 @@ class LibvirtService:
             return {"error": f"VM {name} introuvable"}
 
         try:
-            xml_desc = dom.XMLDesc()
+            description = domain_xml.describe(self.uri, dom)
         except libvirt.libvirtError as e:
             conn.close()
             return {"error": f"Impossible de récupérer le XML de {name} : {e}"}
+        except ET.ParseError as e:
+            conn.close()
+            return {"error": f"Erreur lors de l'analyse du XML de {name} : {e}"}
+        conn.close()
 
-        try:
-            root = ET.fromstring(xml_desc)
-            gfx = root.find("./devices/graphics[@type='vnc']")
-            if gfx is None:
-                conn.close()
-                return {"error": "Aucune console VNC définie pour cette VM"}
+        gfx = description.console("vnc")
+        if gfx is None:
+            return {"error": "Aucune console VNC définie pour cette VM"}
+        if gfx.port is None:
+            return {"error": "Port VNC non encore assigné. Vérifie que la VM est démarrée."}
 
-            port = gfx.get("port")
-            listen = gfx.get("listen") or "127.0.0.1"
+        return {"uri": f"vnc://{gfx.listen or '127.0.0.1'}:{gfx.port}"}
 
-            if port is None or port == "-1":
-                conn.close()
-                return {"error": "Port VNC non encore assigné. Vérifie que la VM est démarrée."}
+    def open_console(self, name: str):
+        """
+        Point d'accès au serveur VNC de la VM pour le proxy WebSocket :
+        - {"fd": fd}              : socket déjà connecté (openGraphicsFD, hyperviseur local)
+        - {"host": h, "port": p}  : adresse TCP du serveur VNC (hyperviseur distant)
+        openGraphicsFD transmet un descripteur de fichier : seulement possible sur
+        une connexion locale (socket unix), et sans exposer le port VNC.
+        """
+        conn = self.connect()
+        if not conn:
+            return {"error": "Impossible de se connecter à l'hyperviseur"}
 
-            uri = f"vnc://{listen}:{port}"
-            conn.close()
-            return {"uri": uri}
-        except Exception as e:
+        try:
+            dom = conn.lookupByName(name)
+        except libvirt.libvirtError:
             conn.close()
+            return {"error": f"VM {name} introuvable"}
+
+        try:
+            if not dom.isActive():
+                return {"error": f"VM {name} arrêtée : pas de console"}
+            description = domain_xml.describe(self.uri, dom)
+            gfx = description.console("vnc")
+            if gfx is None:
+                return {"error": "Aucune console VNC définie pour cette VM"}
+            hostname = urllib.parse.urlparse(self.uri).hostname
+            if not hostname:
+                try:
+                    return {"fd": dom.openGraphicsFD(description.graphics.index(gfx), 0)}
+                except (libvirt.libvirtError, AttributeError):
+                    pass    # libvirt trop ancien ou socket VNC non local : connexion TCP
+            if gfx.port is None:
+                return {"error": "Port VNC non encore assigné. Vérifie que la VM est démarrée."}
+            listen = gfx.listen
+            if not listen or listen in ("0.0.0.0", "::") or (hostname and listen in ("127.0.0.1", "::1", "localhost")):
+                # Écoute sur toutes les interfaces (ou en local sur un hôte distant) : l'hôte de l'URI
+                listen = hostname or "127.0.0.1"
+            return {"host": listen, "port": gfx.port}
+        except libvirt.libvirtError as e:
+            return {"error": f"Impossible d'ouvrir la console de {name} : {e}"}
+        except ET.ParseError as e:
             return {"error": f"Erreur lors de l'analyse du XML de {name} : {e}"}
+        finally:
+            conn.close()
 
-    def clone_vm(self, source_name, target_name):
+    def clone_vm(self, source_name, target_name, job=None, mode="full", base_snapshot=False):
         """
         Clone une VM :
-        - copie du disque qcow2
+        - disque : copie complète (mode="full") ou overlay qcow2 (mode="linked")
         - copie du XML libvirt
         - création d'une nouvelle VM avec un nom différent
+
+        mode="full"   : copie par reflink si le système de fichiers le permet,
+                        sinon qemu-img convert (copie creuse, chaîne aplatie)
+        mode="linked" : le clone est un overlay qcow2 dont la base est le disque
+                        actuel de la source, figé par un snapshot externe disque seul.
+                        Quasi instantané et minuscule. Pour une source active, le
+                        snapshot de base doit être demandé explicitement (base_snapshot=True).
         """
+        if mode not in CLONE_MODES:
+            return {"error": f"Mode de clone inconnu : {mode} (attendu : {', '.join(CLONE_MODES)})"}
+
         conn = self.connect()
         if not conn:
             return {"error": "Impossible de se connecter à l'hyperviseur"}
@@ -330,11 +775,13 @@ class LibvirtService:
             conn.close()
             return {"error": f"VM source {source_name} introuvable"}
 
-        # 2. Récupérer le XML source
-        xml_src = dom_src.XMLDesc()
-
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(xml_src)
+        # 2. Récupérer le XML source (copie modifiable de la description en cache)
+        try:
+            description = domain_xml.describe(self.uri, dom_src)
+        except libvirt.libvirtError as e:
+            conn.close()
+            return {"error": f"Impossible de récupérer le XML de {source_name} : {e}"}
+        root = description.tree()
 
         # Changer le nom
         name_elem = root.find("name")
@@ -346,47 +793,175 @@ class LibvirtService:
             root.remove(uuid_elem)
 
         # 3. Récupérer le disque de la VM source
-        disk_path_src = None
-        for disk in root.findall("./devices/disk"):
-            if disk.get("device") == "disk":
-                source = disk.find("source")
-                if source is not None and "file" in source.attrib:
-                    disk_path_src = source.attrib["file"]
-                    break
+        disk = description.primary_disk()
+        disk_path_src = disk.path if disk else None
+        disk_target = (disk and disk.target) or "vda"
+        disk_format = (disk and disk.format) or "qcow2"
 
         if not disk_path_src:
             conn.close()
             return {"error": "Impossible de trouver le disque source"}
 
         # Nouveau disque
-        disk_path_dst = f"/var/lib/libvirt/images/{target_name}.qcow2"
+        disk_path_dst = os.path.join(config.IMAGES_DIR, f"{target_name}.qcow2")
+        if os.path.exists(disk_path_dst):
+            # Disque d'une autre VM (ou reste d'un clone) : ni écrasé, ni supprimé en cas d'échec
+            conn.close()
+            return {"error": f"Le disque {disk_path_dst} existe déjà"}
+
+        if mode == "full" and dom_src.isActive():
+            # Copie d'un disque en cours d'écriture : image incohérente (et verrou qemu)
+            conn.close()
+            return {"error": (
+                f"La VM source {source_name} est active : arrête-la pour un clone complet, "
+                "ou fais un clone lié (mode=linked, base_snapshot=true)"
+            )}
+
+        if mode == "linked":
+            # Base figée par un clone précédent, sans écriture depuis : réutilisée
+            # (pas de nouvel overlay dans la chaîne de la source)
+            reusable = self._reusable_base(dom_src, disk_path_src)
+            if reusable:
+                base_path, base_format = reusable
+            else:
+                if dom_src.isActive() and not base_snapshot:
+                    conn.close()
+                    return {"error": (
+                        f"La VM source {source_name} est active : un clone lié nécessite "
+                        "un snapshot de base (base_snapshot=true) pour figer son disque"
+                    )}
+
+                # La source continue dans un nouvel overlay ; son disque actuel devient la base
+                try:
+                    self._freeze_base(dom_src, disk_target)
+                except libvirt.libvirtError as e:
+                    conn.close()
+                    return {"error": f"Impossible de figer le disque de {source_name} : {e}"}
+                finally:
+                    # Le disque de la source est désormais l'overlay : pas d'événement de cycle de vie
+                    domain_xml.invalidate(self.uri, dom_src)
+                base_path, base_format = disk_path_src, disk_format
+
+            error = self._run_command(
+                ["qemu-img", "create", "-f", "qcow2",
+                 "-F", base_format, "-b", base_path, disk_path_dst],
+                job=job,
+            )
+        else:
+            error = self._copy_disk(disk_path_src, disk_path_dst, job=job)
 
-        # Copier le disque
-        os.system(f"cp {disk_path_src} {disk_path_dst}")
+        if error:
+            conn.close()
+            if os.path.exists(disk_path_dst):
+                os.remove(disk_path_dst)
+            return {"error": f"Erreur lors de la copie du disque : {error}"}
 
         # Modifier le XML avec le nouveau chemin
         for disk in root.findall("./devices/disk"):
             if disk.get("device") == "disk":
                 source = disk.find("source")
                 source.set("file", disk_path_dst)
+                driver = disk.find("driver")
+                if driver is not None:
+                    driver.set("type", "qcow2")
 
         # 4. Générer le nouveau XML
         new_xml = ET.tostring(root, encoding="unicode")
 
-        # 5. Définir la nouvelle VM
+        # 5. Définir la nouvelle VM (le disque créé est supprimé si elle ne l'est pas)
         try:
             dom_new = conn.defineXML(new_xml)
-            if dom_new is None:
-                conn.close()
-                return {"error": "Impossible de définir la VM clonée"}
+            error = None if dom_new is not None else "Impossible de définir la VM clonée"
         except libvirt.libvirtError as e:
-            conn.close()
-            return {"error": f"Erreur libvirt : {e}"}
-
+            error = f"Erreur libvirt : {e}"
         conn.close()
-        return {"message": f"VM {source_name} clonée vers {target_name}"}
+        if error:
+            if os.path.exists(disk_path_dst):
+                os.remove(disk_path_dst)
+            return {"error": error}
+
+        return {"message": f"VM {source_name} clonée vers {target_name} (clone {'lié' if mode == 'linked' else 'complet'})"}
+
+    def _freeze_base(self, dom, disk_target):
+        """
+        Snapshot externe "disque seul" : la VM écrit désormais dans un nouvel
+        overlay et son disque actuel devient une base en lecture seule,
+        utilisable comme backing file par des clones liés.
+        """
+        # Deux clones dans la même seconde ne doivent pas viser le même overlay
+        stamp = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        overlay = os.path.join(config.IMAGES_DIR, f"{dom.name()}.{stamp}.qcow2")
+        xml = f"""
+        <domainsnapshot>
+            <name>{snapshots.CLONE_BASE_PREFIX}{stamp}</name>
+            <description>Base figée pour clones liés</description>
+            <memory snapshot='no'/>
+            <disks>
+                <disk name='{disk_target}' snapshot='external'>
+                    <driver type='qcow2'/>
+                    <source file='{overlay}'/>
+                </disk>
+            </disks>
+        </domainsnapshot>
+        """
+        dom.snapshotCreateXML(
+            xml,
+            libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC,
+        )
+        return overlay
+
+    @staticmethod
+    def _reusable_base(dom, disk_path):
+        """
+        (chemin, format) de la base figée par le dernier _freeze_base si la VM
+        n'a rien écrit dans son overlay depuis, sinon None.
+        """
+        try:
+            if not dom.hasCurrentSnapshot(0):
+                return None
+            current = snapshots.describe(dom.snapshotCurrent(0))
+            if not current["name"].startswith(snapshots.CLONE_BASE_PREFIX):
+                return None
+            if disk_path not in (d["file"] for d in current["disks"]):
+                return None
+            chain = snapshots.backing_chain(disk_path)
+            if len(chain) < 2 or snapshots.has_writes(disk_path):
+                return None
+        except (libvirt.libvirtError, RuntimeError, ET.ParseError):
+            return None
+        return chain[1]["filename"], chain[1]["format"] or "qcow2"
+
+    def _copy_disk(self, src, dst, job=None):
+        """
+        Copie complète d'un disque, toujours en qcow2 autonome (sans backing file) :
+        - reflink (cp --reflink=always) si la source en est déjà un : instantané
+          sur btrfs/XFS, blocs partagés (les trous sont conservés : GNU cp refuse
+          --sparse avec --reflink=always)
+        - sinon qemu-img convert : copie creuse, chaîne aplatie, format converti
+        La source doit être arrêtée (voir clone_vm).
+        """
+        def report_progress():
+            if os.path.exists(dst):
+                job.set_progress(100.0 * os.path.getsize(dst) / max(os.path.getsize(src), 1))
 
+        on_tick = report_progress if job is not None else None
 
+        try:
+            chain = snapshots.backing_chain(src)
+        except RuntimeError:
+            chain = []
+        # Une image raw ou un overlay copiés tels quels ne seraient pas un qcow2 autonome
+        if len(chain) == 1 and chain[0]["format"] == "qcow2":
+            if self._run_command(["cp", "--reflink=always", src, dst]) is None:
+                return None
+            if job is not None and job.cancel_requested:
+                return "Opération annulée"
+            if os.path.exists(dst):
+                os.remove(dst)
+
+        return self._run_command(
+            ["qemu-img", "convert", "-O", "qcow2", src, dst], job=job, on_tick=on_tick
+        )
 
     def delete_vm(self, name):
         """
@@ -415,34 +990,27 @@ class LibvirtService:
             conn.close()
             return {"error": f"Impossible d'arrêter la VM {name} : {e}"}
 
-        # 🔥 2) SUPPRIMER AUTOMATIQUEMENT LES SNAPSHOTS
-        try:
-            snapshots = dom.snapshotListNames()
-            for snap_name in snapshots:
-                snap = dom.snapshotLookupByName(snap_name)
-                snap.delete()   # suppression individuelle
-        except libvirt.libvirtError:
-            pass  # s'il n'y a pas de snapshots → ok
+        # 🔥 2) SNAPSHOTS : les données des snapshots internes partent avec le disque,
+        # seules les métadonnées comptent (UNDEFINE_SNAPSHOTS_METADATA ci-dessous).
+        # Sans ce flag : métadonnées supprimées arbre par arbre, un appel par racine.
+        if not hasattr(libvirt, "VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA"):
+            try:
+                for root_snap in dom.listAllSnapshots(libvirt.VIR_DOMAIN_SNAPSHOT_LIST_ROOTS):
+                    root_snap.delete(
+                        libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_CHILDREN | libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_METADATA_ONLY
+                    )
+            except libvirt.libvirtError:
+                pass  # s'il n'y a pas de snapshots → ok
 
         # 🔥 3) Récupérer le disque principal via le XML
         try:
-            xml_desc = dom.XMLDesc()
+            disk = domain_xml.describe(self.uri, dom).primary_disk()
         except libvirt.libvirtError as e:
             conn.close()
             return {"error": f"Impossible de récupérer le XML de {name} : {e}"}
-
-        import xml.etree.ElementTree as ET
-        disk_path = None
-        try:
-            root = ET.fromstring(xml_desc)
-            for disk in root.findall("./devices/disk"):
-                if disk.get("device") == "disk":
-                    source = disk.find("source")
-                    if source is not None:
-                        disk_path = source.attrib.get("file")
-                    break
-        except Exception:
-            disk_path = None
+        except ET.ParseError:
+            disk = None
+        disk_path = disk.path if disk else None
 
         # 🔥 4) UNDEFINE AVEC FLAGS SNAPSHOT
         try:
@@ -459,6 +1027,11 @@ class LibvirtService:
 
         conn.close()
 
+        # Image de mise en veille hors managedSave (celle de managedSave part avec l'undefine)
+        save_path = self._save_path(name)
+        if save_path:
+            self._remove_save(save_path)
+
         # 🔥 5) SUPPRIMER LE DISQUE QCOW2
         if disk_path and os.path.exists(disk_path):
             try:
@@ -473,7 +1046,17 @@ class LibvirtService:
 
 
 
-    def snapshot_create(self, name, snapshot_name):
+    def snapshot_create(self, name, snapshot_name, job=None, mode="internal", quiesce=True):
+        """
+        mode="internal" : snapshot dans le qcow2 (avec la mémoire si la VM tourne ;
+                          la VM est suspendue pendant la sauvegarde)
+        mode="external" : snapshot disque seul, un overlay qcow2 par disque ; quasi
+                          instantané quelle que soit la taille des images. quiesce :
+                          systèmes de fichiers figés par l'agent invité, si disponible.
+        """
+        if mode not in snapshots.SNAPSHOT_MODES:
+            return {"error": f"Mode de snapshot inconnu : {mode} (attendu : {', '.join(snapshots.SNAPSHOT_MODES)})"}
+
         conn = self.connect()
         if not conn:
             return {"error": "Connexion à libvirt impossible"}
@@ -486,6 +1069,11 @@ class LibvirtService:
 
         is_running = dom.isActive()
 
+        if mode == "external":
+            result = self._snapshot_external(dom, name, snapshot_name, quiesce and is_running)
+            conn.close()
+            return result
+
         # VM en marche → snapshot AVEC mémoire (live)
         if is_running:
             xml = f"""
@@ -511,6 +1099,10 @@ class LibvirtService:
             </domainsnapshot>
             """
 
+        if job is not None and is_running:
+            # La sauvegarde de la mémoire peut être interrompue
+            job.on_cancel(dom.abortJob)
+
         try:
             dom.snapshotCreateXML(xml, 0)
             conn.close()
@@ -519,20 +1111,70 @@ class LibvirtService:
             conn.close()
             return {"error": str(e)}
 
+    def _snapshot_external(self, dom, name, snapshot_name, quiesce):
+        try:
+            disks = [d for d in domain_xml.describe(self.uri, dom).disks if d.device == "disk" and d.path]
+        except libvirt.libvirtError as e:
+            return {"error": f"Impossible de récupérer le XML de {name} : {e}"}
+        if not disks:
+            return {"error": f"Aucun disque fichier à snapshotter pour {name}"}
+
+        xml = snapshots.external_xml(name, snapshot_name, disks)
+        flags = libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC
+        note = ""
+        try:
+            try:
+                dom.snapshotCreateXML(xml, flags | (libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_QUIESCE if quiesce else 0))
+            except libvirt.libvirtError:
+                if not quiesce:
+                    raise
+                # Pas d'agent invité joignable : snapshot cohérent « crash » plutôt qu'aucun snapshot
+                dom.snapshotCreateXML(xml, flags)
+                note = " (sans quiesce : agent invité indisponible)"
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            domain_xml.invalidate(self.uri, dom)
+        return {"message": f"Snapshot externe '{snapshot_name}' créé avec succès{note}"}
 
     def snapshot_list(self, name):
+        """Noms des snapshots + métadonnées (date, parent, état, type, taille) en une lecture groupée."""
         conn = self.connect()
         if not conn:
             return {"error": "Connexion impossible"}
 
         try:
             dom = conn.lookupByName(name)
-            snaps = dom.snapshotListNames()
+            items = [info for _, info in self._list_snapshots(dom)]
             conn.close()
-            return {"snapshots": snaps}
         except libvirt.libvirtError as e:
             conn.close()
             return {"error": str(e)}
+        return {
+            "snapshots": [item["name"] for item in items],
+            "current": next((item["name"] for item in items if item["current"]), None),
+            "details": items,
+        }
+
+    def snapshot_tree(self, name):
+        """Arbre des snapshots (racines et leurs enfants imbriqués)."""
+        result = self.snapshot_list(name)
+        if "error" in result:
+            return result
+        return {
+            "vm": name,
+            "current": result["current"],
+            "count": len(result["details"]),
+            "size": sum(item["size"] or 0 for item in result["details"]),
+            "tree": snapshots.build_tree(result["details"]),
+        }
+
+    def _list_snapshots(self, dom):
+        try:
+            disk = domain_xml.describe(self.uri, dom).primary_disk()
+        except ET.ParseError:
+            disk = None
+        return snapshots.list_all(dom, disk.path if disk else None)
 
     def snapshot_restore(self, name, snapshot_name):
         conn = self.connect()
@@ -551,17 +1193,198 @@ class LibvirtService:
 
 
     def snapshot_delete(self, name, snapshot_name):
+        result = self.snapshot_delete_many(name, [snapshot_name])
+        if "error" in result:
+            return result
+        if result["errors"]:
+            return {"error": result["errors"][snapshot_name]}
+        return {"message": f"Snapshot '{snapshot_name}' supprimé"}
+
+    def snapshot_delete_many(self, name, snapshot_names=None, job=None):
+        """
+        Supprime plusieurs snapshots (tous si snapshot_names est None) à partir
+        d'une seule lecture. Un sous-arbre entièrement sélectionné de snapshots
+        internes part en un appel (DELETE_CHILDREN) ; les autres sont supprimés
+        des feuilles vers la racine, les externes par fusion de leurs overlays.
+        """
         conn = self.connect()
         if not conn:
             return {"error": "Connexion impossible"}
-
         try:
             dom = conn.lookupByName(name)
-            snapshot = dom.snapshotLookupByName(snapshot_name, 0)
-            snapshot.delete(flags=0)
+            listed = self._list_snapshots(dom)
+        except libvirt.libvirtError as e:
             conn.close()
-            return {"message": f"Snapshot '{snapshot_name}' supprimé"}
+            return {"error": str(e)}
+
+        items = [info for _, info in listed]
+        by_name = {info["name"]: (snap, info) for snap, info in listed}
+        selected = set(by_name) if snapshot_names is None else set(snapshot_names)
+        errors = {n: f"Snapshot '{n}' introuvable" for n in selected - set(by_name)}
+        selected &= set(by_name)
+        deleted = []
+
+        for item in items:
+            snap_name = item["name"]
+            if snap_name not in selected or item["parent"] in selected:
+                continue
+            subtree = snapshots.descendants(items, snap_name) | {snap_name}
+            if subtree <= selected and all(by_name[n][1]["type"] == "internal" for n in subtree):
+                try:
+                    by_name[snap_name][0].delete(libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_CHILDREN)
+                    deleted.extend(n for n in (i["name"] for i in items) if n in subtree)
+                except libvirt.libvirtError as e:
+                    errors[snap_name] = str(e)
+                selected -= subtree
+
+        # Le reste : des feuilles vers la racine
+        for item in reversed(items):
+            snap_name = item["name"]
+            if snap_name not in selected:
+                continue
+            if job is not None and job.cancel_requested:
+                errors[snap_name] = "Opération annulée"
+                continue
+            snap, info = by_name[snap_name]
+            try:
+                if info["type"] == "external":
+                    error = self._consolidate(dom, snap, info, job=job)
+                    if error:
+                        errors[snap_name] = error
+                        continue
+                else:
+                    snap.delete(0)
+                deleted.append(snap_name)
+            except libvirt.libvirtError as e:
+                errors[snap_name] = str(e)
+            if job is not None:
+                job.set_progress(100.0 * (len(deleted) + len(errors)) / max(len(by_name), 1))
+
+        conn.close()
+        return {
+            "message": f"{len(deleted)} snapshot(s) supprimé(s) sur {name}",
+            "deleted": deleted,
+            "errors": errors,
+        }
+
+    def snapshot_prune(self, name, keep, job=None):
+        """Ne garde que les keep snapshots les plus récents (les bases de clones liés sont conservées)."""
+        conn = self.connect()
+        if not conn:
+            return {"error": "Connexion impossible"}
+        try:
+            dom = conn.lookupByName(name)
+            items = [info for _, info in snapshots.list_all(dom)]
         except libvirt.libvirtError as e:
             conn.close()
             return {"error": str(e)}
+        conn.close()
+
+        candidates = [i for i in items if not i["name"].startswith(snapshots.CLONE_BASE_PREFIX)]
+        candidates.sort(key=lambda i: i["created_at"] or 0, reverse=True)
+        expired = [i["name"] for i in candidates[keep:]]
+        if not expired:
+            return {"message": f"Aucun snapshot à supprimer sur {name}", "deleted": [], "errors": {}}
+        return self.snapshot_delete_many(name, expired, job=job)
+
+    def _consolidate(self, dom, snapshot, info, job=None):
+        """
+        Supprime un snapshot externe. Chaque overlay créé par le snapshot est
+        fusionné dans l'image qu'il recouvre (block commit : actif si l'overlay
+        est la couche courante, suivi d'un pivot), l'image suivante est raccrochée
+        à cette base, puis l'overlay et les métadonnées sont supprimés.
+        Renvoie None ou le message d'erreur.
+        """
+        if info["name"].startswith(snapshots.CLONE_BASE_PREFIX):
+            return f"{info['name']} fige la base de clones liés : suppression refusée"
 
+        # libvirt >= 9.0 sait supprimer lui-même les snapshots externes
+        try:
+            snapshot.delete(0)
+            domain_xml.invalidate(self.uri, dom)
+            return None
+        except libvirt.libvirtError as e:
+            if e.get_error_code() not in (libvirt.VIR_ERR_CONFIG_UNSUPPORTED, libvirt.VIR_ERR_OPERATION_UNSUPPORTED):
+                return str(e)
+
+        try:
+            description = domain_xml.describe(self.uri, dom)
+            active = dom.isActive()
+            # Un seul arbre pour tous les disques, redéfini une fois après la boucle
+            root = None
+            # Overlays fusionnés : supprimés seulement une fois le domaine redéfini
+            committed = []
+            error = None
+            for disk in info["disks"]:
+                if disk["snapshot"] != "external" or not disk["file"]:
+                    continue
+                current = next((d for d in description.disks if d.target == disk["name"]), None)
+                if current is None or not current.path:
+                    error = f"Disque {disk['name']} absent de la VM"
+                    break
+                chain = snapshots.backing_chain(current.path)
+                index = next((i for i, image in enumerate(chain) if image["filename"] == disk["file"]), None)
+                if index is None or not chain[index]["backing"]:
+                    error = f"Overlay {disk['file']} absent de la chaîne de {disk['name']}"
+                    break
+                overlay, base = chain[index], chain[index + 1]
+
+                if active:
+                    error = self._commit_live(dom, disk["name"], overlay["filename"], base["filename"], index == 0, job)
+                elif index == 0:
+                    error = self._run_command(["qemu-img", "commit", overlay["filename"]], job=job)
+                    if error is None:
+                        # L'overlay était la couche courante : le domaine repart de la base
+                        if root is None:
+                            root = description.tree()
+                        for elem in root.findall("./devices/disk"):
+                            target = elem.find("target")
+                            if target is not None and target.get("dev") == disk["name"]:
+                                elem.find("source").set("file", base["filename"])
+                                driver = elem.find("driver")
+                                if driver is not None and base["format"]:
+                                    driver.set("type", base["format"])
+                else:
+                    child = chain[index - 1]
+                    error = self._run_command(["qemu-img", "commit", overlay["filename"]], job=job) or self._run_command(
+                        ["qemu-img", "rebase", "-u", "-F", base["format"] or "qcow2",
+                         "-b", base["filename"], child["filename"]],
+                    )
+                if error:
+                    error = f"Fusion de {overlay['filename']} impossible : {error}"
+                    break
+                committed.append(overlay["filename"])
+
+            # Même après un échec, les disques déjà fusionnés repartent de leur base
+            if root is not None:
+                dom.connect().defineXML(ET.tostring(root, encoding="unicode"))
+            for path in committed:
+                os.remove(path)
+            if error:
+                return error
+
+            snapshot.delete(libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_METADATA_ONLY)
+        except (libvirt.libvirtError, RuntimeError, OSError) as e:
+            return str(e)
+        finally:
+            domain_xml.invalidate(self.uri, dom)
+        return None
+
+    def _commit_live(self, dom, disk, top, base, pivot, job=None):
+        """Block commit de top dans base sur une VM active ; pivot si top est la couche courante."""
+        flags = libvirt.VIR_DOMAIN_BLOCK_COMMIT_ACTIVE if pivot else 0
+        dom.blockCommit(disk, base, top, 0, flags)
+        if job is not None:
+            job.on_cancel(lambda: dom.blockJobAbort(disk, 0))
+        while True:
+            info = dom.blockJobInfo(disk, 0)
+            if not info:
+                # Commit non actif : le job se termine seul, la chaîne est déjà raccrochée
+                break
+            if job is not None and job.cancel_requested:
+                return "Opération annulée"
+            if pivot and info["end"] and info["cur"] == info["end"]:
+                dom.blockJobAbort(disk, libvirt.VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT)
+                break
+            time.sleep(0.5)
+        return None
@@ -0,0 +1,298 @@
+"""
+Métriques de performance des VMs : échantillonnage groupé (getAllDomainStats)
+de tous les domaines de chaque hyperviseur, conversion des compteurs en débits,
+stockage dans des tampons circulaires de taille fixe (mémoire bornée).
+"""
+import array
+import math
+import re
+import threading
+import time
+
+import libvirt
+
+from services import domain_stats
+from services.inventory import registry
+from utils import config
+
+
+# Groupes getAllDomainStats nécessaires aux métriques
+SAMPLE_GROUPS = ("state", "cpu", "balloon", "vcpu", "block", "interface")
+
+# Métrique -> (unité, description) ; toutes sont des jauges (débits déjà calculés)
+METRICS = {
+    "cpu_percent": ("%", "Utilisation CPU rapportée au nombre de vCPUs"),
+    "memory_used_mb": ("Mo", "Mémoire utilisée par l'invité (balloon available - unused)"),
+    "memory_current_mb": ("Mo", "Mémoire allouée à l'invité (balloon current)"),
+    "disk_read_bps": ("o/s", "Lecture disque"),
+    "disk_write_bps": ("o/s", "Écriture disque"),
+    "disk_read_iops": ("op/s", "Opérations de lecture disque"),
+    "disk_write_iops": ("op/s", "Opérations d'écriture disque"),
+    "net_rx_bps": ("o/s", "Réception réseau"),
+    "net_tx_bps": ("o/s", "Émission réseau"),
+}
+
+# Compteurs bruts cumulés -> métrique de débit correspondante
+_COUNTERS = {
+    "cpu_time": "cpu_percent",
+    "disk_read_bytes": "disk_read_bps",
+    "disk_write_bytes": "disk_write_bps",
+    "disk_read_reqs": "disk_read_iops",
+    "disk_write_reqs": "disk_write_iops",
+    "net_rx_bytes": "net_rx_bps",
+    "net_tx_bytes": "net_tx_bps",
+}
+
+_RANGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_range(value):
+    """ "15m" / "1h" / "300" -> secondes. Lève ValueError si la durée est invalide."""
+    if not value:
+        return config.METRICS_RETENTION
+    match = re.fullmatch(r"(\d+)([smhd]?)", value.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Durée invalide : {value} (ex: 300, 15m, 1h)")
+    return int(match.group(1)) * _RANGE_UNITS[match.group(2) or "s"]
+
+
+class RingSeries:
+    """
+    Séries temporelles d'une VM : un tableau de doubles pré-alloué par métrique
+    (array('d')), plus celui des horodatages. L'écriture écrase la plus ancienne
+    mesure : la mémoire ne dépend que de la capacité, pas de la durée de fonctionnement.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array.array("d", [0.0]) * capacity
+        self.values = {m: array.array("d", [math.nan]) * capacity for m in METRICS}
+        self.head = 0       # prochaine position écrite
+        self.count = 0
+
+    def append(self, timestamp, sample):
+        self.timestamps[self.head] = timestamp
+        for metric, values in self.values.items():
+            value = sample.get(metric)
+            values[self.head] = math.nan if value is None else value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if not self.count:
+            return None
+        index = (self.head - 1) % self.capacity
+        return self.timestamps[index], {m: v[index] for m, v in self.values.items()}
+
+    def since(self, start):
+        """(horodatages, {métrique: valeurs}) des mesures postérieures à start, dans l'ordre."""
+        first = (self.head - self.count) % self.capacity
+        indexes = [(first + i) % self.capacity for i in range(self.count)]
+        indexes = [i for i in indexes if self.timestamps[i] >= start]
+        return (
+            [self.timestamps[i] for i in indexes],
+            {m: [_json_value(v[i]) for i in indexes] for m, v in self.values.items()},
+        )
+
+
+def _json_value(value):
+    return None if math.isnan(value) else round(value, 3)
+
+
+class MetricsCollector:
+    """Échantillonneur périodique (METRICS_INTERVAL) de tous les hyperviseurs actifs."""
+
+    def __init__(self, interval=None, retention=None):
+        self.interval = interval or config.METRICS_INTERVAL
+        self.retention = retention or config.METRICS_RETENTION
+        self.capacity = max(1, self.retention // self.interval)
+
+        self._lock = threading.Lock()
+        self._series = {}     # (hôte, vm) -> RingSeries
+        self._counters = {}   # (hôte, vm) -> (instant, {compteur: valeur})
+        self._running = False
+        self._wakeup = threading.Event()
+        self.last_sample_at = None
+        self.last_duration = None
+
+    # ---------------------------------------------------------------- lecture
+
+    def series(self, vm, range_seconds, host=None):
+        """Mesures de vm sur les range_seconds dernières secondes (None si inconnue)."""
+        with self._lock:
+            keys = [k for k in self._series if k[1] == vm and (host is None or k[0] == host)]
+            if not keys:
+                return None
+            key = keys[0]
+            timestamps, values = self._series[key].since(time.time() - range_seconds)
+        return {
+            "vm": vm,
+            "host": key[0],
+            "interval": self.interval,
+            "range": range_seconds,
+            "units": {m: unit for m, (unit, _) in METRICS.items()},
+            "timestamps": timestamps,
+            "metrics": values,
+        }
+
+    def latest(self):
+        """[(hôte, vm, horodatage, {métrique: valeur})] : dernière mesure de chaque VM."""
+        with self._lock:
+            items = [(k, s.latest()) for k, s in self._series.items()]
+        return [(host, vm, *latest) for (host, vm), latest in sorted(items) if latest]
+
+    def counters(self):
+        """[(hôte, vm, {compteur: valeur})] : derniers compteurs cumulés bruts."""
+        with self._lock:
+            return [(host, vm, dict(c[1])) for (host, vm), c in sorted(self._counters.items())]
+
+    def status(self):
+        with self._lock:
+            vms = len(self._series)
+        return {
+            "interval": self.interval,
+            "retention": self.retention,
+            "capacity": self.capacity,
+            "vms": vms,
+            # 8 octets par valeur, horodatages compris
+            "memory_bytes": vms * self.capacity * 8 * (len(METRICS) + 1),
+            "last_sample_at": self.last_sample_at,
+            "last_duration": self.last_duration,
+        }
+
+    # ---------------------------------------------------------------- écriture
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._loop, name="metrics", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception:
+                pass
+            self.last_duration = round(time.monotonic() - started, 3)
+            # Cadence fixe, quelle que soit la durée de la collecte
+            self._wakeup.wait(max(0.0, self.interval - self.last_duration))
+
+    def sample(self):
+        results = registry.fan_out(lambda host, service: self._collect(service))
+        now = time.time()
+        with self._lock:
+            for host, outcome in results.items():
+                if outcome["status"] == "timeout":
+                    continue
+                domains = outcome.get("result") or {}
+                if outcome["status"] == "ok":
+                    # VMs disparues : on libère leurs tampons
+                    for key in [k for k in self._series if k[0] == host and k[1] not in domains]:
+                        del self._series[key]
+                        self._counters.pop(key, None)
+                for vm, raw in domains.items():
+                    self._record((host, vm), now, raw)
+        self.last_sample_at = now
+
+    @staticmethod
+    def _collect(service):
+        conn = service.connect()
+        if not conn:
+            return {"error": f"Connexion impossible à {service.uri}"}
+        try:
+            records = domain_stats.collect(conn, SAMPLE_GROUPS)
+            return {dom.name(): _flatten(raw) for dom, raw in records}
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            conn.close()
+
+    def _record(self, key, now, raw):
+        # Appelé avec le verrou tenu
+        counters = {k: raw[k] for k in _COUNTERS if k in raw}
+        sample = {
+            "memory_used_mb": raw.get("memory_used_mb"),
+            "memory_current_mb": raw.get("memory_current_mb"),
+        }
+        previous = self._counters.get(key)
+        self._counters[key] = (now, counters)
+        if previous:
+            elapsed = now - previous[0]
+            for counter, value in counters.items():
+                before = previous[1].get(counter)
+                # Compteur remis à zéro (redémarrage de la VM) : pas de débit cette fois
+                if before is None or value < before or elapsed <= 0:
+                    continue
+                sample[_COUNTERS[counter]] = (value - before) / elapsed
+            if "cpu_percent" in sample:
+                # cpu.time en ns, rapporté au nombre de vCPUs
+                sample["cpu_percent"] = sample["cpu_percent"] / 1e7 / max(raw.get("vcpus", 1), 1)
+
+        series = self._series.get(key)
+        if series is None:
+            series = RingSeries(self.capacity)
+            self._series[key] = series
+        series.append(now, sample)
+
+
+def _flatten(raw):
+    """Compteurs utiles d'un enregistrement getAllDomainStats (disques et interfaces sommés)."""
+    result = {"vcpus": raw.get("vcpu.current", 1)}
+    if raw.get("state.state") not in (libvirt.VIR_DOMAIN_RUNNING, libvirt.VIR_DOMAIN_BLOCKED, libvirt.VIR_DOMAIN_PAUSED):
+        return result
+    if "cpu.time" in raw:
+        result["cpu_time"] = raw["cpu.time"]
+    if "balloon.current" in raw:
+        result["memory_current_mb"] = raw["balloon.current"] / 1024
+    if "balloon.available" in raw and "balloon.unused" in raw:
+        result["memory_used_mb"] = (raw["balloon.available"] - raw["balloon.unused"]) / 1024
+
+    for prefix, fields in (
+        ("block", {"rd.bytes": "disk_read_bytes", "wr.bytes": "disk_write_bytes",
+                   "rd.reqs": "disk_read_reqs", "wr.reqs": "disk_write_reqs"}),
+        ("net", {"rx.bytes": "net_rx_bytes", "tx.bytes": "net_tx_bytes"}),
+    ):
+        for i in range(raw.get(f"{prefix}.count", 0)):
+            for field, counter in fields.items():
+                value = raw.get(f"{prefix}.{i}.{field}")
+                if value is not None:
+                    result[counter] = result.get(counter, 0) + value
+    return result
+
+
+# ------------------------------------------------------------------ Prometheus
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus(collector):
+    """Format d'exposition texte de Prometheus : débits (jauges) et compteurs cumulés."""
+    lines = []
+    latest = collector.latest()
+    for metric, (unit, help_text) in METRICS.items():
+        name = f"orchestrateur_vm_{metric}"
+        lines.append(f"# HELP {name} {help_text} ({unit})")
+        lines.append(f"# TYPE {name} gauge")
+        for host, vm, timestamp, values in latest:
+            value = values.get(metric)
+            if value is not None and not math.isnan(value):
+                lines.append(f'{name}{{host="{_label(host)}",vm="{_label(vm)}"}} {value:.6g}')
+
+    counters = collector.counters()
+    for counter in _COUNTERS:
+        name = f"orchestrateur_vm_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        for host, vm, values in counters:
+            if counter in values:
+                lines.append(f'{name}{{host="{_label(host)}",vm="{_label(vm)}"}} {values[counter]}')
+    return "\n".join(lines) + "\n"
+
+
+collector = MetricsCollector()
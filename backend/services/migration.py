@@ -0,0 +1,145 @@
+import threading
+
+import libvirt
+
+
+COMPRESSION_METHODS = ("xbzrle", "zstd")
+
+
+def build_migration(options):
+    """
+    Traduit les options de l'API en (flags, params) pour migrate3().
+    Lève ValueError si une option est invalide.
+
+    options :
+    - bandwidth            : débit max en MiB/s
+    - parallel_connections : nombre de connexions parallèles (multifd)
+    - compression          : "xbzrle" (pages modifiées) ou "zstd" (nécessite parallel_connections)
+    - auto_converge        : ralentit les vCPUs si la migration ne converge pas
+    - postcopy_after       : bascule en post-copy après N itérations de copie mémoire
+    - max_downtime         : interruption maximale tolérée en fin de migration (ms)
+    - copy_storage         : copie aussi les disques (stockage non partagé), True par défaut
+    """
+    flags = (
+        libvirt.VIR_MIGRATE_LIVE
+        | libvirt.VIR_MIGRATE_PERSIST_DEST
+        | libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
+    )
+    params = {}
+
+    if options.get("copy_storage", True):
+        flags |= libvirt.VIR_MIGRATE_NON_SHARED_DISK
+
+    bandwidth = options.get("bandwidth")
+    if bandwidth is not None:
+        if bandwidth <= 0:
+            raise ValueError("bandwidth doit être > 0 (MiB/s)")
+        params[libvirt.VIR_MIGRATE_PARAM_BANDWIDTH] = int(bandwidth)
+
+    parallel = options.get("parallel_connections")
+    if parallel is not None:
+        if parallel < 1:
+            raise ValueError("parallel_connections doit être >= 1")
+        flags |= libvirt.VIR_MIGRATE_PARALLEL
+        params[libvirt.VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS] = int(parallel)
+
+    compression = options.get("compression")
+    if compression:
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(
+                f"compression inconnue : {compression} (attendu : {', '.join(COMPRESSION_METHODS)})"
+            )
+        if compression == "zstd" and parallel is None:
+            raise ValueError("La compression zstd nécessite parallel_connections")
+        flags |= libvirt.VIR_MIGRATE_COMPRESSED
+        params[libvirt.VIR_MIGRATE_PARAM_COMPRESSION] = compression
+
+    if options.get("auto_converge"):
+        flags |= libvirt.VIR_MIGRATE_AUTO_CONVERGE
+
+    postcopy_after = options.get("postcopy_after")
+    if postcopy_after is not None:
+        if postcopy_after < 1:
+            raise ValueError("postcopy_after doit être >= 1 (itérations)")
+        flags |= libvirt.VIR_MIGRATE_POSTCOPY
+
+    max_downtime = options.get("max_downtime")
+    if max_downtime is not None and max_downtime <= 0:
+        raise ValueError("max_downtime doit être > 0 (ms)")
+
+    return flags, params
+
+
+class MigrationMonitor(threading.Thread):
+    """
+    Suit une migration en cours (jobStats() chaque seconde) pendant que
+    migrate3() bloque dans un autre thread :
+    - publie la progression et les métriques dans le job
+    - applique max_downtime dès que la migration a démarré
+    - bascule en post-copy après postcopy_after itérations
+    """
+
+    def __init__(self, dom, job=None, max_downtime=None, postcopy_after=None, interval=1.0):
+        super().__init__(name=f"migration:{dom.name()}", daemon=True)
+        self.dom = dom
+        self.job = job
+        self.max_downtime = max_downtime
+        self.postcopy_after = postcopy_after
+        self.interval = interval
+        self.postcopy_started = False
+        self.last_stats = {}
+        self._downtime_applied = max_downtime is None
+        # Pas "_stop" : threading.Thread a déjà une méthode _stop() (is_alive, join)
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                stats = self.dom.jobStats()
+            except libvirt.libvirtError:
+                continue
+            if stats.get("type", libvirt.VIR_DOMAIN_JOB_NONE) == libvirt.VIR_DOMAIN_JOB_NONE:
+                continue
+            self.last_stats = stats
+            self._tune(stats)
+            self._report(stats)
+
+    def _tune(self, stats):
+        if not self._downtime_applied:
+            try:
+                self.dom.migrateSetMaxDowntime(int(self.max_downtime), 0)
+                self._downtime_applied = True
+            except libvirt.libvirtError:
+                pass
+
+        if (
+            self.postcopy_after is not None
+            and not self.postcopy_started
+            and stats.get("memory_iteration", 0) >= self.postcopy_after
+        ):
+            try:
+                self.dom.migrateStartPostCopy(0)
+                self.postcopy_started = True
+            except libvirt.libvirtError:
+                pass
+
+    def _report(self, stats):
+        if self.job is None:
+            return
+        total = stats.get("data_total") or 0
+        processed = stats.get("data_processed", 0)
+        self.job.set_progress(
+            100.0 * processed / total if total else None,
+            data_total=total,
+            data_processed=processed,
+            data_remaining=stats.get("data_remaining"),
+            memory_dirty_rate=stats.get("memory_dirty_rate"),   # pages/s
+            memory_iteration=stats.get("memory_iteration"),
+            memory_bps=stats.get("memory_bps"),
+            disk_remaining=stats.get("disk_remaining"),
+            downtime_estimate=stats.get("downtime"),             # ms
+            postcopy=self.postcopy_started,
+        )
@@ -0,0 +1,318 @@
+"""
+Instrumentation : histogrammes de latence, erreurs et opérations en cours
+pour les routes HTTP, les méthodes de LibvirtService et chaque appel RPC libvirt,
+avec des traces optionnelles qui relient une requête API à ses appels libvirt.
+"""
+import bisect
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+import uuid
+
+from utils import config
+
+
+# Bornes des seaux des histogrammes (secondes)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class OperationStats:
+    """
+    Histogramme de latence + erreurs + jauge d'exécutions en cours d'une opération.
+    Chaque opération a son propre verrou : deux opérations mesurées en parallèle
+    ne se disputent rien.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(BUCKETS) + 1)   # dernier seau : au-delà de BUCKETS[-1]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.in_flight = 0
+
+    def observe(self, seconds, error=False):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Estimation par interpolation linéaire dans le seau concerné."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        # Appelé avec self.lock tenu
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "total_ms": ms(self.total),
+            "avg_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.50)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+            "max_ms": ms(self.max),
+        }
+
+
+class Trace:
+    """Requête API tracée : arbre de spans (route -> méthodes du service -> appels libvirt)."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) < config.PERF_TRACE_MAX_SPANS:
+                self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "spans": spans,
+        }
+
+
+_current_trace = contextvars.ContextVar("perf_trace", default=None)
+_current_span = contextvars.ContextVar("perf_span", default=None)
+
+
+class PerfRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()       # création des statistiques et traces seulement
+        self._operations = {}
+        self._traces = collections.deque(maxlen=config.PERF_TRACES)
+        self.started_at = time.time()
+
+    # ------------------------------------------------------------- mesures
+
+    def _stats(self, name):
+        stats = self._operations.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._operations.setdefault(name, OperationStats())
+        return stats
+
+    @contextlib.contextmanager
+    def track(self, name):
+        """Mesure le bloc : latence, erreur si exception, opération en cours pendant son exécution."""
+        stats = self._stats(name)
+        with stats.lock:
+            stats.in_flight += 1
+        trace = _current_trace.get()
+        span_token = None
+        if trace is not None:
+            span = {
+                "id": uuid.uuid4().hex[:8],
+                "parent": _current_span.get(),
+                "name": name,
+                "offset_ms": round((time.time() - trace.started_at) * 1000, 3),
+            }
+            span_token = _current_span.set(span["id"])
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with stats.lock:
+                stats.in_flight -= 1
+                stats.observe(elapsed, error)
+            if span_token is not None:
+                _current_span.reset(span_token)
+                span["duration_ms"] = round(elapsed * 1000, 3)
+                if error:
+                    span["error"] = True
+                trace.add(span)
+
+    def observe(self, name, seconds, error=False):
+        stats = self._stats(name)
+        with stats.lock:
+            stats.observe(seconds, error)
+
+    def mark_error(self, name):
+        """Compte une erreur signalée par une valeur de retour ({"error": ...}) plutôt qu'une exception."""
+        stats = self._stats(name)
+        with stats.lock:
+            stats.errors += 1
+
+    # ---------------------------------------------------------------- traces
+
+    @contextlib.contextmanager
+    def trace(self, name):
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - start
+            _current_trace.reset(token)
+            with self._lock:
+                self._traces.append(trace)
+
+    def traces(self, limit=20, slowest=False):
+        with self._lock:
+            traces = list(self._traces)
+        if slowest:
+            traces.sort(key=lambda t: t.duration or 0, reverse=True)
+        else:
+            traces.reverse()
+        return [t.to_dict() for t in traces[:limit]]
+
+    # ---------------------------------------------------------------- export
+
+    def summary(self, prefix=None):
+        operations = {}
+        for name, stats in self._snapshot():
+            if prefix is None or name.startswith(prefix):
+                with stats.lock:
+                    operations[name] = stats.to_dict()
+        return dict(sorted(operations.items(), key=lambda item: -(item[1]["total_ms"] or 0)))
+
+    def render_prometheus(self):
+        """Histogrammes au format d'exposition Prometheus (secondes)."""
+        items = []
+        for name, s in sorted(self._snapshot(), key=lambda item: item[0]):
+            with s.lock:
+                items.append((name, list(s.buckets), s.count, s.total, s.errors, s.in_flight))
+        lines = [
+            "# HELP orchestrateur_operation_seconds Latence des routes, méthodes du service et appels libvirt",
+            "# TYPE orchestrateur_operation_seconds histogram",
+        ]
+        for name, buckets, count, total, _, _ in items:
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += n
+                lines.append(f'orchestrateur_operation_seconds_bucket{{op="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'orchestrateur_operation_seconds_sum{{op="{label}"}} {total:.6f}')
+            lines.append(f'orchestrateur_operation_seconds_count{{op="{label}"}} {count}')
+        lines.append("# TYPE orchestrateur_operation_errors_total counter")
+        lines.extend(
+            f'orchestrateur_operation_errors_total{{op="{name}"}} {errors}'
+            for name, _, _, _, errors, _ in items
+        )
+        lines.append("# TYPE orchestrateur_operation_in_flight gauge")
+        lines.extend(
+            f'orchestrateur_operation_in_flight{{op="{name}"}} {in_flight}'
+            for name, _, _, _, _, in_flight in items
+        )
+        return "\n".join(lines) + "\n"
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._operations.items())
+
+
+perf = PerfRegistry()
+
+
+# ------------------------------------------------------------ instrumentation
+
+def instrumented(prefix, private=()):
+    """
+    Décorateur de classe : chaque méthode publique (et celles listées dans private)
+    est mesurée sous "<prefix>.<méthode>". Un retour {"error": ...} compte comme erreur.
+    """
+    def decorate(cls):
+        for name, attr in list(vars(cls).items()):
+            if not callable(attr) or isinstance(attr, (staticmethod, classmethod, type)):
+                continue
+            if name.startswith("_") and name not in private:
+                continue
+            setattr(cls, name, _wrap(attr, f"{prefix}.{name}"))
+        return cls
+    return decorate
+
+
+def _wrap(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with perf.track(name):
+            result = func(*args, **kwargs)
+        if isinstance(result, dict) and "error" in result:
+            perf.mark_error(name)
+        return result
+    return wrapper
+
+
+_libvirt_lock = threading.Lock()
+_libvirt_instrumented = False
+
+# Accesseurs servis par l'objet libvirt local, sans aller-retour avec le démon :
+# les mesurer ne coûterait que du temps sur les chemins les plus fréquents
+LOCAL_METHODS = {
+    "name", "ID", "UUID", "UUIDString", "key", "path",
+    "getName", "connect", "getConnect", "domain", "getDomain", "c_pointer",
+}
+
+
+def instrument_libvirt():
+    """
+    Mesure chaque appel RPC libvirt ("libvirt.<Classe>.<méthode>") en enveloppant
+    les méthodes des classes du module, une seule fois par processus (activé par
+    ORCH_PERF_LIBVIRT=1). Les accesseurs locaux (LOCAL_METHODS) ne sont pas
+    mesurés. Les objets restent les vrais objets libvirt : rien ne change pour l'appelant.
+    """
+    global _libvirt_instrumented
+    with _libvirt_lock:
+        if _libvirt_instrumented:
+            return
+        _libvirt_instrumented = True
+
+        import libvirt
+
+        for name in ("open", "openReadOnly", "openAuth"):
+            if hasattr(libvirt, name):
+                setattr(libvirt, name, _wrap_rpc(getattr(libvirt, name), f"libvirt.{name}"))
+        for cls_name in ("virConnect", "virDomain", "virDomainSnapshot", "virStoragePool", "virStorageVol"):
+            cls = getattr(libvirt, cls_name, None)
+            if cls is None:
+                continue
+            for name, attr in list(vars(cls).items()):
+                if name.startswith("_") or name in LOCAL_METHODS:
+                    continue
+                if not callable(attr) or isinstance(attr, (staticmethod, classmethod)):
+                    continue
+                setattr(cls, name, _wrap_rpc(attr, f"libvirt.{cls_name}.{name}"))
+
+
+def _wrap_rpc(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with perf.track(name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,516 @@
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from models.db import AntiAffinityMember, SessionLocal
+from services.domain_cache import get_domain_cache
+from services.inventory import registry
+from utils import config
+
+
+# États où un domaine occupe de la mémoire et des vCPUs sur son hôte
+ACTIVE_STATES = (
+    libvirt.VIR_DOMAIN_RUNNING,
+    libvirt.VIR_DOMAIN_BLOCKED,
+    libvirt.VIR_DOMAIN_PAUSED,
+)
+
+
+class Reservation:
+    """Ressources promises à une VM en cours de création, le temps qu'elle tourne sur l'hôte."""
+
+    def __init__(self, host, vm, memory, vcpus, disk, group=None):
+        self.id = uuid.uuid4().hex
+        self.host = host
+        self.vm = vm
+        self.memory = memory    # Mo
+        self.vcpus = vcpus
+        self.disk = disk        # octets
+        self.group = group
+        self.done = False       # opération réussie : seule l'apparition du domaine reste attendue
+        self.expires_at = time.monotonic() + config.PLACEMENT_RESERVATION_TTL
+
+
+class HostCapacity:
+    """
+    Capacité d'un hôte dans l'index.
+
+    Les valeurs relevées périodiquement (mémoire libre, espace du pool, charge CPU)
+    sont corrigées entre deux relevés par les événements de domaines et par les
+    réservations en cours : free_memory, vcpus_allocated et disk_free sont donc
+    toujours à jour sans interroger l'hôte.
+    """
+
+    def __init__(self, name, uri):
+        self.name = name
+        self.uri = uri
+        self.cpus = 0
+        self.memory_total = 0          # Mo
+        self.load = 0.0                # utilisation CPU entre les deux derniers relevés (0..1)
+        self.sampled_at = None
+        self.error = None
+
+        self._sampled_free_memory = 0  # Mo, au dernier relevé
+        self._sampled_disk_free = None # octets (None : pool inconnu, pas de contrôle)
+        self._sampled_active = {}      # VMs actives au dernier relevé : nom -> Mo
+        self._cpu_times = None
+
+        self.vms = {}                  # nom -> entrée du cache de domaines
+        self.reservations = {}         # id -> Reservation
+        self._on_change = None         # abonnement au cache de domaines de l'hôte
+
+        self.free_memory = 0
+        self.vcpus_allocated = 0
+        self.disk_free = None
+
+    @property
+    def available(self):
+        return self.sampled_at is not None and self.error is None
+
+    def recompute(self):
+        active = {n: vm for n, vm in self.vms.items() if vm["state"] in ACTIVE_STATES}
+        # Mémoire consommée / libérée depuis le relevé, d'après les événements
+        started = sum(vm["memory"] for n, vm in active.items() if n not in self._sampled_active)
+        stopped = sum(m for n, m in self._sampled_active.items() if n not in active)
+        reserved = list(self.reservations.values())
+
+        self.free_memory = (
+            self._sampled_free_memory - started + stopped - sum(r.memory for r in reserved)
+        )
+        self.vcpus_allocated = sum(vm["vcpus"] for vm in active.values()) + sum(r.vcpus for r in reserved)
+        self.disk_free = (
+            None if self._sampled_disk_free is None
+            else self._sampled_disk_free - sum(r.disk for r in reserved)
+        )
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "uri": self.uri,
+            "available": self.available,
+            "error": self.error,
+            "cpus": self.cpus,
+            "memory_total": self.memory_total,
+            "free_memory": self.free_memory,
+            "vcpus_allocated": self.vcpus_allocated,
+            "vcpu_capacity": int(self.cpus * config.VCPU_OVERCOMMIT),
+            "disk_free": self.disk_free,
+            "load": round(self.load, 3),
+            "vms": len(self.vms),
+            "reservations": len(self.reservations),
+            "sampled_at": self.sampled_at,
+        }
+
+
+# ------------------------------------------------------------------ stratégies
+# Une stratégie donne un score à un hôte qui peut accueillir la VM : le plus petit gagne.
+
+def binpack(host, memory, vcpus):
+    """Remplit d'abord les hôtes les plus chargés (libère des hôtes entiers)."""
+    return host.free_memory - memory
+
+
+def spread(host, memory, vcpus):
+    """Répartit les VMs : hôte avec la plus grande part de mémoire libre."""
+    return -(host.free_memory - memory) / max(host.memory_total, 1)
+
+
+def least_loaded(host, memory, vcpus):
+    """Hôte le moins chargé en CPU, puis le moins alloué en vCPUs."""
+    return (round(host.load, 2), (host.vcpus_allocated + vcpus) / max(host.cpus, 1))
+
+
+STRATEGIES = {
+    "binpack": binpack,
+    "spread": spread,
+    "least_loaded": least_loaded,
+}
+
+
+def register_strategy(name, func):
+    """Ajoute une stratégie : func(host, memory, vcpus) -> score (le plus petit gagne)."""
+    STRATEGIES[name] = func
+
+
+class PlacementScheduler:
+    """
+    Choix de l'hyperviseur d'une nouvelle VM.
+
+    L'index de capacité est tenu en mémoire : un relevé complet de chaque hôte
+    (getInfo, getFreeMemory, getCPUStats, pool de stockage) en parallèle toutes
+    les PLACEMENT_REFRESH secondes, puis des mises à jour incrémentales par les
+    événements de domaines et les réservations. Une décision de placement ne
+    fait donc aucun appel libvirt : un simple parcours des hôtes en mémoire.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._groups = None
+        self._cordoned = set()   # hôtes en maintenance : plus aucun placement
+        self._running = False
+        self._wakeup = threading.Event()
+
+    # ---------------------------------------------------------------- placement
+
+    def place(self, vm, memory, vcpus=1, disk=0, strategy=None, group=None, hosts=None):
+        """
+        Choisit un hôte pour vm et y réserve memory (Mo), vcpus et disk (Go).
+        hosts : noms d'hôtes autorisés (tous par défaut).
+        Renvoie {"host", "uri", "reservation"} ou {"error", "rejected": {hôte: raison}}.
+        """
+        strategy = strategy or config.PLACEMENT_STRATEGY
+        score = STRATEGIES.get(strategy)
+        if score is None:
+            return {"error": f"Stratégie inconnue : {strategy} (attendu : {', '.join(STRATEGIES)})"}
+        disk_bytes = int(disk * 1024 ** 3)
+        members = self._group_members(group) - {vm} if group else set()
+
+        with self._lock:
+            self._expire_reservations()
+            rejected = {}
+            best = None
+            for host in self._hosts.values():
+                if hosts is not None and host.name not in hosts:
+                    continue
+                if host.name in self._cordoned:
+                    rejected[host.name] = "En maintenance"
+                    continue
+                reason = self._reject_reason(host, vm, memory, vcpus, disk_bytes, members, group)
+                if reason:
+                    rejected[host.name] = reason
+                    continue
+                candidate = (score(host, memory, vcpus), host.name)
+                if best is None or candidate < best[0]:
+                    best = (candidate, host)
+
+            if best is None:
+                if hosts is not None and not rejected:
+                    return {"error": f"Hôte(s) inconnu(s) du placement : {', '.join(hosts)}", "rejected": {}}
+                return {"error": "Aucun hyperviseur ne peut accueillir la VM", "rejected": rejected}
+
+            host = best[1]
+            reservation = Reservation(host.name, vm, memory, vcpus, disk_bytes, group)
+            host.reservations[reservation.id] = reservation
+            host.recompute()
+
+        return {"host": host.name, "uri": host.uri, "reservation": reservation.id, "strategy": strategy}
+
+    def release(self, reservation_id):
+        with self._lock:
+            for host in self._hosts.values():
+                if host.reservations.pop(reservation_id, None) is not None:
+                    host.recompute()
+                    return
+
+    def bind(self, reservation_id, func):
+        """
+        Enveloppe func(job) : la réservation est rendue si l'opération échoue.
+        En cas de succès la VM entre dans son groupe d'anti-affinité ; la
+        réservation reste jusqu'à ce que le domaine tourne sur l'hôte, ou y
+        apparaisse arrêté (clone), d'après les événements.
+        """
+        with self._lock:
+            reservation = next(
+                (h.reservations[reservation_id] for h in self._hosts.values() if reservation_id in h.reservations),
+                None,
+            )
+
+        def run(job):
+            result = None
+            try:
+                result = func(job)
+                return result
+            finally:
+                if not isinstance(result, dict) or "error" in result:
+                    self.release(reservation_id)
+                elif reservation is not None:
+                    self._complete(reservation)
+        return run
+
+    def _complete(self, reservation):
+        with self._lock:
+            reservation.done = True
+            host = self._hosts.get(reservation.host)
+            if host is not None:
+                self._settle_reservations(host)
+        if reservation.group:
+            self.add_to_group(reservation.group, reservation.vm)
+
+    def locate(self, vm):
+        """Nom de l'hôte où se trouve vm d'après l'index (None si inconnue)."""
+        with self._lock:
+            for host in self._hosts.values():
+                if vm in host.vms:
+                    return host.name
+        return None
+
+    def capacity(self):
+        with self._lock:
+            self._expire_reservations()
+            return [
+                {**h.to_dict(), "cordoned": h.name in self._cordoned}
+                for h in sorted(self._hosts.values(), key=lambda h: h.name)
+            ]
+
+    def hosts(self):
+        """Copie de l'index : [(capacité, {nom: VM})] pour les calculs hors verrou (rééquilibrage)."""
+        with self._lock:
+            self._expire_reservations()
+            return [
+                ({**h.to_dict(), "cordoned": h.name in self._cordoned}, dict(h.vms))
+                for h in sorted(self._hosts.values(), key=lambda h: h.name)
+            ]
+
+    def cordon(self, name):
+        """Met un hôte en maintenance : il ne reçoit plus de nouvelles VMs."""
+        with self._lock:
+            self._cordoned.add(name)
+
+    def uncordon(self, name):
+        with self._lock:
+            self._cordoned.discard(name)
+
+    # ------------------------------------------------------------ anti-affinité
+
+    def groups(self):
+        with self._lock:
+            groups = self._load_groups()
+            return {name: sorted(vms) for name, vms in sorted(groups.items())}
+
+    def add_to_group(self, group, vm):
+        with self._lock:
+            groups = self._load_groups()
+            if vm in groups.get(group, ()):
+                return {"message": f"{vm} est déjà dans le groupe {group}"}
+            groups.setdefault(group, set()).add(vm)
+        with SessionLocal() as db:
+            db.add(AntiAffinityMember(group=group, vm=vm))
+            db.commit()
+        return {"message": f"{vm} ajoutée au groupe {group}"}
+
+    def remove_from_group(self, group, vm):
+        with self._lock:
+            groups = self._load_groups()
+            if vm not in groups.get(group, ()):
+                return {"error": f"{vm} n'est pas dans le groupe {group}"}
+            groups[group].discard(vm)
+            if not groups[group]:
+                del groups[group]
+        with SessionLocal() as db:
+            db.query(AntiAffinityMember).filter(
+                AntiAffinityMember.group == group, AntiAffinityMember.vm == vm
+            ).delete()
+            db.commit()
+        return {"message": f"{vm} retirée du groupe {group}"}
+
+    def forget_vm(self, vm):
+        """Retire vm de tous ses groupes (VM supprimée)."""
+        with self._lock:
+            groups = self._load_groups()
+            joined = [g for g, vms in groups.items() if vm in vms]
+            for group in joined:
+                groups[group].discard(vm)
+                if not groups[group]:
+                    del groups[group]
+        if not joined:
+            return
+        with SessionLocal() as db:
+            db.query(AntiAffinityMember).filter(AntiAffinityMember.vm == vm).delete()
+            db.commit()
+
+    def record_call(self, operation, args, service, result):
+        """Écouteur d'AsyncLibvirtService : une VM supprimée quitte ses groupes d'anti-affinité."""
+        if operation != "delete_vm" or not args:
+            return
+        if isinstance(result, dict) and "error" in result:
+            return
+        self.forget_vm(args[0])
+
+    # ------------------------------------------------------------- relevés
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._refresh_loop, name="placement-refresh", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def refresh(self):
+        """Relève tous les hôtes actifs en parallèle (délai propre à chaque hôte)."""
+        hosts = [h for h in registry.list() if h["enabled"]]
+        results = registry.fan_out(lambda host, service: self._sample(host), hosts)
+
+        with self._lock:
+            for name in set(self._hosts) - {h["name"] for h in hosts}:
+                self._forget(self._hosts.pop(name))
+            for host in hosts:
+                capacity = self._hosts.get(host["name"])
+                if capacity is None or capacity.uri != host["uri"]:
+                    if capacity is not None:
+                        self._forget(capacity)
+                    capacity = HostCapacity(host["name"], host["uri"])
+                    self._hosts[host["name"]] = capacity
+                    self._watch(capacity)
+
+                outcome = results.get(host["name"], {})
+                if outcome.get("status") == "ok":
+                    self._apply_sample(capacity, outcome["result"])
+                elif outcome.get("status") != "timeout" or not capacity.available:
+                    # Un hôte seulement lent garde son dernier relevé
+                    capacity.error = outcome.get("error", "Relevé impossible")
+
+    def _refresh_loop(self):
+        while self._running:
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            self._wakeup.wait(config.PLACEMENT_REFRESH)
+            self._wakeup.clear()
+
+    def _sample(self, host):
+        conn = registry.service(host["name"]).connect()
+        if not conn:
+            return {"error": f"Connexion impossible à {host['uri']}"}
+        try:
+            info = conn.getInfo()
+            return {
+                "memory_total": info[1],
+                "cpus": info[2],
+                "free_memory": conn.getFreeMemory() // (1024 * 1024),
+                "cpu_times": conn.getCPUStats(libvirt.VIR_NODE_CPU_STATS_ALL_CPUS),
+                "disk_free": self._pool_free(conn),
+            }
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _pool_free(conn):
+        """Espace libre (octets) du pool de stockage qui contient IMAGES_DIR, None s'il n'y en a pas."""
+        images_dir = os.path.normpath(config.IMAGES_DIR)
+        try:
+            pools = conn.listAllStoragePools(libvirt.VIR_CONNECT_LIST_STORAGE_POOLS_ACTIVE)
+        except libvirt.libvirtError:
+            return None
+        for pool in pools:
+            try:
+                path = ET.fromstring(pool.XMLDesc(0)).findtext("target/path")
+                if path and os.path.normpath(path) == images_dir:
+                    return pool.info()[3]
+            except libvirt.libvirtError:
+                continue
+        return None
+
+    def _apply_sample(self, host, sample):
+        # Appelé avec le verrou tenu
+        host.memory_total = sample["memory_total"]
+        host.cpus = sample["cpus"]
+        host._sampled_free_memory = sample["free_memory"] - config.HOST_MEMORY_RESERVE
+        host._sampled_disk_free = sample["disk_free"]
+
+        times = sample["cpu_times"]
+        if host._cpu_times is not None:
+            busy = sum(times.values()) - times.get("idle", 0)
+            prev_busy = sum(host._cpu_times.values()) - host._cpu_times.get("idle", 0)
+            total = sum(times.values()) - sum(host._cpu_times.values())
+            if total > 0:
+                host.load = max(0.0, min(1.0, (busy - prev_busy) / total))
+        host._cpu_times = times
+
+        host._sampled_active = {
+            n: vm["memory"] for n, vm in host.vms.items() if vm["state"] in ACTIVE_STATES
+        }
+        host.sampled_at = time.time()
+        host.error = None
+        host.recompute()
+
+    # --------------------------------------------------- mises à jour incrémentales
+
+    def _watch(self, host):
+        # Appelé avec le verrou tenu : la liste des VMs suit le cache d'événements de l'hôte
+        cache = get_domain_cache(host.uri)
+        host._on_change = lambda: self._sync_vms(host)
+        cache.subscribe(host._on_change)
+        self._sync_vms_locked(host, cache)
+
+    def _forget(self, host):
+        get_domain_cache(host.uri).unsubscribe(host._on_change)
+
+    def _sync_vms(self, host):
+        cache = get_domain_cache(host.uri)
+        with self._lock:
+            self._sync_vms_locked(host, cache)
+
+    def _sync_vms_locked(self, host, cache):
+        host.vms = {vm["name"]: vm for vm in cache.list()}
+        self._settle_reservations(host)
+
+    @staticmethod
+    def _settle_reservations(host):
+        # Appelé avec le verrou tenu. Une VM réservée qui tourne sur l'hôte est désormais
+        # comptée par les événements. Simplement définie, elle peut encore démarrer : la
+        # réservation reste, sauf si l'opération est terminée (clone laissé arrêté).
+        for rid, reservation in list(host.reservations.items()):
+            vm = host.vms.get(reservation.vm)
+            if vm is not None and (vm["state"] in ACTIVE_STATES or reservation.done):
+                del host.reservations[rid]
+        host.recompute()
+
+    def _expire_reservations(self):
+        # Appelé avec le verrou tenu
+        now = time.monotonic()
+        for host in self._hosts.values():
+            expired = [rid for rid, r in host.reservations.items() if r.expires_at <= now]
+            for rid in expired:
+                del host.reservations[rid]
+            if expired:
+                host.recompute()
+
+    # ---------------------------------------------------------------- interne
+
+    @staticmethod
+    def _reject_reason(host, vm, memory, vcpus, disk_bytes, members, group=None):
+        if not host.available:
+            return host.error or "Pas encore relevé"
+        if host.free_memory < memory:
+            return f"Mémoire insuffisante ({host.free_memory} Mo libres)"
+        capacity = int(host.cpus * config.VCPU_OVERCOMMIT)
+        if host.vcpus_allocated + vcpus > capacity:
+            return f"vCPUs insuffisants ({host.vcpus_allocated}/{capacity} alloués)"
+        if host.disk_free is not None and host.disk_free < disk_bytes:
+            return f"Espace disque insuffisant ({host.disk_free // 1024 ** 3} Go libres)"
+        conflicts = members & (set(host.vms) | {r.vm for r in host.reservations.values()})
+        # Membres du groupe encore en création : pas encore inscrits dans le groupe
+        conflicts |= {
+            r.vm for r in host.reservations.values() if group and r.group == group and r.vm != vm
+        }
+        if conflicts:
+            return f"Anti-affinité : {', '.join(sorted(conflicts))} déjà sur cet hôte"
+        return None
+
+    def _group_members(self, group):
+        with self._lock:
+            return set(self._load_groups().get(group, ()))
+
+    def _load_groups(self):
+        # Appelé avec le verrou tenu
+        if self._groups is None:
+            groups = {}
+            with SessionLocal() as db:
+                for member in db.query(AntiAffinityMember).all():
+                    groups.setdefault(member.group, set()).add(member.vm)
+            self._groups = groups
+        return self._groups
+
+
+scheduler = PlacementScheduler()
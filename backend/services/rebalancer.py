@@ -0,0 +1,365 @@
+import collections
+import threading
+import time
+
+import libvirt
+
+from services import domain_stats
+from services.inventory import registry
+from services.jobs import job_manager
+from services.placement import ACTIVE_STATES, scheduler
+from utils import config
+
+
+class Rebalancer:
+    """
+    Rééquilibrage de la charge par migration live.
+
+    - mesure la pression CPU et mémoire de chaque hôte toutes les
+      REBALANCE_INTERVAL secondes (moyenne glissante sur REBALANCE_WINDOW mesures)
+      et la consommation CPU de chaque VM (cpu.time)
+    - un hôte au-dessus d'un seuil est un point chaud : le plan est un ensemble
+      minimal de migrations (les plus grosses VMs d'abord) qui le ramène sous
+      seuil - REBALANCE_MARGIN, sans faire passer une destination au-dessus
+    - hystérésis : moyenne glissante, marge sous le seuil, et une VM déplacée
+      ne bouge plus pendant REBALANCE_COOLDOWN secondes
+    - les migrations sont des jobs, bornés par hôte (source et destination)
+      et sur l'ensemble du cluster
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._history = {}      # hôte -> deque[(cpu, mémoire)]
+        self._vm_cpu = {}       # (hôte, vm) -> part du CPU de l'hôte (0..1)
+        self._cpu_times = {}    # (hôte, vm) -> (cpu.time ns, instant)
+        self._moved = {}        # vm -> instant de la dernière migration lancée
+        self.last_plan = None
+
+        self._running = False
+        self._wakeup = threading.Event()
+
+    # ---------------------------------------------------------------- mesures
+
+    def sample(self):
+        """Une mesure de chaque hôte (depuis l'index de placement) et du CPU de chaque VM."""
+        hosts = {h["name"]: h for h, _ in scheduler.hosts() if h["available"]}
+        results = registry.fan_out(
+            lambda host, service: self._collect_cpu(service),
+            [h for h in registry.list() if h["name"] in hosts],
+        )
+        now = time.monotonic()
+        with self._lock:
+            for name, host in hosts.items():
+                memory = 1 - host["free_memory"] / max(host["memory_total"], 1)
+                history = self._history.setdefault(name, collections.deque(maxlen=config.REBALANCE_WINDOW))
+                history.append((host["load"], max(0.0, min(1.0, memory))))
+
+                outcome = results.get(name, {})
+                if outcome.get("status") != "ok":
+                    continue
+                for vm, cpu_time in outcome["result"].items():
+                    key = (name, vm)
+                    previous = self._cpu_times.get(key)
+                    self._cpu_times[key] = (cpu_time, now)
+                    if previous and now > previous[1]:
+                        used = (cpu_time - previous[0]) / ((now - previous[1]) * 1e9)
+                        self._vm_cpu[key] = max(0.0, used / max(host["cpus"], 1))
+            for name in set(self._history) - set(hosts):
+                del self._history[name]
+
+    def pressure(self):
+        """Pression moyenne par hôte sur la fenêtre : {hôte: {"cpu", "memory", "samples"}}."""
+        with self._lock:
+            return {
+                name: {
+                    "cpu": round(sum(s[0] for s in history) / len(history), 3),
+                    "memory": round(sum(s[1] for s in history) / len(history), 3),
+                    "samples": len(history),
+                }
+                for name, history in self._history.items() if history
+            }
+
+    @staticmethod
+    def _collect_cpu(service):
+        conn = service.connect()
+        if not conn:
+            return {"error": f"Connexion impossible à {service.uri}"}
+        try:
+            records = domain_stats.collect(conn, ["cpu"])
+            return {dom.name(): raw.get("cpu.time", 0) for dom, raw in records}
+        except libvirt.libvirtError as e:
+            return {"error": str(e)}
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------- plans
+
+    def plan(self):
+        """Migrations qui ramènent les points chauds sous le seuil cible (rien n'est lancé)."""
+        model = self._model()
+        pressure = self.pressure()
+        target_cpu = config.REBALANCE_CPU_THRESHOLD - config.REBALANCE_MARGIN
+        target_memory = config.REBALANCE_MEMORY_THRESHOLD - config.REBALANCE_MARGIN
+
+        hotspots = []
+        for name, p in pressure.items():
+            if name not in model or p["samples"] < config.REBALANCE_WINDOW:
+                continue
+            if p["cpu"] > config.REBALANCE_CPU_THRESHOLD or p["memory"] > config.REBALANCE_MEMORY_THRESHOLD:
+                hotspots.append(name)
+        hotspots.sort(key=lambda n: -max(
+            pressure[n]["cpu"] - config.REBALANCE_CPU_THRESHOLD,
+            pressure[n]["memory"] - config.REBALANCE_MEMORY_THRESHOLD,
+        ))
+
+        moves, unresolved = [], {}
+        for name in hotspots:
+            host = model[name]
+            while self._over(host, target_cpu, target_memory):
+                if len(moves) >= config.REBALANCE_MAX_MOVES:
+                    unresolved[name] = "Nombre maximal de migrations par plan atteint"
+                    break
+                move = self._best_move(model, host, target_cpu, target_memory, hotspots)
+                if move is None:
+                    unresolved[name] = "Aucune VM déplaçable vers un hôte qui reste sous le seuil"
+                    break
+                moves.append(move)
+
+        plan = {
+            "kind": "rebalance",
+            "created_at": time.time(),
+            "thresholds": {
+                "cpu": config.REBALANCE_CPU_THRESHOLD,
+                "memory": config.REBALANCE_MEMORY_THRESHOLD,
+                "target_cpu": round(target_cpu, 3),
+                "target_memory": round(target_memory, 3),
+            },
+            "pressure": pressure,
+            "hotspots": hotspots,
+            "moves": moves,
+            "unresolved": unresolved,
+        }
+        self.last_plan = plan
+        return plan
+
+    def drain(self, name, dry_run=False):
+        """
+        Évacue toutes les VMs actives de l'hôte name (maintenance) : l'hôte ne
+        reçoit plus de VMs, et ses VMs partent en parallèle vers les hôtes les
+        moins chargés qui peuvent les accueillir.
+        """
+        model = self._model(include_cordoned=True)
+        host = model.get(name)
+        if host is None:
+            return {"error": f"Hyperviseur {name} introuvable ou pas encore relevé"}
+        if not dry_run:
+            scheduler.cordon(name)
+
+        moves, unresolved = [], {}
+        for vm in sorted(host["vms"].values(), key=lambda v: -v["memory"]):
+            dest = self._destination(model, host, vm, 1.0, 1.0, exclude=(name,))
+            if dest is None:
+                unresolved[vm["name"]] = "Aucun hôte ne peut l'accueillir"
+                continue
+            moves.append(self._apply(host, dest, vm))
+
+        plan = {
+            "kind": "drain",
+            "host": name,
+            "created_at": time.time(),
+            "moves": moves,
+            "unresolved": unresolved,
+            # migrate_vm ne fait que des migrations live : les VMs arrêtées restent
+            "skipped": sorted(host["inactive"]),
+        }
+        if not dry_run:
+            plan["jobs"] = self.execute(plan, ignore_cooldown=True)
+        return plan
+
+    def run(self, dry_run=False):
+        plan = self.plan()
+        if not dry_run:
+            plan["jobs"] = self.execute(plan)
+        return plan
+
+    # -------------------------------------------------------------- exécution
+
+    def execute(self, plan, ignore_cooldown=False):
+        """Lance les migrations du plan (jobs) ; renvoie {vm: job_id | erreur}."""
+        started = {}
+        now = time.monotonic()
+        for move in plan["moves"]:
+            vm, source, dest = move["vm"], move["source"], move["destination"]
+            if not ignore_cooldown and now - self._moved.get(vm, -config.REBALANCE_COOLDOWN) < config.REBALANCE_COOLDOWN:
+                started[vm] = {"error": "Migrée trop récemment"}
+                continue
+            reservation = scheduler.place(vm, move["memory"], vcpus=move["vcpus"], hosts=[dest])
+            if "error" in reservation:
+                started[vm] = {"error": reservation["error"]}
+                continue
+
+            source_service = registry.service(source)
+            dest_uri = reservation["uri"]
+            options = {"auto_converge": True, "copy_storage": config.REBALANCE_COPY_STORAGE}
+
+            def migrate(job, vm=vm, service=source_service, uri=dest_uri):
+                return service.migrate_vm(vm, uri, job=job, options=options)
+
+            job = job_manager.submit(
+                "migrate", vm, scheduler.bind(reservation["reservation"], migrate),
+                hypervisor=source_service.uri,
+                params={"destination": dest_uri, "reason": plan["kind"], **options},
+                limits=self._limits(source, dest),
+            )
+            self._moved[vm] = now
+            started[vm] = {"job_id": job.id}
+        return started
+
+    @staticmethod
+    def _limits(source, dest):
+        """
+        Places de migration sur le cluster et sur chaque hôte (source et destination),
+        tenues par le JobManager : un job en attente de place n'occupe pas de worker.
+        """
+        return {
+            "rebalance": config.REBALANCE_MAX_PARALLEL,
+            f"rebalance:{source}": config.REBALANCE_PER_HOST,
+            f"rebalance:{dest}": config.REBALANCE_PER_HOST,
+        }
+
+    # ------------------------------------------------------------ arrière-plan
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._loop, name="rebalancer", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            self._wakeup.wait(config.REBALANCE_INTERVAL)
+            if not self._running:
+                break
+            try:
+                self.sample()
+                if config.REBALANCE_AUTO:
+                    self.run()
+            except Exception:
+                pass
+
+    # ------------------------------------------------------------ modèle
+
+    def _model(self, include_cordoned=False):
+        """État projeté des hôtes sur lequel les migrations du plan sont simulées."""
+        pressure = self.pressure()
+        groups = scheduler.groups()
+        vm_groups = collections.defaultdict(set)
+        for group, members in groups.items():
+            for vm in members:
+                vm_groups[vm].add(group)
+
+        model = {}
+        for host, vms in scheduler.hosts():
+            if not host["available"] or (host["cordoned"] and not include_cordoned):
+                continue
+            active = {n: vm for n, vm in vms.items() if vm["state"] in ACTIVE_STATES}
+            allocated = max(sum(vm["vcpus"] for vm in active.values()), 1)
+            cpu = pressure.get(host["name"], {}).get("cpu", host["load"])
+            with self._lock:
+                model[host["name"]] = {
+                    "name": host["name"],
+                    "uri": host["uri"],
+                    "cordoned": host["cordoned"],
+                    "cpus": max(host["cpus"], 1),
+                    "memory_total": max(host["memory_total"], 1),
+                    "free_memory": host["free_memory"],
+                    "vcpus_free": host["vcpu_capacity"] - host["vcpus_allocated"],
+                    "cpu": cpu,
+                    "vms": {
+                        n: {
+                            "name": n,
+                            "memory": vm["memory"],
+                            "vcpus": vm["vcpus"],
+                            # Sans mesure : part de la charge de l'hôte au prorata des vCPUs
+                            "cpu": self._vm_cpu.get((host["name"], n), cpu * vm["vcpus"] / allocated),
+                            "groups": vm_groups.get(n, set()),
+                        }
+                        for n, vm in active.items()
+                    },
+                    "inactive": [n for n in vms if n not in active],
+                }
+        return model
+
+    @staticmethod
+    def _memory(host):
+        return 1 - host["free_memory"] / host["memory_total"]
+
+    def _over(self, host, target_cpu, target_memory):
+        return host["cpu"] > target_cpu or self._memory(host) > target_memory
+
+    def _best_move(self, model, host, target_cpu, target_memory, hotspots):
+        # Les plus grosses contributions d'abord : le moins de migrations possible
+        cpu_excess = host["cpu"] - target_cpu
+        memory_excess = self._memory(host) - target_memory
+        if cpu_excess >= memory_excess:
+            order = sorted(host["vms"].values(), key=lambda v: -v["cpu"])
+        else:
+            order = sorted(host["vms"].values(), key=lambda v: -v["memory"])
+
+        now = time.monotonic()
+        for vm in order:
+            if now - self._moved.get(vm["name"], -config.REBALANCE_COOLDOWN) < config.REBALANCE_COOLDOWN:
+                continue
+            dest = self._destination(model, host, vm, target_cpu, target_memory, exclude=hotspots)
+            if dest is not None:
+                return self._apply(host, dest, vm)
+        return None
+
+    def _destination(self, model, source, vm, target_cpu, target_memory, exclude=()):
+        best = None
+        for host in model.values():
+            if host["name"] == source["name"] or host["name"] in exclude or host["cordoned"]:
+                continue
+            if not host["uri"].startswith("qemu+ssh://"):
+                # migrate_vm n'accepte que des destinations qemu+ssh://
+                continue
+            if host["free_memory"] < vm["memory"] or host["vcpus_free"] < vm["vcpus"]:
+                continue
+            if vm["groups"] and any(vm["groups"] & other["groups"] for other in host["vms"].values()):
+                continue
+            cpu = host["cpu"] + vm["cpu"] * source["cpus"] / host["cpus"]
+            memory = 1 - (host["free_memory"] - vm["memory"]) / host["memory_total"]
+            if cpu > target_cpu or memory > target_memory:
+                continue
+            score = max(cpu, memory)
+            if best is None or score < best[0]:
+                best = (score, host)
+        return best[1] if best else None
+
+    @staticmethod
+    def _apply(source, dest, vm):
+        # Simule la migration dans le modèle pour les choix suivants du plan
+        del source["vms"][vm["name"]]
+        source["cpu"] = max(0.0, source["cpu"] - vm["cpu"])
+        source["free_memory"] += vm["memory"]
+        source["vcpus_free"] += vm["vcpus"]
+        moved_cpu = vm["cpu"] * source["cpus"] / dest["cpus"]
+        dest["vms"][vm["name"]] = {**vm, "cpu": moved_cpu}
+        dest["cpu"] += moved_cpu
+        dest["free_memory"] -= vm["memory"]
+        dest["vcpus_free"] -= vm["vcpus"]
+        return {
+            "vm": vm["name"],
+            "source": source["name"],
+            "destination": dest["name"],
+            "memory": vm["memory"],
+            "vcpus": vm["vcpus"],
+            "cpu": round(vm["cpu"], 3),
+        }
+
+
+rebalancer = Rebalancer()
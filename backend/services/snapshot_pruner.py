@@ -0,0 +1,83 @@
+"""
+Rétention des snapshots : toutes les SNAPSHOT_PRUNE_INTERVAL secondes, ne garde
+que les N snapshots les plus récents de chaque VM. N vient du label
+snapshot.keep de la VM (il la suit en migration), sinon de ORCH_SNAPSHOT_KEEP.
+"""
+import threading
+import time
+
+from services import snapshots
+from services.inventory import registry
+from services.vm_store import vm_store
+from utils import config
+
+
+def keep_policy(labels):
+    """Nombre de snapshots à garder pour une VM (None : pas de rétention)."""
+    value = labels.get(snapshots.KEEP_LABEL)
+    if value is not None:
+        return int(value) if value.isdigit() else None
+    return config.SNAPSHOT_KEEP or None
+
+
+class SnapshotPruner:
+    def __init__(self):
+        self._running = False
+        self._wakeup = threading.Event()
+        self.last_run_at = None
+        self.last_result = {}
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._loop, name="snapshot-pruner", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            self._wakeup.wait(config.SNAPSHOT_PRUNE_INTERVAL)
+            if not self._running:
+                break
+            try:
+                self.run()
+            except Exception:
+                pass
+
+    def run(self):
+        """
+        Un passage sur tous les hôtes actifs, hôte par hôte : les fusions de
+        snapshots externes peuvent être longues et ne doivent pas occuper le
+        pool partagé de fan_out.
+        """
+        result = {}
+        for host in registry.list():
+            if not host["enabled"]:
+                continue
+            service = registry.service(host["name"])
+            labels = service.list_labels()
+            if "error" in labels:
+                result[host["name"]] = {"error": labels["error"]}
+                continue
+            pruned = {}
+            for vm, vm_labels in labels.items():
+                keep = keep_policy(vm_labels)
+                if keep is None:
+                    continue
+                outcome = service.snapshot_prune(vm, keep)
+                if outcome.get("deleted") or outcome.get("errors") or "error" in outcome:
+                    pruned[vm] = outcome
+                    vm_store.record(
+                        vm, "snapshot_prune", "failed" if outcome.get("errors") or "error" in outcome else "succeeded",
+                        host=host["name"], detail=outcome.get("error") or outcome.get("message"),
+                    )
+            result[host["name"]] = pruned
+        self.last_run_at = time.time()
+        self.last_result = result
+        return result
+
+
+pruner = SnapshotPruner()
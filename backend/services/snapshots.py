@@ -0,0 +1,173 @@
+"""
+Snapshots des domaines : lecture groupée des métadonnées (un listAllSnapshots),
+arbre parent/enfants, XML des snapshots externes disque seul et chaîne
+d'images qcow2 (qemu-img info) utilisée pour les fusionner (block commit).
+"""
+import json
+import os
+import re
+import subprocess
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from utils import config
+
+
+SNAPSHOT_MODES = ("internal", "external")
+
+# Snapshots qui figent la base de clones liés (voir LibvirtService._freeze_base) :
+# jamais fusionnés ni supprimés automatiquement
+CLONE_BASE_PREFIX = "clone-base-"
+
+# Label de VM qui fixe sa politique de rétention (voir services.snapshot_pruner)
+KEEP_LABEL = "snapshot.keep"
+
+
+def describe(snapshot, current=None, sizes=None):
+    """Métadonnées d'un virDomainSnapshot (un appel getXMLDesc)."""
+    root = ET.fromstring(snapshot.getXMLDesc(0))
+    disks = []
+    for disk in root.findall("./disks/disk"):
+        source = disk.find("source")
+        disks.append({
+            "name": disk.get("name"),
+            "snapshot": disk.get("snapshot"),
+            "file": source.get("file") if source is not None else None,
+        })
+    name = root.findtext("name")
+    memory = root.find("memory")
+    external = any(d["snapshot"] == "external" for d in disks)
+    creation = root.findtext("creationTime")
+
+    size = None
+    if external:
+        # Blocs réellement alloués des overlays (fichiers locaux uniquement)
+        size = sum(_allocated(d["file"]) or 0 for d in disks if d["snapshot"] == "external" and d["file"]) or None
+    elif sizes:
+        size = sizes.get(name)
+
+    return {
+        "name": name,
+        "description": root.findtext("description"),
+        "parent": root.findtext("./parent/name"),
+        "created_at": int(creation) if creation else None,
+        "state": root.findtext("state"),
+        "type": "external" if external else "internal",
+        "memory": memory.get("snapshot") if memory is not None else None,
+        "disks": disks,
+        "current": name == current,
+        "size": size,
+    }
+
+
+def list_all(dom, disk_path=None):
+    """
+    Métadonnées de tous les snapshots de dom, parents avant enfants.
+    disk_path : disque principal, pour la taille des snapshots internes.
+    """
+    snapshots = dom.listAllSnapshots(libvirt.VIR_DOMAIN_SNAPSHOT_LIST_TOPOLOGICAL)
+    try:
+        current = dom.snapshotCurrent(0).getName() if dom.hasCurrentSnapshot(0) else None
+    except libvirt.libvirtError:
+        current = None
+    sizes = internal_sizes(disk_path) if snapshots and disk_path else None
+    return [(snap, describe(snap, current, sizes)) for snap in snapshots]
+
+
+def build_tree(items):
+    """[{..., "parent"}] (parents avant enfants) -> racines avec leurs "children" imbriqués."""
+    nodes = {item["name"]: dict(item, children=[]) for item in items}
+    roots = []
+    for item in items:
+        node = nodes[item["name"]]
+        parent = nodes.get(item["parent"])
+        (parent["children"] if parent else roots).append(node)
+    return roots
+
+
+def descendants(items, name):
+    """Noms de tous les descendants de name."""
+    children = {}
+    for item in items:
+        children.setdefault(item["parent"], []).append(item["name"])
+    result, pending = set(), list(children.get(name, []))
+    while pending:
+        child = pending.pop()
+        result.add(child)
+        pending.extend(children.get(child, []))
+    return result
+
+
+def overlay_path(vm, snapshot_name, disk_target):
+    safe = re.sub(r"[^\w.-]", "_", snapshot_name)
+    return os.path.join(config.IMAGES_DIR, f"{vm}.{safe}.{disk_target}.qcow2")
+
+
+def external_xml(vm, snapshot_name, disks, description=None):
+    """XML d'un snapshot externe disque seul : un overlay qcow2 par disque."""
+    root = ET.Element("domainsnapshot")
+    ET.SubElement(root, "name").text = snapshot_name
+    ET.SubElement(root, "description").text = description or "Snapshot externe (disque seul) créé par orchestrateur"
+    ET.SubElement(root, "memory", snapshot="no")
+    disks_elem = ET.SubElement(root, "disks")
+    for disk in disks:
+        elem = ET.SubElement(disks_elem, "disk", name=disk.target, snapshot="external")
+        ET.SubElement(elem, "driver", type="qcow2")
+        ET.SubElement(elem, "source", file=overlay_path(vm, snapshot_name, disk.target))
+    return ET.tostring(root, encoding="unicode")
+
+
+def backing_chain(path):
+    """
+    Chaîne d'images à partir de path, du haut vers la base :
+    [{"filename", "format", "backing"}]. Lève RuntimeError si qemu-img échoue.
+    -U : lecture possible pendant que la VM tourne.
+    """
+    proc = subprocess.run(
+        ["qemu-img", "info", "-U", "--backing-chain", "--output=json", path],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError((proc.stderr or "").strip() or "qemu-img info a échoué")
+    return [
+        {
+            "filename": image["filename"],
+            "format": image.get("format"),
+            "backing": image.get("full-backing-filename") or image.get("backing-filename"),
+        }
+        for image in json.loads(proc.stdout)
+    ]
+
+
+def has_writes(path):
+    """
+    True si l'image du haut de la chaîne contient des données propres (blocs
+    alloués dans path et pas dans sa base). Lève RuntimeError si qemu-img échoue.
+    """
+    proc = subprocess.run(
+        ["qemu-img", "map", "-U", "--output=json", path], capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError((proc.stderr or "").strip() or "qemu-img map a échoué")
+    # depth 0 : zone allouée dans l'image elle-même
+    return any(extent["depth"] == 0 for extent in json.loads(proc.stdout))
+
+
+def internal_sizes(path):
+    """{snapshot: taille de l'état mémoire} des snapshots internes de l'image path (locale)."""
+    if not os.path.exists(path):
+        return {}
+    proc = subprocess.run(
+        ["qemu-img", "info", "-U", "--output=json", path], capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return {}
+    return {s["name"]: s.get("vm-state-size") for s in json.loads(proc.stdout).get("snapshots", [])}
+
+
+def _allocated(path):
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return None
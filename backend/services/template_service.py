@@ -0,0 +1,277 @@
+import json
+import os
+import subprocess
+import threading
+import time
+import uuid
+
+from utils import config
+
+
+class TemplateStore:
+    """
+    Bibliothèque d'images de référence ("golden images").
+
+    Un template est un qcow2 déjà installé et préparé ; les VMs créées depuis un
+    template sont des overlays qcow2 fins dont il est le backing file (aucune
+    installation d'OS). En option, un pool "chaud" d'overlays pré-créés par
+    template rend la création quasi instantanée : un rename puis defineXML.
+
+    Le registre est un simple fichier JSON dans TEMPLATE_DIR ; les overlays du
+    pool chaud sont rangés dans IMAGES_DIR/.warm/<template>/ (même système de
+    fichiers que les disques des VMs, pour que le rename soit atomique).
+    Les VMs déjà démarrées et en pause (vm_pool_size) sont gérées par
+    services.warm_pool.
+    """
+
+    def __init__(self, registry_path=None, warm_dir=None):
+        self.registry_path = registry_path or os.path.join(config.TEMPLATE_DIR, "templates.json")
+        self.warm_dir = warm_dir or os.path.join(config.IMAGES_DIR, ".warm")
+
+        self._lock = threading.Lock()
+        self._templates = None
+        self._refill = threading.Event()
+        self._running = False
+
+    # ------------------------------------------------------------------ CRUD
+
+    def list(self):
+        with self._lock:
+            templates = list(self._load().values())
+        return [self._describe(t) for t in templates]
+
+    def get(self, name):
+        with self._lock:
+            template = self._load().get(name)
+        return self._describe(template) if template else None
+
+    def register(self, name, path, description="", pool_size=0, vm_pool_size=0, vm_memory=1024, vm_vcpus=1,
+                 copy=False):
+        """
+        Enregistre l'image path comme template. copy=True la copie d'abord dans
+        TEMPLATE_DIR (reflink si possible), où la copie est mise en lecture seule ;
+        sinon l'image est utilisée en place et ne doit plus être modifiée.
+        """
+        if not os.path.isfile(path):
+            return {"error": f"Image {path} introuvable"}
+        if pool_size < 0 or vm_pool_size < 0:
+            return {"error": "pool_size et vm_pool_size doivent être >= 0"}
+
+        fmt = self._image_format(path)
+        if fmt is None:
+            return {"error": f"Impossible de lire l'image {path} (qemu-img info)"}
+
+        with self._lock:
+            if name in self._load():
+                return {"error": f"Le template {name} existe déjà"}
+
+        if copy:
+            copied = os.path.join(config.TEMPLATE_DIR, f"{name}.{fmt}")
+            if os.path.exists(copied):
+                return {"error": f"L'image {copied} existe déjà"}
+            error = self._copy_image(path, copied)
+            if error:
+                return {"error": f"Copie de {path} impossible : {error}"}
+            path = copied
+
+        with self._lock:
+            templates = self._load()
+            if name in templates:
+                if copy:
+                    os.remove(path)
+                return {"error": f"Le template {name} existe déjà"}
+            templates[name] = {
+                "name": name,
+                "path": path,
+                "format": fmt,
+                "description": description,
+                "pool_size": pool_size,
+                # VMs pré-démarrées et en pause (voir services.warm_pool)
+                "vm_pool_size": vm_pool_size,
+                "vm_memory": vm_memory,
+                "vm_vcpus": vm_vcpus,
+                "copied": copy,
+                "created_at": time.time(),
+            }
+            self._save(templates)
+
+        self._refill.set()
+        return {"message": f"Template {name} enregistré", "template": self.get(name)}
+
+    def update(self, name, description=None, pool_size=None, vm_pool_size=None, vm_memory=None, vm_vcpus=None):
+        if (pool_size is not None and pool_size < 0) or (vm_pool_size is not None and vm_pool_size < 0):
+            return {"error": "pool_size et vm_pool_size doivent être >= 0"}
+        with self._lock:
+            templates = self._load()
+            template = templates.get(name)
+            if template is None:
+                return {"error": f"Template {name} introuvable"}
+            if description is not None:
+                template["description"] = description
+            if pool_size is not None:
+                template["pool_size"] = pool_size
+            for key, value in (("vm_pool_size", vm_pool_size), ("vm_memory", vm_memory), ("vm_vcpus", vm_vcpus)):
+                if value is not None:
+                    template[key] = value
+            self._save(templates)
+        self._refill.set()
+        return {"message": f"Template {name} mis à jour", "template": self.get(name)}
+
+    def delete(self, name):
+        """Retire le template du registre et vide son pool chaud (l'image de base est conservée)."""
+        with self._lock:
+            templates = self._load()
+            if templates.pop(name, None) is None:
+                return {"error": f"Template {name} introuvable"}
+            self._save(templates)
+
+        for path in self._warm_disks(name):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return {"message": f"Template {name} supprimé"}
+
+    # ---------------------------------------------------------------- disques
+
+    def acquire_disk(self, name, disk_path):
+        """
+        Fournit le disque d'une nouvelle VM en disk_path :
+        un overlay du pool chaud s'il y en a un (rename), sinon un overlay créé à la volée.
+        Renvoie None si tout va bien, sinon le message d'erreur.
+        """
+        with self._lock:
+            template = self._load().get(name)
+            if template is None:
+                return f"Template {name} introuvable"
+            warm = self._warm_disks(name)
+            while warm:
+                try:
+                    os.rename(warm.pop(), disk_path)
+                    self._refill.set()
+                    return None
+                except OSError:
+                    continue
+
+        self._refill.set()
+        return self._create_overlay(template, disk_path)
+
+    # ---------------------------------------------------------------- pool chaud
+
+    def start(self):
+        """Démarre le thread qui maintient chaque pool chaud à sa taille cible."""
+        if self._running:
+            return
+        self._running = True
+        self._refill.set()
+        threading.Thread(target=self._refill_loop, name="template-refill", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._refill.set()
+
+    def _refill_loop(self):
+        while self._running:
+            self._refill.wait(config.TEMPLATE_REFILL_INTERVAL)
+            self._refill.clear()
+            if not self._running:
+                break
+            try:
+                self._refill_pass()
+            except Exception:
+                pass
+
+    def _refill_pass(self):
+        """Un passage : complète le pool chaud de chaque template."""
+        with self._lock:
+            templates = list(self._load().values())
+        for template in templates:
+            missing = template["pool_size"] - len(self._warm_disks(template["name"]))
+            for _ in range(max(0, missing)):
+                directory = os.path.join(self.warm_dir, template["name"])
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{uuid.uuid4().hex}.qcow2")
+                # Le .tmp évite de distribuer un overlay en cours de création
+                if self._create_overlay(template, path + ".tmp") is not None:
+                    if os.path.exists(path + ".tmp"):
+                        os.remove(path + ".tmp")
+                    break
+                os.rename(path + ".tmp", path)
+
+    # ---------------------------------------------------------------- interne
+
+    def _create_overlay(self, template, disk_path):
+        cmd = [
+            "qemu-img", "create", "-f", "qcow2",
+            "-F", template["format"], "-b", template["path"], disk_path,
+        ]
+        try:
+            res = subprocess.run(cmd, capture_output=True, text=True)
+        except OSError as e:
+            return f"Impossible de lancer qemu-img : {e.strerror}"
+        if res.returncode != 0:
+            return res.stderr.strip() or "qemu-img create a échoué"
+        return None
+
+    @staticmethod
+    def _copy_image(src, dst):
+        """Copie src en dst (reflink si possible) puis la met en lecture seule ; renvoie l'erreur ou None."""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            res = subprocess.run(["cp", "--reflink=auto", src, dst], capture_output=True, text=True)
+        except OSError as e:
+            return f"Impossible de lancer cp : {e.strerror}"
+        if res.returncode != 0:
+            if os.path.exists(dst):
+                os.remove(dst)
+            return res.stderr.strip() or "cp a échoué"
+        # La copie ne doit plus jamais être modifiée : tous les overlays en dépendent
+        os.chmod(dst, 0o444)
+        return None
+
+    def _warm_disks(self, name):
+        directory = os.path.join(self.warm_dir, name)
+        try:
+            return sorted(
+                os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".qcow2")
+            )
+        except OSError:
+            return []
+
+    def _describe(self, template):
+        # Templates enregistrés avant les pools de VMs pré-démarrées
+        defaults = {"vm_pool_size": 0, "vm_memory": 1024, "vm_vcpus": 1}
+        return {**defaults, **template, "warm": len(self._warm_disks(template["name"]))}
+
+    @staticmethod
+    def _image_format(path):
+        try:
+            res = subprocess.run(
+                ["qemu-img", "info", "--output=json", path], capture_output=True, text=True
+            )
+        except OSError:
+            return None
+        if res.returncode != 0:
+            return None
+        return json.loads(res.stdout).get("format")
+
+    def _load(self):
+        # Appelé avec le verrou tenu
+        if self._templates is None:
+            try:
+                with open(self.registry_path) as f:
+                    self._templates = json.load(f)
+            except FileNotFoundError:
+                self._templates = {}
+        return self._templates
+
+    def _save(self, templates):
+        # Appelé avec le verrou tenu ; écriture atomique
+        os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+        tmp = self.registry_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(templates, f, indent=2)
+        os.replace(tmp, self.registry_path)
+
+
+template_store = TemplateStore()
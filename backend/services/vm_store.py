@@ -0,0 +1,367 @@
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import tuple_
+
+from models.db import Operation, SessionLocal, VmLabel, VmRecord
+from services import inventory_view
+from services import labels as vm_labels
+from services.domain_cache import get_domain_cache
+from services.inventory import registry
+from utils import config
+
+
+# Opérations synchrones de l'API enregistrées dans l'historique -> nom de l'action
+RECORDED_CALLS = {
+    "start_vm": "start",
+    "stop_vm": "stop",
+    "suspend_vm": "suspend",
+    "reboot_vm": "reboot",
+    "delete_vm": "delete",
+    "snapshot_restore": "snapshot_restore",
+    "snapshot_delete": "snapshot_delete",
+    "set_labels": "labels",
+}
+
+# Champs d'une VM dans les résultats de query() (mêmes clés que VmRecord.to_dict)
+_LISTED_COLUMNS = (
+    VmRecord.name, VmRecord.host, VmRecord.state, VmRecord.memory,
+    VmRecord.vcpus, VmRecord.owner, VmRecord.updated_at,
+)
+
+# Durée de conservation d'un propriétaire en attente (VM en création ou en migration)
+_OWNER_TTL = 3600
+
+
+class VmStore:
+    """
+    Index SQL des VMs de tous les hyperviseurs (état, ressources, labels,
+    propriétaire) et historique des opérations.
+
+    libvirt reste la source de vérité : l'index suit les diffs des caches
+    d'événements de chaque hôte et une réconciliation complète (labels compris)
+    a lieu toutes les VMSTORE_RECONCILE secondes. Toutes les écritures passent
+    par un thread dédié : ni le thread d'événements libvirt ni les requêtes
+    n'attendent la base.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._positions = {}       # hôte -> (epoch, seq) du dernier diff appliqué
+        self._watched = {}         # hôte -> (uri, callback)
+        self._owners = {}          # nom -> propriétaire en attente (VM pas encore indexée, ou migrée)
+        self._running = False
+        self.last_reconcile_at = None
+
+    # ---------------------------------------------------------------- lecture
+
+    def query(self, selector=None, owner=None, state=None, host=None, name_prefix=None,
+              cursor=None, limit=50, count=False):
+        """
+        VMs filtrées depuis l'index, triées par (nom, hôte) et paginées par curseur :
+        cursor est le next_cursor de la page précédente (ni OFFSET ni COUNT, le
+        coût d'une page ne dépend pas de sa position). count=True ajoute le total.
+        selector : "env=prod,tier!=db,owner" (voir services.labels).
+        Lève ValueError si le sélecteur ou le curseur est invalide.
+        """
+        terms = vm_labels.parse_selector(selector) if selector else []
+        after = self._decode_cursor(cursor) if cursor else None
+        with SessionLocal() as db:
+            # Colonnes seules (pas d'objets ORM) : la page se construit sans hydratation
+            q = db.query(VmRecord.id, *_LISTED_COLUMNS)
+            for key, op, value in terms:
+                label = db.query(VmLabel.id).filter(VmLabel.vm_id == VmRecord.id, VmLabel.key == key)
+                if op == "=":
+                    q = q.filter(label.filter(VmLabel.value == value).exists())
+                elif op == "!=":
+                    q = q.filter(~label.filter(VmLabel.value == value).exists())
+                else:
+                    q = q.filter(label.exists())
+            if owner is not None:
+                q = q.filter(VmRecord.owner == owner)
+            if state is not None:
+                q = q.filter(VmRecord.state == state)
+            if host is not None:
+                q = q.filter(VmRecord.host == host)
+            if name_prefix:
+                q = q.filter(VmRecord.name.startswith(name_prefix, autoescape=True))
+
+            result = {}
+            if count:
+                result["total"] = q.count()
+            if after is not None:
+                q = q.filter(tuple_(VmRecord.name, VmRecord.host) > tuple_(*after))
+            # Une ligne de plus que la page : dit s'il en reste une suivante
+            rows = q.order_by(VmRecord.name, VmRecord.host).limit(limit + 1).all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = self._encode_cursor(rows[-1])
+
+            vms = {}
+            for row in rows:
+                vms[row.id] = {column.key: getattr(row, column.key) for column in _LISTED_COLUMNS}
+                vms[row.id]["labels"] = {}
+            if vms:
+                labels = db.query(VmLabel.vm_id, VmLabel.key, VmLabel.value).filter(VmLabel.vm_id.in_(vms))
+                for vm_id, key, value in labels:
+                    vms[vm_id]["labels"][key] = value
+            return {"vms": list(vms.values()), "next_cursor": next_cursor, **result}
+
+    @staticmethod
+    def _encode_cursor(row):
+        return inventory_view.encode_cursor(json.dumps([row.name, row.host]))
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            name, host = json.loads(inventory_view.decode_cursor(cursor))
+        except (TypeError, ValueError):
+            raise ValueError("Curseur invalide")
+        if not isinstance(name, str) or not isinstance(host, str):
+            raise ValueError("Curseur invalide")
+        return name, host
+
+    def labels(self, host=None):
+        """{hôte: {vm: labels}} des VMs indexées qui ont au moins un label."""
+        with SessionLocal() as db:
+            q = db.query(VmRecord.host, VmRecord.name, VmLabel.key, VmLabel.value).join(
+                VmLabel, VmLabel.vm_id == VmRecord.id
+            )
+            if host is not None:
+                q = q.filter(VmRecord.host == host)
+            result = {}
+            for vm_host, name, key, value in q:
+                result.setdefault(vm_host, {}).setdefault(name, {})[key] = value
+            return result
+
+    def history(self, vm, limit=50):
+        with SessionLocal() as db:
+            rows = (
+                db.query(Operation)
+                .filter(Operation.vm == vm)
+                .order_by(Operation.created_at.desc())
+                .limit(limit)
+                .all()
+            )
+            return [row.to_dict() for row in rows]
+
+    # -------------------------------------------------------------- écriture
+
+    def record(self, vm, action, status, host=None, detail=None, job_id=None):
+        """Ajoute une entrée à l'historique (asynchrone)."""
+        self._queue.put(("operation", {
+            "vm": vm, "host": host, "action": action, "status": status,
+            "detail": detail, "job_id": job_id, "created_at": time.time(),
+        }))
+
+    def set_owner(self, name, owner, host=None):
+        with SessionLocal() as db:
+            q = db.query(VmRecord).filter(VmRecord.name == name)
+            if host is not None:
+                q = q.filter(VmRecord.host == host)
+            rows = q.all()
+            for row in rows:
+                row.owner = owner
+            db.commit()
+        if not rows:
+            # VM en cours de création : appliqué quand elle apparaîtra dans l'index
+            with self._lock:
+                self._owners[name] = (owner, time.monotonic())
+        return {"message": f"Propriétaire de {name} : {owner}"}
+
+    def record_call(self, operation, args, service, result):
+        """Écouteur d'AsyncLibvirtService : historise les opérations de cycle de vie."""
+        action = RECORDED_CALLS.get(operation)
+        if action is None or not args:
+            return
+        host = registry.get_by_uri(service.uri)
+        failed = isinstance(result, dict) and "error" in result
+        self.record(
+            args[0], action, "failed" if failed else "succeeded",
+            host=host["name"] if host else service.uri,
+            detail=(result.get("error") or result.get("message")) if isinstance(result, dict) else None,
+        )
+        if action == "labels" and not failed and host:
+            self.set_labels(host["name"], args[0], args[1])
+
+    def record_job(self, job):
+        """Écouteur du JobManager : historise les jobs terminés (création, clone, migration...)."""
+        host = registry.get_by_uri(job.hypervisor)
+        self.record(
+            job.target, job.kind, job.state,
+            host=host["name"] if host else job.hypervisor,
+            detail=job.error,
+            job_id=job.id,
+        )
+
+    def set_labels(self, host, name, labels):
+        """Reflète tout de suite dans l'index des labels écrits dans libvirt par l'API."""
+        self._queue.put(("labels", host, name, labels))
+
+    # ------------------------------------------------------------ synchronisation
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._writer, name="vm-store", daemon=True).start()
+        threading.Thread(target=self._reconcile_loop, name="vm-store-reconcile", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._queue.put(("stop",))
+
+    def reconcile(self):
+        """Demande une réconciliation complète de tous les hôtes (labels compris)."""
+        self._queue.put(("reconcile",))
+
+    def _reconcile_loop(self):
+        while self._running:
+            self.reconcile()
+            time.sleep(config.VMSTORE_RECONCILE)
+
+    def _writer(self):
+        while self._running:
+            item = self._queue.get()
+            try:
+                if item[0] == "stop":
+                    break
+                if item[0] == "sync":
+                    self._sync(item[1])
+                elif item[0] == "operation":
+                    with SessionLocal() as db:
+                        db.add(Operation(**item[1]))
+                        db.commit()
+                elif item[0] == "labels":
+                    with SessionLocal() as db:
+                        row = db.query(VmRecord).filter(VmRecord.host == item[1], VmRecord.name == item[2]).first()
+                        if row is not None:
+                            self._replace_labels(row, item[3])
+                            db.commit()
+                elif item[0] == "reconcile":
+                    self._reconcile()
+            except Exception:
+                # Une écriture ratée sera rattrapée par la prochaine réconciliation
+                pass
+
+    def _watch(self, host):
+        name, uri = host["name"], host["uri"]
+        with self._lock:
+            watched = self._watched.get(name)
+            if watched and watched[0] == uri:
+                return
+            if watched:
+                get_domain_cache(watched[0]).unsubscribe(watched[1])
+            callback = lambda: self._queue.put(("sync", name))  # noqa: E731
+            self._watched[name] = (uri, callback)
+            self._positions.pop(name, None)
+        get_domain_cache(uri).subscribe(callback)
+
+    def _sync(self, name):
+        """Applique les diffs du cache de l'hôte depuis la dernière position connue."""
+        with self._lock:
+            watched = self._watched.get(name)
+        if watched is None:
+            return
+        cache = get_domain_cache(watched[0])
+        if not cache.ready:
+            return
+
+        epoch, seq = self._positions.get(name, (None, None))
+        changes = cache.changes_since(seq) if epoch == cache.epoch else None
+        with SessionLocal() as db:
+            if changes is None:
+                # Journal dépassé ou cache redémarré : on repart de l'état complet
+                seq, vms = cache.snapshot()
+                self._replace_host(db, name, vms)
+            else:
+                for seq, diff in changes:
+                    if diff["type"] == "removed":
+                        self._remove(db, name, diff["name"])
+                    else:
+                        self._upsert(db, name, diff["vm"])
+            db.commit()
+        self._positions[name] = (cache.epoch, seq)
+
+    def _reconcile(self):
+        hosts = [h for h in registry.list() if h["enabled"]]
+        for host in hosts:
+            self._watch(host)
+        results = registry.fan_out(lambda host, service: service.list_labels(), hosts)
+        for host in hosts:
+            name = host["name"]
+            cache = get_domain_cache(host["uri"])
+            outcome = results.get(name, {})
+            if not cache.ready or outcome.get("status") != "ok":
+                continue
+            seq, vms = cache.snapshot()
+            with SessionLocal() as db:
+                self._replace_host(db, name, vms, outcome["result"])
+                db.commit()
+            self._positions[name] = (cache.epoch, seq)
+
+        with SessionLocal() as db:
+            known = {h["name"] for h in hosts}
+            db.query(VmRecord).filter(VmRecord.host.notin_(known)).delete(synchronize_session=False)
+            db.commit()
+        with self._lock:
+            expired = time.monotonic() - _OWNER_TTL
+            self._owners = {n: o for n, o in self._owners.items() if o[1] > expired}
+        self.last_reconcile_at = time.time()
+
+    # ---------------------------------------------------------------- interne
+
+    def _replace_host(self, db, host, vms, labels=None):
+        rows = {row.name: row for row in db.query(VmRecord).filter(VmRecord.host == host)}
+        for vm in vms:
+            row = self._upsert(db, host, vm, rows.get(vm["name"]))
+            if labels is not None and vm["name"] in labels:
+                self._replace_labels(row, labels[vm["name"]])
+        present = {vm["name"] for vm in vms}
+        for name, row in rows.items():
+            if name not in present:
+                self._forget(db, row)
+
+    def _upsert(self, db, host, vm, row=None):
+        if row is None:
+            row = db.query(VmRecord).filter(VmRecord.host == host, VmRecord.name == vm["name"]).first()
+        if row is None:
+            with self._lock:
+                owner, _ = self._owners.pop(vm["name"], (None, None))
+            row = VmRecord(host=host, name=vm["name"], owner=owner)
+            db.add(row)
+        row.state = vm["state"]
+        row.memory = vm["memory"]
+        row.vcpus = vm["vcpus"]
+        return row
+
+    def _remove(self, db, host, name):
+        row = db.query(VmRecord).filter(VmRecord.host == host, VmRecord.name == name).first()
+        if row is not None:
+            self._forget(db, row)
+
+    def _forget(self, db, row):
+        if row.owner:
+            # Une VM migrée disparaît d'un hôte avant d'apparaître sur l'autre : elle garde son propriétaire
+            with self._lock:
+                self._owners[row.name] = (row.owner, time.monotonic())
+        db.delete(row)
+
+    @staticmethod
+    def _replace_labels(row, labels):
+        current = {label.key: label for label in row.labels}
+        for key, label in current.items():
+            if key not in labels:
+                row.labels.remove(label)
+            elif label.value != labels[key]:
+                label.value = labels[key]
+        for key, value in labels.items():
+            if key not in current:
+                row.labels.append(VmLabel(key=key, value=value))
+
+
+vm_store = VmStore()
@@ -0,0 +1,229 @@
+"""
+Pool de VMs pré-démarrées par template, distribuées instantanément.
+
+Pour chaque template dont vm_pool_size > 0, le remplisseur garde vm_pool_size
+VMs warm-<template>-<id> créées depuis le template (disque pris dans le pool
+chaud d'overlays), démarrées puis mises en pause après WARM_POOL_BOOT_DELAY
+secondes de démarrage. claim() en reprend une (resume) : pas de démarrage de
+l'OS invité. La VM distribuée garde son nom ; le label warm.template est
+remplacé par template=<template>.
+
+L'appartenance au pool est un label (warm.template) : elle survit à un
+redémarrage de l'orchestrateur. Les VMs en pause ont une horloge en retard à
+la reprise : l'image du template doit la resynchroniser (qemu-guest-agent, NTP).
+"""
+import threading
+import time
+import uuid
+
+import libvirt
+
+from services.libvirt_service import LibvirtService
+from services.template_service import template_store
+from services.vm_store import vm_store
+from utils import config
+
+
+POOL_PREFIX = "warm-"
+POOL_LABEL = "warm.template"
+LABEL_ATTEMPTS = 3   # tentatives de réétiquetage d'une VM distribuée
+
+
+class WarmPool:
+    def __init__(self, service=None):
+        self.service = service or LibvirtService()
+        self._lock = threading.Lock()
+        self._ready = {}        # template -> [VMs en pause, prêtes]
+        self._booting = {}      # VM -> (template, instant du début de son démarrage)
+        self._claimed = set()   # VMs en cours de distribution, peut-être encore étiquetées warm.template
+        self._running = False
+        self._wakeup = threading.Event()
+        self.last_run_at = None
+        self.last_errors = {}
+
+    def status(self):
+        """{template: {"target", "ready": [...], "booting": [...]}}"""
+        targets = {t["name"]: t["vm_pool_size"] for t in template_store.list()}
+        with self._lock:
+            booting = {}
+            for vm, (template, _) in self._booting.items():
+                booting.setdefault(template, []).append(vm)
+            return {
+                name: {
+                    "target": target,
+                    "ready": list(self._ready.get(name, [])),
+                    "booting": sorted(booting.get(name, [])),
+                    "error": self.last_errors.get(name),
+                }
+                for name, target in targets.items()
+                if target or self._ready.get(name) or booting.get(name)
+            }
+
+    def claim(self, template, owner=None, labels=None):
+        """
+        Reprend une VM en pause du pool de template et la donne à owner : {"message", "name"}.
+        La VM perd son label warm.template avant d'être reprise : si le réétiquetage
+        échoue, elle reste dans le pool et claim renvoie une erreur.
+        """
+        while True:
+            with self._lock:
+                ready = self._ready.get(template)
+                if not ready:
+                    return {"error": f"Aucune VM prête dans le pool de {template}"}
+                vm = ready.pop(0)
+                self._claimed.add(vm)
+
+            error = self._relabel(vm, dict(labels or {}, template=template))
+            if error:
+                with self._lock:
+                    self._claimed.discard(vm)
+                    self._ready.setdefault(template, []).insert(0, vm)
+                return {"error": f"Labels non appliqués à {vm} : {error}"}
+            self.refill()   # remplacement immédiat
+
+            result = self.service.resume_vm(vm)
+            if "error" not in result:
+                break
+            # VM disparue ou arrêtée entre deux passages : sans son label, le remplisseur
+            # ne la verrait plus, on la supprime ici
+            self.service.delete_vm(vm)
+
+        if owner:
+            vm_store.set_owner(vm, owner)
+        return {"message": f"VM {vm} prise dans le pool de {template}", "name": vm}
+
+    def _relabel(self, vm, labels):
+        """Remplace les labels de vm (warm.template compris) ; renvoie la dernière erreur ou None."""
+        error = None
+        for attempt in range(LABEL_ATTEMPTS):
+            if attempt:
+                time.sleep(0.2 * attempt)
+            result = self.service.set_labels(vm, labels)
+            if "error" not in result:
+                return None
+            error = result["error"]
+        return error
+
+    # ------------------------------------------------------------ cycle de vie
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wakeup.set()
+        threading.Thread(target=self._loop, name="warm-pool", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def refill(self):
+        """Passage anticipé (template ajouté, modifié ou supprimé)."""
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            self._wakeup.wait(config.WARM_POOL_INTERVAL)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self.run()
+            except Exception:
+                pass
+
+    # ------------------------------------------------------------ remplissage
+
+    def run(self):
+        """Un passage : met en pause les VMs démarrées, supprime les surplus, crée les manquantes."""
+        templates = {t["name"]: t for t in template_store.list()}
+        members = self.service.list_pool_vms(POOL_PREFIX, POOL_LABEL)
+        if "error" in members:
+            self.last_errors = {name: members["error"] for name in templates}
+            return {"error": members["error"]}
+        errors = {}
+        now = time.monotonic()
+
+        ready, booting, doomed = {}, {}, []
+        with self._lock:
+            # Les VMs distribuées perdent leur label : on les oublie quand il a disparu
+            self._claimed &= set(members)
+            for vm, (template, state) in members.items():
+                if vm in self._claimed:
+                    continue
+                if template not in templates or state not in (libvirt.VIR_DOMAIN_RUNNING, libvirt.VIR_DOMAIN_PAUSED):
+                    doomed.append(vm)   # template supprimé, VM arrêtée ou plantée
+                elif state == libvirt.VIR_DOMAIN_PAUSED:
+                    ready.setdefault(template, []).append(vm)
+                else:
+                    # VM découverte au démarrage de l'orchestrateur : on lui laisse le délai complet
+                    started = self._booting.get(vm, (template, now))[1]
+                    booting.setdefault(template, []).append((vm, started))
+            self._booting = {vm: (name, started) for name, vms in booting.items() for vm, started in vms}
+
+            for name, template in templates.items():
+                target = template["vm_pool_size"]
+                pool_ready = sorted(ready.get(name, []))
+                pool_booting = booting.get(name, [])
+                # Surplus (taille réduite) : les VMs en démarrage d'abord
+                excess = len(pool_ready) + len(pool_booting) - target
+                while excess > 0 and pool_booting:
+                    vm, _ = pool_booting.pop()
+                    self._booting.pop(vm, None)
+                    doomed.append(vm)
+                    excess -= 1
+                while excess > 0:
+                    doomed.append(pool_ready.pop())
+                    excess -= 1
+                ready[name] = pool_ready
+                booting[name] = pool_booting
+            self._ready = {name: vms for name, vms in ready.items() if name in templates}
+
+        for vm in doomed:
+            result = self.service.delete_vm(vm)
+            if "error" in result:
+                errors[members[vm][0]] = result["error"]
+
+        for name, template in templates.items():
+            for vm, started in booting.get(name, []):
+                if now - started < config.WARM_POOL_BOOT_DELAY:
+                    continue
+                result = self.service.pause_vm(vm)
+                if "error" in result:
+                    errors[name] = result["error"]
+                    continue
+                with self._lock:
+                    self._booting.pop(vm, None)
+                    self._ready.setdefault(name, []).append(vm)
+
+            with self._lock:
+                still_booting = sum(1 for vm, _ in booting.get(name, []) if vm in self._booting)
+                missing = template["vm_pool_size"] - len(self._ready.get(name, [])) - still_booting
+            for _ in range(max(0, missing)):
+                error = self._create(template)
+                if error:
+                    errors[name] = error
+                    break
+
+        self.last_errors = errors
+        self.last_run_at = time.time()
+        return {"errors": errors}
+
+    def _create(self, template):
+        vm = f"{POOL_PREFIX}{template['name']}-{uuid.uuid4().hex[:8]}"
+        result = self.service.create_vm(
+            vm, memory=template["vm_memory"], template=template["name"], vcpus=template["vm_vcpus"],
+        )
+        if "error" in result:
+            return result["error"]
+        labeled = self.service.set_labels(vm, {POOL_LABEL: template["name"]})
+        if "error" in labeled:
+            # Sans label, la VM sortirait du pool : on ne la garde pas
+            self.service.delete_vm(vm)
+            return labeled["error"]
+        with self._lock:
+            self._booting[vm] = (template["name"], time.monotonic())
+        return None
+
+
+warm_pool = WarmPool()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from schemas.vm_schema import BatchRequest
+from services.batch import TokenBucket, run_batch
+
+
+class FakeAsyncService:
+    """Remplace AsyncLibvirtService : enregistre les appels, échoue pour les VMs "bad-*"."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def call(self, operation, name, *args, service=None, **kwargs):
+        self.calls.append((operation, name, args, kwargs))
+        if name.startswith("bad-"):
+            return {"error": f"{name} introuvable"}
+        return {"message": f"{operation} {name}"}
+
+
+async def collect(generator):
+    return [json.loads(line) async for line in generator]
+
+
+def test_token_bucket_allows_burst_then_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=20, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.take()
+        burst = time.monotonic() - start
+        for _ in range(2):
+            await bucket.take()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.05
+    assert total >= 0.09    # 2 jetons à 20/s
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_token_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate)
+
+
+def test_run_batch_streams_results_and_summary():
+    aservice = FakeAsyncService()
+    lines = asyncio.run(collect(run_batch(
+        aservice, None, "hibernate", ["vm1", "bad-vm", "vm2"], parallel=2, rate=1000,
+    )))
+    results = {line["vm"]: line for line in lines[:-1]}
+    assert results["vm1"]["status"] == "ok"
+    assert results["bad-vm"]["status"] == "error"
+    assert lines[-1]["summary"]["succeeded"] == 2
+    assert lines[-1]["summary"]["failed"] == 1
+    assert all(call[0] == "stop_vm" and call[3] == {"mode": "hibernate"} for call in aservice.calls)
+
+
+def test_run_batch_rejects_invalid_limits():
+    with pytest.raises(ValueError):
+        asyncio.run(collect(run_batch(FakeAsyncService(), None, "start", ["vm1"], rate=-5)))
+    with pytest.raises(ValueError):
+        asyncio.run(collect(run_batch(FakeAsyncService(), None, "start", ["vm1"], parallel=0)))
+
+
+@pytest.mark.parametrize("field", ["rate", "parallel"])
+def test_batch_request_rejects_non_positive_limits(field):
+    with pytest.raises(ValidationError):
+        BatchRequest(action="start", names=["vm1"], **{field: 0})
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip("libvirt")
+
+from services.connection_pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def isAlive(self):
+        return 1 if self.alive else 0
+
+    def unregisterCloseCallback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(max_size):
+    pool = ConnectionPool("test:///default", max_size=max_size, acquire_timeout=1)
+    pool.opened = []
+
+    def open_conn():
+        conn = FakeConnection()
+        pool.opened.append(conn)
+        return conn
+
+    pool._open = open_conn
+    return pool
+
+
+def test_connections_are_shared_round_robin_once_the_pool_is_full():
+    pool = make_pool(2)
+    borrowed = [pool.acquire() for _ in range(6)]
+    assert len(pool.opened) == 2
+    assert {borrowed.count(conn) for conn in pool.opened} == {3}
+    stats = pool.stats()
+    assert stats["in_use"] == 6 and stats["shared"] == 4 and stats["timeouts"] == 0
+
+
+def test_free_connection_is_preferred_to_sharing():
+    pool = make_pool(2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(pool.opened) == 1
+
+
+def test_dead_connection_is_replaced_and_closed_when_returned():
+    pool = make_pool(1)
+    conn = pool.acquire()
+    conn.alive = False
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert not conn.closed      # encore empruntée
+    pool.release(conn)
+    assert conn.closed
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_resize_and_close_wait_for_borrowers():
+    pool = make_pool(2)
+    a, b = pool.acquire(), pool.acquire()
+    pool.release(a)
+    pool.resize(1)
+    assert a.closed and not b.closed
+    pool.close()
+    assert not b.closed
+    pool.release(b)
+    assert b.closed
+    assert pool.stats()["open"] == 0
@@ -0,0 +1,129 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from services import domain_profiles
+from services.domain_profiles import HostTopology
+
+
+def cell(cell_id, first_cpu, hugepages=512):
+    cpus = "".join(
+        f'<cpu id="{cpu}" socket_id="{cell_id}" die_id="0" core_id="{(cpu - first_cpu) // 2}" '
+        f'siblings="{cpu - cpu % 2},{cpu - cpu % 2 + 1}"/>'
+        for cpu in range(first_cpu, first_cpu + 4)
+    )
+    return (
+        f'<cell id="{cell_id}"><memory unit="KiB">8388608</memory>'
+        f'<pages unit="KiB" size="4">1000000</pages><pages unit="KiB" size="2048">{hugepages}</pages>'
+        f'<cpus num="4">{cpus}</cpus></cell>'
+    )
+
+
+# Deux nœuds NUMA de 4 CPUs (2 cœurs x 2 threads), hugepages de 2 Mo
+CAPABILITIES = (
+    "<capabilities><host><topology><cells num='2'>"
+    + cell(0, 0) + cell(1, 4)
+    + "</cells></topology></host></capabilities>"
+)
+
+
+@pytest.fixture
+def topology():
+    return HostTopology(CAPABILITIES)
+
+
+# ------------------------------------------------------------------ resolve
+
+def test_resolve_applies_overrides_and_ignores_none():
+    settings = domain_profiles.resolve("dense", {"vcpus": 4, "iothreads": None})
+    assert settings["profile"] == "dense"
+    assert settings["vcpus"] == 4
+    assert settings["iothreads"] == 0
+    assert settings["cpu_mode"] == "host-model"
+
+
+def test_resolve_defaults_and_topology():
+    settings = domain_profiles.resolve(None, {"vcpus": 4, "sockets": 2})
+    assert settings["profile"] == "default"
+    assert (settings["sockets"], settings["cores"], settings["threads"]) == (2, 2, 1)
+
+
+@pytest.mark.parametrize("profile,overrides", [
+    ("unknown", {}),
+    (None, {"profile": "dense"}),
+    (None, {"memory": 1024}),
+    (None, {"vcpus": 0}),
+    (None, {"disk_io": "native", "disk_cache": "writeback"}),
+    (None, {"vcpus": 4, "sockets": 3}),
+    (None, {"net_queues": "many"}),
+])
+def test_resolve_rejects_invalid(profile, overrides):
+    with pytest.raises(ValueError):
+        domain_profiles.resolve(profile, overrides)
+
+
+# --------------------------------------------------------------------- plan
+
+def test_plan_dedicated_uses_whole_cores_outside_housekeeping(topology):
+    settings = domain_profiles.resolve("latency-sensitive")
+    placement = domain_profiles.plan(topology, settings, 1024, free_pages={0: {2048: 512}, 1: {2048: 512}})
+    assert placement["node"] == 0
+    assert placement["vcpupin"] == ["2", "3"]
+    assert placement["emulatorpin"] == "0-1"
+    assert placement["threads"] == 2
+    assert placement["page_size"] == 2048
+
+
+def test_plan_dedicated_skips_used_cpus(topology):
+    settings = domain_profiles.resolve("latency-sensitive", {"hugepages": False})
+    placement = domain_profiles.plan(topology, settings, 1024, used_cpus={2, 3})
+    assert placement["node"] == 1
+    assert placement["vcpupin"] == ["6", "7"]
+    with pytest.raises(ValueError):
+        domain_profiles.plan(topology, settings, 1024, used_cpus={2, 3, 6, 7})
+
+
+def test_plan_node_follows_free_hugepages(topology):
+    settings = domain_profiles.resolve("throughput")
+    placement = domain_profiles.plan(topology, settings, 1024, free_pages={0: {2048: 100}, 1: {2048: 600}})
+    assert placement["node"] == 1
+    assert placement["vcpupin"] == ["4-7"] * 4
+    with pytest.raises(ValueError):
+        domain_profiles.plan(topology, settings, 1025, free_pages={1: {2048: 600}})
+
+
+def test_plan_node_larger_than_a_node_is_not_pinned(topology):
+    settings = domain_profiles.resolve("throughput", {"vcpus": 8, "hugepages": False})
+    placement = domain_profiles.plan(topology, settings, 1024)
+    assert placement["node"] is None
+    assert placement["notes"]
+
+
+# ------------------------------------------------------------- build_domain
+
+def test_build_domain_default_profile():
+    settings = domain_profiles.resolve(None)
+    root = ET.fromstring(domain_profiles.build_domain("vm", 512, "/img/vm.qcow2", settings, iso_path="/iso/x.iso"))
+    assert root.findtext("vcpu") == "1"
+    assert root.find("cputune") is None and root.find("cpu") is None
+    assert [b.get("dev") for b in root.findall("os/boot")] == ["cdrom", "hd"]
+    assert root.find("devices/disk[@device='cdrom']/source").get("file") == "/iso/x.iso"
+    assert root.find("devices/interface/driver") is None
+
+
+def test_build_domain_pinned_profile(topology):
+    settings = domain_profiles.resolve("latency-sensitive")
+    placement = domain_profiles.plan(topology, settings, 1024, free_pages={0: {2048: 512}})
+    root = ET.fromstring(domain_profiles.build_domain(
+        "vm", 1024, "/img/vm.qcow2", settings, placement, boot_from_disk=True,
+    ))
+    assert [p.get("cpuset") for p in root.findall("cputune/vcpupin")] == ["2", "3"]
+    assert root.find("cputune/emulatorpin").get("cpuset") == "0-1"
+    assert root.find("numatune/memory").get("nodeset") == "0"
+    assert root.find("memoryBacking/hugepages/page").get("size") == "2048"
+    assert root.find("cpu").get("mode") == "host-passthrough"
+    assert root.find("cpu/topology").attrib == {"sockets": "1", "cores": "1", "threads": "2"}
+    driver = root.find("devices/disk/driver")
+    assert (driver.get("cache"), driver.get("io"), driver.get("iothread")) == ("none", "native", "1")
+    assert root.find("devices/interface/driver").get("queues") == "2"
+    assert [b.get("dev") for b in root.findall("os/boot")] == ["hd"]
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+pytest.importorskip("libvirt")
+
+from services.domain_cache import DomainStateCache
+from services.inventory import HypervisorRegistry
+
+
+HOST = {"name": "mort", "uri": "test:///mort", "enabled": True, "timeout": 0.05}
+
+
+def test_fan_out_does_not_pile_up_calls_on_a_hung_host(monkeypatch):
+    registry = HypervisorRegistry()
+    monkeypatch.setattr(registry, "service", lambda name: None)
+    release = threading.Event()
+    calls = []
+
+    def hang(host, service):
+        calls.append(host["name"])
+        release.wait(5)
+        return []
+
+    try:
+        assert registry.fan_out(hang, [HOST])["mort"]["status"] == "timeout"
+        outcome = registry.fan_out(hang, [HOST])["mort"]
+        assert outcome["status"] == "timeout" and "précédent" in outcome["error"]
+        assert calls == ["mort"]
+
+        release.set()
+        registry._inflight["mort"].result(1)
+        assert registry.fan_out(lambda host, service: [], [HOST])["mort"]["status"] == "ok"
+    finally:
+        release.set()
+        registry.shutdown()
+
+
+def test_restarting_the_cache_keeps_a_single_supervisor(monkeypatch):
+    cache = DomainStateCache("test:///cache")
+    connected = threading.Semaphore(0)
+    restarted = threading.Event()
+
+    def connect():
+        cache._disconnected.clear()
+        connected.release()
+
+    monkeypatch.setattr(cache, "_connect", connect)
+    monkeypatch.setattr(cache, "resync", lambda: None)
+    # Le superviseur reste dans son nettoyage tant que start() n'a pas été rappelé
+    monkeypatch.setattr(cache, "_cleanup", lambda: restarted.wait(1))
+
+    cache.start()
+    assert connected.acquire(timeout=1)
+    supervisor = cache._thread
+    cache.stop()
+    cache.start()
+    restarted.set()
+    assert cache._thread is supervisor
+    assert connected.acquire(timeout=1)     # l'ancien superviseur s'est reconnecté
+
+    cache.stop()
+    supervisor.join(1)
+    assert not supervisor.is_alive() and cache._thread is None
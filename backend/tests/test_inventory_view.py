@@ -0,0 +1,55 @@
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+
+from services import inventory_view
+
+
+RUNNING = libvirt.VIR_DOMAIN_RUNNING
+SHUTOFF = libvirt.VIR_DOMAIN_SHUTOFF
+
+
+def make_vms(*specs):
+    vms = [{"name": name, "state": state, "memory": 1024, "vcpus": 1} for name, state in specs]
+    return vms, [vm["name"] for vm in vms]
+
+
+def test_select_pages_with_cursor():
+    vms, names = make_vms(("a", RUNNING), ("b", RUNNING), ("c", RUNNING))
+    page, last = inventory_view.select(vms, names, limit=2)
+    assert [vm["name"] for vm in page] == ["a", "b"]
+    assert last == "b"
+    page, last = inventory_view.select(vms, names, after=last, limit=2)
+    assert [vm["name"] for vm in page] == ["c"]
+    assert last is None
+
+
+def test_select_full_last_page_has_no_cursor():
+    vms, names = make_vms(("a", RUNNING), ("b", RUNNING))
+    assert inventory_view.select(vms, names, limit=2)[1] is None
+
+
+def test_select_filters_prefix_state_and_fields():
+    vms, names = make_vms(("db-1", SHUTOFF), ("web-1", RUNNING), ("web-2", SHUTOFF), ("web-3", RUNNING), ("x", RUNNING))
+    page, last = inventory_view.select(vms, names, state=RUNNING, prefix="web-", fields=("name",))
+    assert page == [{"name": "web-1"}, {"name": "web-3"}]
+    assert last is None
+
+
+def test_cursor_round_trip_and_invalid():
+    cursor = inventory_view.encode_cursor("vm-é/1")
+    assert "=" not in cursor
+    assert inventory_view.decode_cursor(cursor) == "vm-é/1"
+    with pytest.raises(ValueError):
+        inventory_view.decode_cursor("////")
+
+
+def test_parse_fields_and_state():
+    assert inventory_view.parse_fields("name, state,name") == ("name", "state")
+    assert inventory_view.parse_fields("") is None
+    with pytest.raises(ValueError):
+        inventory_view.parse_fields("name,disk")
+    assert inventory_view.parse_state("running") == RUNNING
+    assert inventory_view.parse_state("5") == 5
+    with pytest.raises(ValueError):
+        inventory_view.parse_state("sleeping")
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from services.jobs import CANCELLED, FAILED, PENDING, RUNNING, SUCCEEDED, JobManager
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def blocking(release):
+    def func(job):
+        release.wait(5)
+        return {"message": "ok"}
+    return func
+
+
+def test_job_succeeds_and_notifies_listeners():
+    manager = JobManager(workers=2, per_hypervisor=2, per_storage_pool=2)
+    finished = []
+    manager.add_listener(finished.append)
+    job = manager.submit("create", "vm1", lambda job: {"message": "ok"}, hypervisor="qemu:///system")
+    assert wait_for(lambda: job.state == SUCCEEDED)
+    assert job.progress == 100.0
+    assert wait_for(lambda: finished == [job])
+
+
+def test_error_result_marks_job_failed():
+    manager = JobManager(workers=1, per_hypervisor=1, per_storage_pool=1)
+    job = manager.submit("create", "vm1", lambda job: {"error": "boom"}, hypervisor="h1")
+    assert wait_for(lambda: job.state == FAILED)
+    assert job.error == "boom"
+
+
+def test_per_hypervisor_limit_keeps_jobs_pending():
+    manager = JobManager(workers=4, per_hypervisor=1, per_storage_pool=4)
+    release = threading.Event()
+    first = manager.submit("clone", "a", blocking(release), hypervisor="h1")
+    second = manager.submit("clone", "b", blocking(release), hypervisor="h1")
+    other = manager.submit("clone", "c", blocking(release), hypervisor="h2")
+    assert wait_for(lambda: first.state == RUNNING and other.state == RUNNING)
+    assert second.state == PENDING
+    release.set()
+    assert wait_for(lambda: second.state == SUCCEEDED)
+
+
+def test_storage_pool_limit_is_per_hypervisor():
+    manager = JobManager(workers=4, per_hypervisor=4, per_storage_pool=1)
+    release = threading.Event()
+    a = manager.submit("create", "a", blocking(release), hypervisor="h1", storage_pool="/images")
+    b = manager.submit("create", "b", blocking(release), hypervisor="h1", storage_pool="/images")
+    # Même chemin sur un autre hyperviseur : autre pool de stockage
+    c = manager.submit("create", "c", blocking(release), hypervisor="h2", storage_pool="/images")
+    assert wait_for(lambda: a.state == RUNNING and c.state == RUNNING)
+    assert b.state == PENDING
+    release.set()
+    assert wait_for(lambda: b.state == SUCCEEDED)
+
+
+def test_extra_limits_are_shared_across_hypervisors():
+    manager = JobManager(workers=4, per_hypervisor=4, per_storage_pool=4)
+    release = threading.Event()
+    limits = {"rebalance": 1}
+    a = manager.submit("migrate", "a", blocking(release), hypervisor="h1", limits=limits)
+    b = manager.submit("migrate", "b", blocking(release), hypervisor="h2", limits=limits)
+    free = manager.submit("create", "c", blocking(release), hypervisor="h1")
+    assert wait_for(lambda: a.state == RUNNING and free.state == RUNNING)
+    assert b.state == PENDING
+    release.set()
+    assert wait_for(lambda: b.state == SUCCEEDED)
+
+
+def test_cancel_pending_job():
+    manager = JobManager(workers=1, per_hypervisor=1, per_storage_pool=1)
+    release = threading.Event()
+    running = manager.submit("clone", "a", blocking(release), hypervisor="h1")
+    pending = manager.submit("clone", "b", blocking(release), hypervisor="h1")
+    assert "message" in manager.cancel(pending.id)
+    assert pending.state == CANCELLED
+    release.set()
+    assert wait_for(lambda: running.state == SUCCEEDED)
+    assert pending.state == CANCELLED
+    assert "error" in manager.cancel(pending.id)
+
+
+def test_cancel_running_job_calls_callbacks():
+    manager = JobManager(workers=1, per_hypervisor=1, per_storage_pool=1)
+    stop = threading.Event()
+
+    def func(job):
+        job.on_cancel(stop.set)
+        stop.wait(5)
+        return {"error": "interrompu"}
+
+    job = manager.submit("migrate", "a", func, hypervisor="h1")
+    assert wait_for(lambda: job.state == RUNNING and job._cancel_callbacks)
+    assert "message" in manager.cancel(job.id)
+    assert wait_for(lambda: job.state == CANCELLED)
+
+
+def test_unknown_job_cannot_be_cancelled():
+    assert "error" in JobManager(workers=1).cancel("inconnu")
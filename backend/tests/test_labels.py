@@ -0,0 +1,37 @@
+import pytest
+
+from services import labels
+
+
+def test_parse_selector_terms():
+    assert labels.parse_selector("env=prod, tier!=db,owner") == [
+        ("env", "=", "prod"),
+        ("tier", "!=", "db"),
+        ("owner", "exists", None),
+    ]
+
+
+@pytest.mark.parametrize("selector", ["", " , ", "=prod", "bad key=x"])
+def test_parse_selector_rejects_invalid(selector):
+    with pytest.raises(ValueError):
+        labels.parse_selector(selector)
+
+
+def test_matches():
+    terms = labels.parse_selector("env=prod,tier!=db,owner")
+    assert labels.matches({"env": "prod", "tier": "web", "owner": "alice"}, terms)
+    assert not labels.matches({"env": "prod", "tier": "db", "owner": "alice"}, terms)
+    assert not labels.matches({"env": "prod", "tier": "web"}, terms)
+
+
+def test_validate():
+    labels.validate({"app.kubernetes/name": "web", "env": ""})
+    with pytest.raises(ValueError):
+        labels.validate({"-env": "prod"})
+    with pytest.raises(ValueError):
+        labels.validate({"env": "x" * 256})
+
+
+def test_xml_round_trip():
+    values = {"env": "prod", "team": "a & b"}
+    assert labels.from_xml(labels.to_xml(values)) == values
@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+pytest.importorskip("libvirt")
+
+from services import metrics
+from services.metrics import MetricsCollector, RingSeries
+
+
+def test_ring_series_overwrites_the_oldest_samples():
+    series = RingSeries(3)
+    for t in range(5):
+        series.append(float(t), {"cpu_percent": t * 10})
+    timestamps, values = series.since(0)
+    assert timestamps == [2.0, 3.0, 4.0]
+    assert values["cpu_percent"] == [20, 30, 40]
+    assert values["net_rx_bps"] == [None, None, None]
+    assert series.latest()[0] == 4.0
+
+
+def test_ring_series_since_filters_and_handles_empty():
+    series = RingSeries(4)
+    assert series.latest() is None
+    assert series.since(0) == ([], {m: [] for m in metrics.METRICS})
+    series.append(10.0, {"memory_used_mb": 512})
+    series.append(20.0, {"memory_used_mb": 768})
+    timestamps, values = series.since(15)
+    assert timestamps == [20.0]
+    assert values["memory_used_mb"] == [768]
+
+
+def test_record_computes_rates_and_skips_counter_resets():
+    collector = MetricsCollector(interval=10, retention=100)
+    key = ("h1", "vm")
+    collector._record(key, 100.0, {"vcpus": 2, "cpu_time": 0, "disk_read_bytes": 1000})
+    collector._record(key, 110.0, {"vcpus": 2, "cpu_time": 10 * 1e9, "disk_read_bytes": 6000})
+    _, latest = collector._series[key].latest()
+    assert latest["cpu_percent"] == pytest.approx(50.0)
+    assert latest["disk_read_bps"] == pytest.approx(500.0)
+
+    # VM redémarrée : compteurs revenus à zéro, pas de débit négatif
+    collector._record(key, 120.0, {"vcpus": 2, "cpu_time": 1e9, "disk_read_bytes": 0})
+    _, latest = collector._series[key].latest()
+    assert math.isnan(latest["cpu_percent"])
+    assert math.isnan(latest["disk_read_bps"])
+
+
+@pytest.mark.parametrize("value,seconds", [("300", 300), ("15m", 900), ("1h", 3600), ("2d", 172800)])
+def test_parse_range(value, seconds):
+    assert metrics.parse_range(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["0", "abc", "5w", "-1m"])
+def test_parse_range_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        metrics.parse_range(value)
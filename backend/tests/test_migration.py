@@ -0,0 +1,42 @@
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+
+from services.migration import MigrationMonitor
+
+
+class FakeDomain:
+    def __init__(self):
+        self.iteration = 0
+        self.postcopy = False
+        self.downtime = None
+
+    def name(self):
+        return "vm"
+
+    def jobStats(self):
+        self.iteration += 1
+        return {"type": libvirt.VIR_DOMAIN_JOB_UNBOUNDED, "memory_iteration": self.iteration,
+                "data_total": 100, "data_processed": 50}
+
+    def migrateSetMaxDowntime(self, downtime, flags):
+        self.downtime = downtime
+
+    def migrateStartPostCopy(self, flags):
+        self.postcopy = True
+
+
+def test_monitor_can_be_joined_and_switches_to_postcopy():
+    dom = FakeDomain()
+    monitor = MigrationMonitor(dom, max_downtime=300, postcopy_after=2, interval=0.01)
+    monitor.start()
+    assert monitor.is_alive()
+    for _ in range(500):
+        if monitor.postcopy_started:
+            break
+        monitor.join(0.01)
+    monitor.stop()
+    monitor.join(1)
+    assert not monitor.is_alive()
+    assert dom.postcopy and dom.downtime == 300
+    assert monitor.last_stats["memory_iteration"] >= 2
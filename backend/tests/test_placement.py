@@ -0,0 +1,126 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+libvirt = pytest.importorskip("libvirt")
+
+from models.db import AntiAffinityMember, Base
+from services import placement as placement_module
+from services.placement import HostCapacity, PlacementScheduler
+
+
+def make_host(name, free, total=16384, cpus=8, load=0.0):
+    host = HostCapacity(name, f"qemu+ssh://{name}/system")
+    host.memory_total = total
+    host.cpus = cpus
+    host.load = load
+    host._sampled_free_memory = free
+    host.sampled_at = time.time()
+    host.recompute()
+    return host
+
+
+def make_scheduler(*hosts):
+    scheduler = PlacementScheduler()
+    scheduler._groups = {}
+    scheduler._hosts = {h.name: h for h in hosts}
+    return scheduler
+
+
+def domain(state, memory=1024, vcpus=1):
+    return {"state": state, "memory": memory, "vcpus": vcpus}
+
+
+def test_binpack_fills_the_fullest_host():
+    scheduler = make_scheduler(make_host("a", 2000), make_host("b", 8000))
+    assert scheduler.place("vm", 1024, strategy="binpack")["host"] == "a"
+
+
+def test_spread_picks_the_emptiest_host():
+    scheduler = make_scheduler(make_host("a", 2000), make_host("b", 8000))
+    assert scheduler.place("vm", 1024, strategy="spread")["host"] == "b"
+
+
+def test_least_loaded_picks_the_idlest_host():
+    scheduler = make_scheduler(make_host("a", 8000, load=0.9), make_host("b", 2000, load=0.1))
+    assert scheduler.place("vm", 1024, strategy="least_loaded")["host"] == "b"
+
+
+def test_unknown_strategy_and_no_room():
+    scheduler = make_scheduler(make_host("a", 512))
+    assert "error" in scheduler.place("vm", 256, strategy="random")
+    result = scheduler.place("vm", 1024)
+    assert "Mémoire insuffisante" in result["rejected"]["a"]
+
+
+def test_reservation_counts_until_the_domain_runs():
+    host = make_host("a", 4096)
+    scheduler = make_scheduler(host)
+    placement = scheduler.place("vm", 1024, vcpus=2)
+    assert host.free_memory == 3072 and host.vcpus_allocated == 2
+
+    # Défini mais pas encore démarré : la réservation reste
+    host.vms = {"vm": domain(libvirt.VIR_DOMAIN_SHUTOFF)}
+    scheduler._settle_reservations(host)
+    assert placement["reservation"] in host.reservations
+
+    host.vms = {"vm": domain(libvirt.VIR_DOMAIN_RUNNING, vcpus=2)}
+    scheduler._settle_reservations(host)
+    assert not host.reservations
+    assert host.free_memory == 3072 and host.vcpus_allocated == 2
+
+
+def test_bind_releases_on_failure():
+    host = make_host("a", 4096)
+    scheduler = make_scheduler(host)
+    placement = scheduler.place("vm", 1024)
+    scheduler.bind(placement["reservation"], lambda job: {"error": "boom"})(None)
+    assert not host.reservations
+    assert host.free_memory == 4096
+
+
+def test_bind_success_joins_group_and_settles_stopped_clone(monkeypatch):
+    host = make_host("a", 4096)
+    scheduler = make_scheduler(host)
+    joined = []
+    monkeypatch.setattr(scheduler, "add_to_group", lambda group, vm: joined.append((group, vm)))
+    placement = scheduler.place("clone", 1024, group="web")
+    assert joined == []
+
+    def clone(job):
+        host.vms = {"clone": domain(libvirt.VIR_DOMAIN_SHUTOFF)}
+        return {"message": "ok"}
+
+    scheduler.bind(placement["reservation"], clone)(None)
+    assert joined == [("web", "clone")]
+    assert placement["reservation"] not in host.reservations
+
+
+def test_pending_group_member_blocks_the_host():
+    scheduler = make_scheduler(make_host("a", 8000), make_host("b", 4000))
+    first = scheduler.place("web1", 1024, group="web", strategy="spread")
+    second = scheduler.place("web2", 1024, group="web", strategy="spread")
+    assert first["host"] == "a"
+    assert second["host"] == "b"
+    assert "error" in scheduler.place("web3", 1024, group="web")
+
+
+def test_deleted_vm_leaves_its_groups(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(placement_module, "SessionLocal", sessionmaker(bind=engine, expire_on_commit=False))
+    scheduler = make_scheduler(make_host("a", 8000), make_host("b", 8000))
+    scheduler.add_to_group("web", "web1")
+    scheduler.add_to_group("web", "web2")
+    scheduler.add_to_group("db", "web1")
+
+    scheduler.record_call("delete_vm", ("web1",), None, {"error": "VM introuvable"})
+    assert scheduler.groups() == {"db": ["web1"], "web": ["web1", "web2"]}
+
+    scheduler.record_call("delete_vm", ("web1",), None, {"message": "VM web1 supprimée"})
+    assert scheduler.groups() == {"web": ["web2"]}
+    with placement_module.SessionLocal() as db:
+        assert [(m.group, m.vm) for m in db.query(AntiAffinityMember)] == [("web", "web2")]
@@ -0,0 +1,74 @@
+import os
+import stat
+import threading
+
+import pytest
+
+from services import template_service
+from services.template_service import TemplateStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(template_service.config, "TEMPLATE_DIR", str(tmp_path / "templates"))
+    monkeypatch.setattr(TemplateStore, "_image_format", staticmethod(lambda path: "qcow2"))
+    return TemplateStore(str(tmp_path / "templates" / "templates.json"), str(tmp_path / "warm"))
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "golden.qcow2"
+    path.write_text("image")
+    path.chmod(0o644)
+    return path
+
+
+def test_register_in_place_leaves_the_image_permissions(store, image):
+    result = store.register("golden", str(image))
+    assert result["template"]["path"] == str(image)
+    assert stat.S_IMODE(os.stat(image).st_mode) == 0o644
+
+
+def test_register_copy_makes_a_read_only_copy(store, image, tmp_path):
+    result = store.register("golden", str(image), copy=True)
+    copied = tmp_path / "templates" / "golden.qcow2"
+    assert result["template"]["path"] == str(copied)
+    assert copied.read_text() == "image"
+    assert stat.S_IMODE(os.stat(copied).st_mode) == 0o444
+    assert stat.S_IMODE(os.stat(image).st_mode) == 0o644
+    assert "error" in store.register("golden", str(image), copy=True)
+
+
+def test_failed_overlay_leaves_no_tmp_file(store, image, tmp_path, monkeypatch):
+    store.register("golden", str(image), pool_size=2)
+
+    def failing_overlay(template, disk_path):
+        open(disk_path, "w").close()    # qemu-img interrompu : fichier partiel
+        return "disque plein"
+
+    monkeypatch.setattr(store, "_create_overlay", failing_overlay)
+    store._refill_pass()
+    assert os.listdir(tmp_path / "warm" / "golden") == []
+
+
+def test_refill_loop_survives_a_failing_pass(store, monkeypatch):
+    passes = []
+    done = threading.Event()
+
+    def refill_pass():
+        passes.append(1)
+        if len(passes) == 1:
+            raise OSError("disque plein")
+        done.set()
+
+    monkeypatch.setattr(store, "_refill_pass", refill_pass)
+    store.start()
+    store._refill.set()
+    try:
+        for _ in range(50):
+            if done.wait(0.05):
+                break
+            store._refill.set()
+        assert done.is_set()
+    finally:
+        store.stop()
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+pytest.importorskip("libvirt")
+
+from models.db import Base, VmLabel, VmRecord
+from services import vm_store as vm_store_module
+from services.vm_store import VmStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(vm_store_module, "SessionLocal", session)
+    with session() as db:
+        for i, (host, name) in enumerate([("b", "web1"), ("a", "web1"), ("a", "db1"), ("a", "web2"), ("b", "web3")]):
+            vm = VmRecord(host=host, name=name, state=1, memory=1024, vcpus=1, owner=f"user-{i % 2}")
+            vm.labels = [VmLabel(key="env", value="prod" if i % 2 else "dev")]
+            db.add(vm)
+        db.commit()
+    return VmStore()
+
+
+def walk(store, **params):
+    pages, cursor = [], None
+    while True:
+        result = store.query(cursor=cursor, **params)
+        pages.append([(vm["name"], vm["host"]) for vm in result["vms"]])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_cursor_walks_every_vm_once_in_name_then_host_order(store):
+    assert walk(store, limit=2) == [
+        [("db1", "a"), ("web1", "a")],
+        [("web1", "b"), ("web2", "a")],
+        [("web3", "b")],
+    ]
+    assert walk(store, limit=5) == [[("db1", "a"), ("web1", "a"), ("web1", "b"), ("web2", "a"), ("web3", "b")]]
+
+
+def test_filters_labels_and_optional_total(store):
+    result = store.query(selector="env=prod", limit=1, count=True)
+    assert result["total"] == 2
+    assert result["vms"][0] == {
+        "name": "web1", "host": "a", "state": 1, "memory": 1024, "vcpus": 1, "owner": "user-1",
+        "labels": {"env": "prod"}, "updated_at": result["vms"][0]["updated_at"],
+    }
+    assert "total" not in store.query(owner="user-0")
+    assert walk(store, owner="user-0", limit=1) == [[("db1", "a")], [("web1", "b")], [("web3", "b")]]
+
+
+def test_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        store.query(cursor="pas-un-curseur")
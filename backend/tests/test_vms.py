@@ -0,0 +1,192 @@
+import pytest
+
+libvirt = pytest.importorskip("libvirt")
+
+from services import libvirt_service
+from services.domain_xml import DomainDescription
+from services.libvirt_service import LibvirtService
+
+
+SOURCE_XML = """
+<domain type='kvm'>
+  <name>src</name>
+  <uuid>6f1c1c1e-0000-4000-8000-000000000001</uuid>
+  <memory unit='KiB'>524288</memory>
+  <vcpu>1</vcpu>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='/images/src.qcow2'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+  </devices>
+</domain>
+"""
+
+
+class FakeDomain:
+    def __init__(self, active=False):
+        self.active = active
+
+    def isActive(self):
+        return self.active
+
+    def name(self):
+        return "src"
+
+
+class FakeConnection:
+    def __init__(self, define_error=None):
+        self.define_error = define_error
+        self.defined = []
+
+    def lookupByName(self, name):
+        return FakeDomain()
+
+    def defineXML(self, xml):
+        if self.define_error:
+            raise libvirt.libvirtError(self.define_error)
+        self.defined.append(xml)
+        return object()
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def connect(self, uri):
+        return self.conn
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(libvirt_service.config, "IMAGES_DIR", str(tmp_path))
+    monkeypatch.setattr(libvirt_service.domain_xml, "describe", lambda uri, dom: DomainDescription(SOURCE_XML))
+    service = LibvirtService("test:///default", pool=FakePool(FakeConnection()))
+    service.commands = []
+
+    def run_command(cmd, job=None, on_tick=None):
+        service.commands.append(cmd[0])
+        with open(cmd[-1], "w") as f:
+            f.write("disk")
+        return None
+
+    monkeypatch.setattr(service, "_run_command", run_command)
+    return service
+
+
+@pytest.mark.parametrize("chain,commands", [
+    ([{"filename": "src", "format": "qcow2", "backing": None}], ["cp"]),
+    ([{"filename": "src", "format": "qcow2", "backing": "base"},
+      {"filename": "base", "format": "qcow2", "backing": None}], ["qemu-img"]),
+    ([{"filename": "src", "format": "raw", "backing": None}], ["qemu-img"]),
+])
+def test_copy_disk_reflinks_only_standalone_qcow2(service, monkeypatch, tmp_path, chain, commands):
+    monkeypatch.setattr(libvirt_service.snapshots, "backing_chain", lambda path: chain)
+    assert service._copy_disk("/images/src.qcow2", str(tmp_path / "dst.qcow2")) is None
+    assert service.commands == commands
+
+
+def test_clone_refuses_an_existing_target_disk(service, tmp_path):
+    existing = tmp_path / "dst.qcow2"
+    existing.write_text("autre VM")
+    result = service.clone_vm("src", "dst")
+    assert "existe déjà" in result["error"]
+    assert existing.read_text() == "autre VM"
+    assert service.commands == []
+
+
+def test_clone_removes_the_new_disk_when_define_fails(service, monkeypatch, tmp_path):
+    monkeypatch.setattr(libvirt_service.snapshots, "backing_chain", lambda path: [])
+    service.pool = FakePool(FakeConnection(define_error="nom déjà pris"))
+    result = service.clone_vm("src", "dst")
+    assert "nom déjà pris" in result["error"]
+    assert not (tmp_path / "dst.qcow2").exists()
+
+
+def test_clone_defines_the_copy(service, monkeypatch, tmp_path):
+    monkeypatch.setattr(libvirt_service.snapshots, "backing_chain", lambda path: [])
+    result = service.clone_vm("src", "dst")
+    assert "message" in result
+    defined = DomainDescription(service.pool.conn.defined[0])
+    assert defined.name == "dst" and defined.uuid is None
+    assert defined.primary_disk().path == str(tmp_path / "dst.qcow2")
+
+
+TWO_DISKS_XML = """
+<domain type='kvm'>
+  <name>src</name>
+  <uuid>6f1c1c1e-0000-4000-8000-000000000001</uuid>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='{dir}/vda.snap1'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='{dir}/vdb.snap1'/>
+      <target dev='vdb' bus='virtio'/>
+    </disk>
+  </devices>
+</domain>
+"""
+
+
+class Unsupported(libvirt.libvirtError):
+    def get_error_code(self):
+        return libvirt.VIR_ERR_CONFIG_UNSUPPORTED
+
+
+class FakeSnapshot:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, flags):
+        if not flags:
+            raise Unsupported("suppression des snapshots externes non supportée")
+        self.deleted.append(flags)
+
+
+class StoppedDomain(FakeDomain):
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    def connect(self):
+        return self.conn
+
+    def UUIDString(self):
+        return "6f1c1c1e-0000-4000-8000-000000000001"
+
+
+def test_consolidate_redefines_every_disk_at_once(service, monkeypatch, tmp_path):
+    xml = TWO_DISKS_XML.format(dir=tmp_path)
+    monkeypatch.setattr(libvirt_service.domain_xml, "describe", lambda uri, dom: DomainDescription(xml))
+    chains = {}
+    for dev in ("vda", "vdb"):
+        overlay, base = tmp_path / f"{dev}.snap1", tmp_path / f"{dev}.qcow2"
+        overlay.write_text("overlay")
+        chains[str(overlay)] = [
+            {"filename": str(overlay), "format": "qcow2", "backing": str(base)},
+            {"filename": str(base), "format": "qcow2", "backing": None},
+        ]
+    monkeypatch.setattr(libvirt_service.snapshots, "backing_chain", lambda path: chains[path])
+
+    conn = FakeConnection()
+    snapshot = FakeSnapshot()
+    info = {"name": "snap1", "disks": [
+        {"name": dev, "snapshot": "external", "file": str(tmp_path / f"{dev}.snap1")} for dev in ("vda", "vdb")
+    ]}
+    assert service._consolidate(StoppedDomain(conn), snapshot, info) is None
+
+    assert len(conn.defined) == 1
+    defined = DomainDescription(conn.defined[0])
+    assert {d.target: d.path for d in defined.disks} == {
+        "vda": str(tmp_path / "vda.qcow2"), "vdb": str(tmp_path / "vdb.qcow2"),
+    }
+    assert not (tmp_path / "vda.snap1").exists() and not (tmp_path / "vdb.snap1").exists()
+    assert snapshot.deleted == [libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_METADATA_ONLY]
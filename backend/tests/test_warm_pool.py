@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("libvirt")
+
+from services import warm_pool as warm_pool_module
+from services.warm_pool import POOL_LABEL, WarmPool
+
+
+class FakeService:
+    """Remplace LibvirtService : labels en mémoire, échecs de set_labels programmables."""
+
+    def __init__(self, label_failures=0):
+        self.labels = {}
+        self.label_failures = label_failures
+        self.resumed = []
+
+    def set_labels(self, name, labels):
+        if self.label_failures:
+            self.label_failures -= 1
+            return {"error": "libvirt indisponible"}
+        self.labels[name] = labels
+        return {"message": "ok"}
+
+    def resume_vm(self, name):
+        self.resumed.append(name)
+        return {"message": "ok"}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(warm_pool_module.time, "sleep", lambda seconds: None)
+
+
+def make_pool(service, *vms):
+    pool = WarmPool(service)
+    pool._ready = {"tpl": list(vms)}
+    for vm in vms:
+        service.labels[vm] = {POOL_LABEL: "tpl"}
+    return pool
+
+
+def test_claim_relabels_before_resuming():
+    service = FakeService(label_failures=1)
+    pool = make_pool(service, "warm-tpl-1", "warm-tpl-2")
+    result = pool.claim("tpl", labels={"env": "dev"})
+    assert result["name"] == "warm-tpl-1"
+    assert service.labels["warm-tpl-1"] == {"env": "dev", "template": "tpl"}
+    assert service.resumed == ["warm-tpl-1"]
+    assert pool._ready["tpl"] == ["warm-tpl-2"]
+
+
+def test_claim_keeps_the_vm_in_the_pool_when_relabeling_fails():
+    service = FakeService(label_failures=warm_pool_module.LABEL_ATTEMPTS)
+    pool = make_pool(service, "warm-tpl-1")
+    result = pool.claim("tpl")
+    assert "error" in result
+    assert service.resumed == []
+    assert pool._ready["tpl"] == ["warm-tpl-1"]
+    assert not pool._claimed
+    assert service.labels["warm-tpl-1"] == {POOL_LABEL: "tpl"}
+
+
+def test_claim_on_empty_pool():
+    assert "error" in WarmPool(FakeService()).claim("tpl")
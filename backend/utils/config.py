@@ -0,0 +1,164 @@
+import os
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Hyperviseur par défaut (surchargé par la variable d'environnement)
+LIBVIRT_URI = os.getenv("ORCH_LIBVIRT_URI", "qemu:///system")
+
+# Stockage des disques des VMs
+IMAGES_DIR = os.getenv("ORCH_IMAGES_DIR", "/var/lib/libvirt/images")
+
+# ISO : stockage adressé par contenu + taille des blocs d'écriture des uploads
+ISO_DIR = os.getenv("ORCH_ISO_DIR", "/var/lib/libvirt/iso_uploads")
+ISO_CHUNK_SIZE = _env_int("ORCH_ISO_CHUNK_SIZE", 4 * 1024 * 1024)
+
+# Templates (golden images) : registre + intervalle de vérification des pools chauds
+TEMPLATE_DIR = os.getenv("ORCH_TEMPLATE_DIR", "/var/lib/libvirt/templates")
+TEMPLATE_REFILL_INTERVAL = _env_int("ORCH_TEMPLATE_REFILL_INTERVAL", 30)  # secondes
+# Pool de VMs pré-démarrées et en pause par template (vm_pool_size du template)
+WARM_POOL_INTERVAL = _env_int("ORCH_WARM_POOL_INTERVAL", 30)        # secondes entre deux passages
+WARM_POOL_BOOT_DELAY = _env_int("ORCH_WARM_POOL_BOOT_DELAY", 60)    # secondes de démarrage avant la pause
+
+# Pool de connexions libvirt (par URI)
+POOL_MAX_SIZE = _env_int("ORCH_POOL_MAX_SIZE", 4)   # connexions ouvertes par URI, partagées entre appels
+POOL_ACQUIRE_TIMEOUT = _env_int("ORCH_POOL_ACQUIRE_TIMEOUT", 10)  # secondes (attente d'une première connexion)
+
+# Keepalive libvirt : un ping toutes les N secondes, connexion morte après M pings sans réponse
+KEEPALIVE_INTERVAL = _env_int("ORCH_KEEPALIVE_INTERVAL", 5)
+KEEPALIVE_COUNT = _env_int("ORCH_KEEPALIVE_COUNT", 3)
+
+# Flux d'événements VMs (/vms/events)
+EVENTS_BACKLOG = _env_int("ORCH_EVENTS_BACKLOG", 1000)     # diffs conservés pour la reprise
+EVENTS_HEARTBEAT = _env_int("ORCH_EVENTS_HEARTBEAT", 15)   # secondes
+
+# Opérations libvirt exécutées hors de la boucle asyncio
+LIBVIRT_WORKERS = _env_int("ORCH_LIBVIRT_WORKERS", 16)  # taille du pool de threads dédié
+
+
+def _parse_limits(value):
+    # "stop_vm=4,reboot_vm=2" -> {"stop_vm": 4, "reboot_vm": 2}
+    limits = {}
+    for item in (value or "").split(","):
+        op, _, limit = item.partition("=")
+        if op.strip() and limit.strip().isdigit():
+            limits[op.strip()] = int(limit)
+    return limits
+
+
+# Nombre maximal d'exécutions simultanées par opération (les autres attendent leur tour)
+OPERATION_LIMITS = {
+    "create_vm": 2,
+    "clone_vm": 2,
+    "migrate_vm": 2,
+    "delete_vm": 4,
+    "stop_vm": 8,
+    "reboot_vm": 8,
+    **_parse_limits(os.getenv("ORCH_OPERATION_LIMITS")),
+}
+
+SHUTDOWN_TIMEOUT = _env_int("ORCH_SHUTDOWN_TIMEOUT", 5)  # secondes avant destroy()
+REBOOT_PAUSE = _env_int("ORCH_REBOOT_PAUSE", 0)          # secondes "éteinte" pendant un reboot
+
+# Mise en veille prolongée (stop mode=hibernate) : état mémoire sauvegardé, restauré au start.
+# SAVE_DIR vide : managedSave (emplacement choisi par libvirt, MANAGED_SAVE_DIR pour qemu:///system) ;
+# sinon les images vont dans SAVE_DIR (stockage rapide de l'hyperviseur local)
+SAVE_DIR = os.getenv("ORCH_SAVE_DIR", "")
+MANAGED_SAVE_DIR = os.getenv("ORCH_MANAGED_SAVE_DIR", "/var/lib/libvirt/qemu/save")
+SAVE_BYPASS_CACHE = os.getenv("ORCH_SAVE_BYPASS_CACHE", "1") == "1"  # O_DIRECT : ne pollue pas le cache de l'hôte
+
+# Jobs longs (création, clone, migration, snapshot)
+JOB_WORKERS = _env_int("ORCH_JOB_WORKERS", 8)
+JOBS_PER_HYPERVISOR = _env_int("ORCH_JOBS_PER_HYPERVISOR", 4)
+JOBS_PER_STORAGE_POOL = _env_int("ORCH_JOBS_PER_STORAGE_POOL", 2)
+JOB_HISTORY = _env_int("ORCH_JOB_HISTORY", 500)  # jobs terminés conservés
+
+# Base de données (registre des hyperviseurs...)
+DATABASE_URL = os.getenv("ORCH_DATABASE_URL", "sqlite:///./orchestrateur.db")
+
+# Inventaire multi-hyperviseurs : hôte enregistré au premier démarrage + requêtes groupées
+DEFAULT_HYPERVISOR_NAME = os.getenv("ORCH_DEFAULT_HYPERVISOR_NAME", "local")
+# Hôtes qui voient IMAGES_DIR, TEMPLATE_DIR et ISO_DIR aux mêmes chemins que l'orchestrateur
+# (hôte local, ou stockage partagé NFS/CephFS monté à l'identique) : le disque d'une nouvelle
+# VM est préparé localement, seuls ces hôtes peuvent donc l'accueillir
+SHARED_STORAGE_HOSTS = {DEFAULT_HYPERVISOR_NAME} | {
+    h.strip() for h in os.getenv("ORCH_SHARED_STORAGE_HOSTS", "").split(",") if h.strip()
+}
+FANOUT_WORKERS = _env_int("ORCH_FANOUT_WORKERS", 64)
+FANOUT_TIMEOUT = _env_int("ORCH_FANOUT_TIMEOUT", 5)  # secondes, délai par hôte par défaut
+
+# Placement des VMs sur les hyperviseurs
+PLACEMENT_STRATEGY = os.getenv("ORCH_PLACEMENT_STRATEGY", "binpack")  # binpack, spread, least_loaded
+PLACEMENT_REFRESH = _env_int("ORCH_PLACEMENT_REFRESH", 30)            # secondes entre deux relevés des hôtes
+PLACEMENT_RESERVATION_TTL = _env_int("ORCH_PLACEMENT_RESERVATION_TTL", 600)  # secondes
+VCPU_OVERCOMMIT = _env_float("ORCH_VCPU_OVERCOMMIT", 4.0)   # vCPUs alloués par CPU physique
+HOST_MEMORY_RESERVE = _env_int("ORCH_HOST_MEMORY_RESERVE", 1024)  # Mo laissés à l'hôte
+
+# Rééquilibrage automatique par migration live
+REBALANCE_AUTO = os.getenv("ORCH_REBALANCE_AUTO", "0") == "1"     # sinon : plans à la demande seulement
+REBALANCE_INTERVAL = _env_int("ORCH_REBALANCE_INTERVAL", 60)      # secondes entre deux mesures
+REBALANCE_WINDOW = _env_int("ORCH_REBALANCE_WINDOW", 5)           # mesures moyennées par hôte
+REBALANCE_CPU_THRESHOLD = _env_float("ORCH_REBALANCE_CPU_THRESHOLD", 0.85)
+REBALANCE_MEMORY_THRESHOLD = _env_float("ORCH_REBALANCE_MEMORY_THRESHOLD", 0.90)
+REBALANCE_MARGIN = _env_float("ORCH_REBALANCE_MARGIN", 0.10)      # cible = seuil - marge (hystérésis)
+REBALANCE_COOLDOWN = _env_int("ORCH_REBALANCE_COOLDOWN", 1800)    # secondes avant de redéplacer une VM
+REBALANCE_MAX_MOVES = _env_int("ORCH_REBALANCE_MAX_MOVES", 10)    # migrations max par plan
+REBALANCE_MAX_PARALLEL = _env_int("ORCH_REBALANCE_MAX_PARALLEL", 4)  # migrations simultanées (cluster)
+REBALANCE_PER_HOST = _env_int("ORCH_REBALANCE_PER_HOST", 2)       # migrations simultanées par hôte
+REBALANCE_COPY_STORAGE = os.getenv("ORCH_REBALANCE_COPY_STORAGE", "1") == "1"  # 0 si stockage partagé
+
+# Métriques de performance des VMs (tampons circulaires : RETENTION / INTERVAL mesures par VM)
+METRICS_INTERVAL = _env_int("ORCH_METRICS_INTERVAL", 10)     # secondes entre deux mesures
+METRICS_RETENTION = _env_int("ORCH_METRICS_RETENTION", 3600) # secondes conservées
+
+# Instrumentation (/debug/perf, histogrammes dans /metrics)
+PERF_LIBVIRT = os.getenv("ORCH_PERF_LIBVIRT", "0") == "1"    # mesure de chaque appel RPC libvirt (diagnostic)
+PERF_TRACING = os.getenv("ORCH_PERF_TRACING", "0") == "1"    # traces de toutes les requêtes (sinon en-tête X-Trace: 1)
+PERF_TRACES = _env_int("ORCH_PERF_TRACES", 200)               # traces conservées
+PERF_TRACE_MAX_SPANS = _env_int("ORCH_PERF_TRACE_MAX_SPANS", 500)
+
+# Opérations groupées (POST /vms/batch)
+BATCH_PARALLEL = _env_int("ORCH_BATCH_PARALLEL", 8)          # VMs traitées en même temps (par défaut)
+BATCH_MAX_PARALLEL = _env_int("ORCH_BATCH_MAX_PARALLEL", 32)
+BATCH_RATE = _env_float("ORCH_BATCH_RATE", 5.0)              # opérations lancées par seconde
+BATCH_MAX_RATE = _env_float("ORCH_BATCH_MAX_RATE", 50.0)
+BATCH_BURST = _env_int("ORCH_BATCH_BURST", 10)               # opérations lancées d'un coup au départ
+
+# Index SQL des VMs (labels, propriétaires, historique)
+VMSTORE_RECONCILE = _env_int("ORCH_VMSTORE_RECONCILE", 300)  # secondes entre deux réconciliations complètes
+
+# Cache des descriptions XML analysées des domaines
+DOMAIN_XML_CACHE_SIZE = _env_int("ORCH_DOMAIN_XML_CACHE_SIZE", 1024)  # domaines conservés (LRU)
+
+# Rétention des snapshots (label snapshot.keep=N par VM ; ORCH_SNAPSHOT_KEEP pour les autres, 0 = aucune)
+SNAPSHOT_KEEP = _env_int("ORCH_SNAPSHOT_KEEP", 0)
+SNAPSHOT_PRUNE_INTERVAL = _env_int("ORCH_SNAPSHOT_PRUNE_INTERVAL", 3600)  # secondes entre deux passages
+
+# Équilibrage de la mémoire par virtio-balloon
+BALLOON_AUTO = os.getenv("ORCH_BALLOON_AUTO", "0") == "1"         # sinon : décisions calculées, pas appliquées
+BALLOON_INTERVAL = _env_int("ORCH_BALLOON_INTERVAL", 30)          # secondes entre deux passages
+BALLOON_STATS_PERIOD = _env_int("ORCH_BALLOON_STATS_PERIOD", 10)  # période des statistiques du pilote balloon
+BALLOON_HEADROOM = _env_float("ORCH_BALLOON_HEADROOM", 0.25)      # marge au-dessus de la mémoire utilisée
+BALLOON_MIN_RATIO = _env_float("ORCH_BALLOON_MIN_RATIO", 0.25)    # plancher par défaut (fraction de <memory>)
+BALLOON_MIN_MB = _env_int("ORCH_BALLOON_MIN_MB", 256)
+BALLOON_STEP = _env_int("ORCH_BALLOON_STEP", 512)                 # Mo repris au plus par passage
+BALLOON_MIN_CHANGE = _env_int("ORCH_BALLOON_MIN_CHANGE", 64)      # Mo : en dessous, pas de changement
+
+# Proxy WebSocket -> VNC des consoles (/vms/{name}/console/ws)
+CONSOLE_MAX_SESSIONS = _env_int("ORCH_CONSOLE_MAX_SESSIONS", 500)      # consoles ouvertes en même temps
+CONSOLE_IDLE_TIMEOUT = _env_int("ORCH_CONSOLE_IDLE_TIMEOUT", 900)      # secondes sans trafic avant fermeture
+CONSOLE_RATE_KB = _env_int("ORCH_CONSOLE_RATE_KB", 0)                  # Kio/s par session et par sens (0 = illimité)
+CONSOLE_CHUNK = _env_int("ORCH_CONSOLE_CHUNK", 65536)                  # octets lus au plus par relais
+CONSOLE_CONNECT_TIMEOUT = _env_int("ORCH_CONSOLE_CONNECT_TIMEOUT", 5)  # secondes pour joindre le serveur VNC
@@ -3,8 +3,11 @@ function HypervisorList({ hypervisors }) {
     <div className="mb-6">
       <h2 className="text-xl font-semibold mb-2">Hyperviseurs</h2>
       <ul>
-        {hypervisors.map((h, i) => (
-          <li key={i} className="bg-gray-100 p-2 rounded mb-1">{h}</li>
+        {hypervisors.map((h) => (
+          <li key={h.name} className="bg-gray-100 p-2 rounded mb-1">
+            <span className="font-semibold">{h.name}</span> — {h.uri}
+            {!h.enabled && <span className="text-gray-500"> (désactivé)</span>}
+          </li>
         ))}
       </ul>
     </div>
@@ -20,9 +20,9 @@ function VMList({
       <h2 className="text-2xl font-bold mb-4">Machines Virtuelles</h2>
 
       <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-5">
-        {vms.map((vm, i) => (
+        {vms.map((vm) => (
           <VMCard
-            key={i}
+            key={vm.name}
             vm={vm}
             onDelete={onDelete}
             onMigrate={onMigrate}
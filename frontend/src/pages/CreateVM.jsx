@@ -1,21 +1,37 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import api from "../services/api";
 
 function CreateVM({ onCreated }) {
   const [name, setName] = useState("");
   const [diskSize, setDiskSize] = useState(10);
   const [memory, setMemory] = useState(512); // le backend met 512 par défaut si non fourni
+  const [vcpus, setVcpus] = useState(1);
   const [isoFile, setIsoFile] = useState(null);
+  const [template, setTemplate] = useState("");
+  const [templates, setTemplates] = useState([]);
+  const [isoId, setIsoId] = useState("");
+  const [isos, setIsos] = useState([]);
   const [loading, setLoading] = useState(false);
 
+  useEffect(() => {
+    api
+      .get("/templates/")
+      .then((res) => setTemplates(res?.data?.templates || []))
+      .catch((err) => console.error(err));
+    api
+      .get("/isos/")
+      .then((res) => setIsos(res?.data?.isos || []))
+      .catch((err) => console.error(err));
+  }, []);
+
   const handleCreate = async () => {
     if (!name) {
       return alert("Nom de la VM requis");
     }
-    if (!isoFile) {
-      return alert("ISO requis pour créer la VM");
+    if (!isoFile && !isoId && !template) {
+      return alert("ISO ou template requis pour créer la VM");
     }
-    if (diskSize < 5) {
+    if (!template && diskSize < 5) {
       const confirmSmallDisk = window.confirm(
         "Moins de 5 Go, c'est très peu pour un OS. Continuer quand même ?"
       );
@@ -25,7 +41,15 @@ function CreateVM({ onCreated }) {
     const formData = new FormData();
     formData.append("name", name);
     formData.append("disk_size", diskSize);
-    formData.append("iso", isoFile);
+    formData.append("vcpus", vcpus);
+    if (template) {
+      formData.append("template", template);
+    } else if (isoId) {
+      // ISO déjà sur le serveur : pas de nouvel upload
+      formData.append("iso_id", isoId);
+    } else {
+      formData.append("iso", isoFile);
+    }
     // memory est optionnel, mais on l'envoie quand même
     if (memory) {
       formData.append("memory", memory);
@@ -47,6 +71,8 @@ function CreateVM({ onCreated }) {
       setDiskSize(10);
       setMemory(512);
       setIsoFile(null);
+      setTemplate("");
+      setIsoId("");
 
       if (onCreated) {
         onCreated(); // rafraîchit la liste dans le Dashboard
@@ -102,13 +128,58 @@ function CreateVM({ onCreated }) {
         </p>
       </div>
 
+      <div className="mb-2">
+        <label className="block text-sm mb-1">vCPUs</label>
+        <input
+          type="number"
+          value={vcpus}
+          min={1}
+          onChange={(e) => setVcpus(Number(e.target.value))}
+          className="border p-2 rounded w-32"
+        />
+      </div>
+
+      <div className="mb-2">
+        <label className="block text-sm mb-1">Template (optionnel)</label>
+        <select
+          value={template}
+          onChange={(e) => setTemplate(e.target.value)}
+          className="border p-2 rounded w-full"
+        >
+          <option value="">Aucun (installation depuis une ISO)</option>
+          {templates.map((t) => (
+            <option key={t.name} value={t.name}>
+              {t.name} {t.warm ? `(${t.warm} prêts)` : ""}
+            </option>
+          ))}
+        </select>
+      </div>
+
+      <div className="mb-2">
+        <label className="block text-sm mb-1">ISO déjà envoyée</label>
+        <select
+          value={isoId}
+          onChange={(e) => setIsoId(e.target.value)}
+          disabled={!!template}
+          className="border p-2 rounded w-full disabled:opacity-50"
+        >
+          <option value="">Aucune (envoyer un fichier)</option>
+          {isos.map((iso) => (
+            <option key={iso.sha256} value={iso.sha256}>
+              {iso.names[0] || iso.sha256.slice(0, 12)} ({Math.round(iso.size / 1048576)} Mo)
+            </option>
+          ))}
+        </select>
+      </div>
+
       <div className="mb-2">
         <label className="block text-sm mb-1">Fichier ISO</label>
         <input
           type="file"
           accept=".iso"
           onChange={(e) => setIsoFile(e.target.files[0])}
-          className="border p-2 rounded w-full"
+          disabled={!!template || !!isoId}
+          className="border p-2 rounded w-full disabled:opacity-50"
         />
       </div>
 
@@ -4,16 +4,22 @@ import VMList from "../components/VMList";
 import HypervisorList from "../components/HypervisorList";
 import CreateVM from "./CreateVM";
 
+// Applique un diff du flux /vms/events à la liste (triée par nom)
+const applyDiff = (vms, diff) => {
+  if (diff.type === "removed") {
+    return vms.filter((vm) => vm.name !== diff.name);
+  }
+  const others = vms.filter((vm) => vm.name !== diff.vm.name);
+  return [...others, diff.vm].sort((a, b) => a.name.localeCompare(b.name));
+};
+
 function Dashboard() {
   const [vms, setVms] = useState([]);
   const [hypervisors, setHypervisors] = useState([]);
-  const [actionInProgress, setActionInProgress] = useState(false);
 
-  const fetchData = async () => {
+  const fetchHypervisors = async () => {
     try {
-      const vmsRes = await api.get("/vms/");
       const hypervisorsRes = await api.get("/hypervisors/");
-      setVms(vmsRes?.data || []);
       setHypervisors(hypervisorsRes?.data?.hypervisors || []);
     } catch (err) {
       console.error(err);
@@ -21,12 +27,20 @@ function Dashboard() {
   };
 
   useEffect(() => {
-    if (actionInProgress) return; // stop polling during actions
+    fetchHypervisors();
+
+    // Flux SSE : snapshot initial puis diffs. En cas de coupure, EventSource
+    // se reconnecte seul et renvoie Last-Event-ID : seuls les diffs manqués sont rejoués.
+    const source = new EventSource(`${api.defaults.baseURL}/vms/events`);
+    source.addEventListener("snapshot", (e) => setVms(JSON.parse(e.data).vms));
+    source.addEventListener("diff", (e) => {
+      const diff = JSON.parse(e.data);
+      setVms((prev) => applyDiff(prev, diff));
+    });
+    source.onerror = (err) => console.error(err);
 
-    fetchData();
-    const interval = setInterval(fetchData, 3000);
-    return () => clearInterval(interval);
-  }, [actionInProgress]);
+    return () => source.close();
+  }, []);
 
   /* ---------------- SNAPSHOT ACTIONS ---------------- */
 
@@ -34,65 +48,54 @@ function Dashboard() {
     const snap = prompt("Nom du snapshot ?");
     if (!snap) return;
 
-    setActionInProgress(true);
     try {
       const form = new FormData();
       form.append("snapshot_name", snap);
 
       const res = await api.post(`/vms/${vmName}/snapshot/create`, form);
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   const handleSnapshotList = async (vmName) => {
-    setActionInProgress(true);
     try {
       const res = await api.get(`/vms/${vmName}/snapshot/list`);
       alert("Snapshots : " + res.data.snapshots.join(", "));
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   const handleSnapshotRestore = async (vmName) => {
     const snap = prompt("Snapshot à restaurer ?");
     if (!snap) return;
 
-    setActionInProgress(true);
     try {
       const form = new FormData();
       form.append("snapshot_name", snap);
 
       const res = await api.post(`/vms/${vmName}/snapshot/restore`, form);
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   const handleSnapshotDelete = async (vmName) => {
     const snap = prompt("Snapshot à supprimer ?");
     if (!snap) return;
 
-    setActionInProgress(true);
     try {
       const form = new FormData();
       form.append("snapshot_name", snap);
 
       const res = await api.post(`/vms/${vmName}/snapshot/delete`, form);
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   /* ---------------------- BASIC ACTIONS ---------------------- */
@@ -100,32 +103,25 @@ function Dashboard() {
   const handleDelete = async (name) => {
     if (!window.confirm(`Supprimer ${name} ?`)) return;
 
-    setActionInProgress(true);
     try {
       await api.delete(`/vms/delete/${name}`);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.error || err.message);
     }
-    setActionInProgress(false);
   };
 
   const handleAction = async (vmName, action) => {
-    setActionInProgress(true);
     try {
       const res = await api.post(`/vms/${vmName}/${action}`);
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.error || err.message);
     }
-    setActionInProgress(false);
   };
 
   const handleReboot = (vmName) => handleAction(vmName, "reboot");
 
   const handleConsole = async (vmName) => {
-    setActionInProgress(true);
     try {
       const res = await api.get(`/vms/${vmName}/console`);
       if (!res?.data?.uri) alert("URI console introuvable");
@@ -133,7 +129,6 @@ function Dashboard() {
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   /* ---------------------- CLONE ---------------------- */
@@ -142,19 +137,24 @@ function Dashboard() {
     const target = prompt("Nom de la VM clonée :");
     if (!target) return;
 
-    setActionInProgress(true);
+    // Clone lié : overlay qcow2 sur le disque figé de la source (quasi instantané)
+    const linked = window.confirm(
+      "Clone lié (instantané, le disque de la source est figé par un snapshot) ?\n" +
+      "Annuler = copie complète du disque."
+    );
+
     try {
       const form = new FormData();
       form.append("source", sourceName);
       form.append("target", target);
+      form.append("mode", linked ? "linked" : "full");
+      if (linked) form.append("base_snapshot", "true");
 
       const res = await api.post("/vms/clone", form);
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.detail || err.message);
     }
-    setActionInProgress(false);
   };
 
   /* --------------------- MIGRATE --------------------- */
@@ -163,18 +163,15 @@ function Dashboard() {
     const dest = prompt("IP destination ?");
     if (!dest) return;
 
-    setActionInProgress(true);
     try {
       const uri = `qemu+ssh://user@${dest}/system`;
       const res = await api.post(`/vms/migrate/${name}`, null, {
         params: { destination: uri },
       });
       alert(res.data.message);
-      await fetchData();
     } catch (err) {
       alert(err?.response?.data?.error || err.message);
     }
-    setActionInProgress(false);
   };
 
   return (
@@ -183,7 +180,7 @@ function Dashboard() {
 
       <HypervisorList hypervisors={hypervisors} />
 
-      <CreateVM onCreated={fetchData} />
+      <CreateVM />
 
       <VMList
         vms={vms}